@@ -1,10 +1,18 @@
 # consumers.py
+import asyncio
+import logging
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.middleware.csrf import CsrfViewMiddleware
 from django.http.request import HttpRequest
 from channels.exceptions import DenyConnection
 import json
 
+logger = logging.getLogger(__name__)
+
 class CSRFAuthMiddleware:
     def __init__(self, app):
         self.app = app
@@ -68,4 +76,116 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'type': 'error',
             'code': code,
             'message': message
-        }))
\ No newline at end of file
+        }))
+
+class ScannerConsumer(AsyncWebsocketConsumer):
+    """
+    Persistent gate scanner connection for one event: ``ws/scanner/<event_id>/``.
+
+    Scanners send ``{"id": ..., "code": "<scanned payload>"}`` for every scan
+    without waiting for the previous verdict. Scans that arrive while a
+    validation is running are validated together with one
+    ``validation.validate_codes`` call, and each comes back as
+    ``{"type": "verdict", "id": ..., ...}`` with the same fields as
+    ``validate_ticket_api``. At most ``SCANNER_MAX_IN_FLIGHT`` scans are
+    pending per connection; past that the connection stops reading until
+    verdicts go out. After every batch that admits someone, all scanners on
+    the event receive ``{"type": "totals", ...}``. Scans are logged with the
+    gate named by ``?gate=`` in the connection URL.
+    """
+
+    async def connect(self):
+        self.event_id = int(self.scope['url_route']['kwargs']['event_id'])
+        self.group_name = f'scanner-event-{self.event_id}'
+        self.gate = parse_qs(self.scope.get('query_string', b'').decode()).get('gate', [''])[0][:100]
+        self.pending = []
+        self.worker = None
+        self.slots = asyncio.Semaphore(getattr(settings, 'SCANNER_MAX_IN_FLIGHT', 64))
+
+        user = self.scope.get('user')
+        if not user or not user.is_authenticated or not await self.is_staff(user):
+            await self.close(code=4003)
+            return
+        totals = await self.totals()
+        if totals is None:
+            await self.close(code=4004)
+            return
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await self.send(text_data=json.dumps({'type': 'connection_success', 'totals': totals}))
+
+    async def disconnect(self, close_code):
+        if self.worker is not None:
+            self.worker.cancel()
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+            code = data['code']
+        except (json.JSONDecodeError, KeyError, TypeError):
+            await self.send_error('Expected {"id": ..., "code": "..."}', 4001)
+            return
+        if not isinstance(code, str) or not code:
+            await self.send_error('No ticket code provided', 4002)
+            return
+
+        await self.slots.acquire()
+        self.pending.append((data.get('id'), code))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self.drain())
+
+    async def drain(self):
+        from tickets.validation import MAX_BATCH_SIZE
+
+        while self.pending:
+            batch = self.pending[:MAX_BATCH_SIZE]
+            del self.pending[:len(batch)]
+            try:
+                verdicts = await self.validate([code for _, code in batch])
+            except Exception:
+                logger.exception(f"Scanner validation failed for Event ID: {self.event_id}")
+                verdicts = [{'status': 'error', 'message': 'Validation failed, please scan again',
+                             'audio_feedback': 'error'}] * len(batch)
+            for (scan_id, _), verdict in zip(batch, verdicts):
+                await self.send(text_data=json.dumps({'type': 'verdict', 'id': scan_id, **verdict}))
+                self.slots.release()
+            if any(verdict.get('ticket', {}).get('is_valid') for verdict in verdicts):
+                await self.channel_layer.group_send(self.group_name, {
+                    'type': 'checkin.totals', 'totals': await self.totals()
+                })
+
+    async def checkin_totals(self, event):
+        await self.send(text_data=json.dumps({'type': 'totals', **event['totals']}))
+
+    async def send_error(self, message, code=4000):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'code': code,
+            'message': message
+        }))
+
+    @database_sync_to_async
+    def is_staff(self, user):
+        from tickets.views import is_staff
+        return is_staff(user)
+
+    @database_sync_to_async
+    def validate(self, codes):
+        from tickets import validation
+        return validation.validate_codes(codes, event_id=self.event_id, source='socket',
+                                         scanned_by=self.scope['user'], gate=self.gate)
+
+    @database_sync_to_async
+    def totals(self):
+        from tickets.models import Event
+
+        counts = Event.objects.filter(pk=self.event_id).values('sold_count', 'used_count').first()
+        if counts is None:
+            return None
+        return {
+            'checked_in': counts['used_count'],
+            'sold': counts['sold_count'],
+            'remaining': counts['sold_count'] - counts['used_count'],
+        }
@@ -1,7 +1,8 @@
 # ticket_system/routing.py
 from django.urls import path
-from .consumers import ChatConsumer
+from .consumers import ChatConsumer, ScannerConsumer
 
 websocket_urlpatterns = [
     path('ws/chat/', ChatConsumer.as_asgi()),
+    path('ws/scanner/<int:event_id>/', ScannerConsumer.as_asgi()),
 ]
\ No newline at end of file
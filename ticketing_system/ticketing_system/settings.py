@@ -124,6 +124,81 @@ AUTH_PASSWORD_VALIDATORS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Caches
+# Swap 'default' for django.core.cache.backends.redis.RedisCache when running
+# more than one worker so that cached state is shared between processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered QR images (see tickets/qr.py), bounded by MAX_ENTRIES
+    'qr_codes': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'qr_codes',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+# QR images are rendered on demand by the ticket_qr view. Set to True to also
+# render and store a PNG for every new ticket when it is saved.
+TICKET_EAGER_QR_CODES = False
+
+# Signed QR payloads (see tickets/qr_signing.py). To rotate, add a new key
+# version, make it current, and remove the old one once its tickets are gone.
+TICKET_QR_KEYS = {1: os.getenv('TICKET_QR_KEY', SECRET_KEY)}
+TICKET_QR_KEY_VERSION = 1
+TICKET_QR_GRACE_HOURS = 24  # Codes stay valid this long after the event starts
+TICKET_QR_ACCEPT_LEGACY = True  # Still accept unsigned "Ticket ID: X, Code: Y" payloads
+
+# Gate workers keep an event's tickets in memory from this many hours before it
+# starts (see tickets/gate_cache.py) and check for changes made elsewhere at
+# most this often
+GATE_CACHE_DOORS_OPEN_HOURS = 3
+GATE_CACHE_CHECK_SECONDS = 1.0
+
+# How far ahead of the server an offline scanner's clock may run before its
+# check-ins are refused (see record_offline_scans in tickets/manifests.py)
+OFFLINE_SCAN_CLOCK_SKEW_SECONDS = 300
+
+# Scans a gate scanner WebSocket may have pending before the server stops
+# reading from it (see ScannerConsumer in ticketing_system/consumers.py)
+SCANNER_MAX_IN_FLIGHT = 64
+
+# Scan history (see tickets/scan_log.py). Scans are buffered in each process
+# and written in bulk by a background thread.
+SCAN_LOG = {
+    'ENABLED': os.getenv('SCAN_LOG_ENABLED', 'True') == 'True',
+    'FLUSH_SIZE': 500,
+    'FLUSH_SECONDS': 2.0,
+    'MAX_BUFFER': 50000,
+}
+
+# Longest a stats snapshot (see tickets/stats.py) is served from the cache.
+# Changes replace snapshots right away; this only bounds changes nothing
+# reports, such as tokens expiring.
+STATS_SNAPSHOT_TTL = 300
+
+# Longest the active announcement feed (see tickets/announcements.py) is cached;
+# saves, deletes and the earliest valid_until already refresh it
+ANNOUNCEMENT_FEED_TTL = 3600
+
+# How long responses to requests carrying an Idempotency-Key header are kept
+# for replay (see tickets/idempotency.py)
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+
+# How long a ticket hold lasts before `manage.py sweep_holds` releases it
+TICKET_HOLD_SECONDS = 300
+
+# Flash sale waiting room (see tickets/waiting_room.py). When enabled, buyers
+# must be admitted from the queue before purchase_ticket accepts them. Needs a
+# cache shared by all worker processes in production.
+WAITING_ROOM = {
+    'ENABLED': os.getenv('WAITING_ROOM_ENABLED', 'False') == 'True',
+    'RATE': 5.0,    # admissions per second
+    'BURST': 20,
+    'PASS_TTL': 600,
+}
+
 # Chatbot settings
 CHATBOT_MODEL_PATH = r"C:\Users\lamso\OneDrive\Documents\Ticketapp\ticketing_system\models\cache\models--EleutherAI--gpt-j-6B\snapshots\47e169305d2e8376be1d31e765533382721b2cc1"
 # Internationalization
@@ -1,7 +1,20 @@
 from django.contrib import admin
+from . import ledger
 from .models import Event, Ticket,Profile
 
+
+class ProfileAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Profile.save never writes credits, so an edited balance is posted to the ledger
+        if change and 'credits' in form.changed_data:
+            stored = Profile.objects.filter(pk=obj.pk).values_list('credits', flat=True).get()
+            if obj.credits > stored:
+                ledger.credit(obj.user, obj.credits - stored, 'ADJUSTMENT_CREDIT')
+            elif obj.credits < stored:
+                ledger.debit(obj.user, stored - obj.credits, 'ADJUSTMENT_DEBIT')
+
+
 admin.site.register(Event)
 admin.site.register(Ticket)
-admin.site.register(Profile)
-
+admin.site.register(Profile, ProfileAdmin)
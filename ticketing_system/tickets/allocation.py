@@ -0,0 +1,135 @@
+"""
+Ticket allocation for purchases.
+
+Concurrent buyers must be handed different AVAILABLE tickets without queueing
+behind a lock on the same row. On databases that support it (PostgreSQL,
+MySQL 8, Oracle) candidate rows are locked with ``SELECT ... FOR UPDATE SKIP
+LOCKED``, so each buyer skips rows another transaction is holding. Elsewhere
+(SQLite) each buyer starts from a random point in the event's ticket id range
+and claims candidates with a conditional UPDATE (``... WHERE status =
+'AVAILABLE'``); a buyer that loses a race simply retries with other rows.
+Because SQLite only allows one writer, purchases for the same event are also
+queued in-process with ``purchase_slot`` so threads wait their turn instead of
+failing with "database is locked".
+
+Either way the final UPDATE only touches rows that are still AVAILABLE, so a
+ticket can never be sold twice.
+
+The inventory counters live on the single ``Event`` row, and updating them
+locks that row until commit. A purchase therefore passes ``record=False`` and
+records the move itself as the last statement of its transaction, so buyers
+of the event only queue on the counter UPDATE, not on each other's profile
+lock and ledger writes.
+"""
+import logging
+import random
+import threading
+from contextlib import nullcontext
+
+from django.db import connection
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .inventory import record_transition
+from .models import Ticket
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+CANDIDATE_FACTOR = 4  # rows read per ticket wanted, so losing a few races still fills the order
+
+LOCK_STRIPES = 64
+# A fixed set of locks shared out by event id, so nothing grows with the number of events
+_event_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def purchase_slot(event_id):
+    """
+    Context manager to wrap a purchase transaction in. It is a no-op where the
+    database can skip locked rows; otherwise purchases for one event are
+    queued within this process (events sharing a lock stripe queue together).
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        return nullcontext()
+    return _event_locks[int(event_id) % LOCK_STRIPES]
+
+
+def allocate_tickets(event, user, quantity=1, hold_until=None, record=True):
+    """
+    Assign up to ``quantity`` AVAILABLE tickets of ``event`` to ``user`` as
+    PURCHASED, or as HELD until ``hold_until`` when it is given. Must be called
+    inside a transaction. Returns the claimed ids, which may be fewer than
+    requested if the event is (nearly) sold out. With ``record=False`` the
+    caller reports the move with ``inventory.record_transition`` before commit.
+    """
+    now = timezone.now()
+    if hold_until is None:
+        changes = {'status': 'PURCHASED', 'purchased_at': now}
+    else:
+        changes = {'status': 'HELD', 'hold_expires_at': hold_until}
+    changes.update(user=user, last_modified=now)
+
+    if connection.features.has_select_for_update_skip_locked:
+        claimed = _allocate_skip_locked(event, quantity, changes)
+    else:
+        claimed = _allocate_optimistic(event, quantity, changes)
+
+    if claimed and record:
+        record_transition(event.id, 'AVAILABLE', changes['status'], count=len(claimed))
+    return claimed
+
+
+def _claim(ids, changes):
+    return Ticket.objects.filter(id__in=ids, status='AVAILABLE').update(**changes)
+
+
+def _allocate_skip_locked(event, quantity, changes):
+    ids = list(
+        Ticket.objects.select_for_update(skip_locked=True)
+        .filter(event=event, status='AVAILABLE')
+        .values_list('id', flat=True)[:quantity]
+    )
+    if ids:
+        _claim(ids, changes)
+    return ids
+
+
+def _allocate_optimistic(event, quantity, changes):
+    bounds = Ticket.objects.filter(event=event).aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return []
+
+    available = Ticket.objects.filter(event=event, status='AVAILABLE')
+    claimed = []
+    for attempt in range(MAX_ATTEMPTS):
+        wanted = quantity - len(claimed)
+        if not wanted:
+            break
+        # Spread buyers over the id range; the last attempt scans from the start
+        # so a nearly sold out event still finds its remaining tickets.
+        pivot = random.randint(bounds['low'], bounds['high']) if attempt < MAX_ATTEMPTS - 1 else bounds['low']
+        candidates = list(
+            available.filter(id__gte=pivot).order_by('id').values_list('id', flat=True)[:wanted * CANDIDATE_FACTOR]
+        )
+        if len(candidates) < wanted and pivot > bounds['low']:
+            candidates += list(
+                available.filter(id__lt=pivot).order_by('id').values_list('id', flat=True)[:wanted * CANDIDATE_FACTOR]
+            )
+        if not candidates:
+            break
+
+        while candidates and len(claimed) < quantity:
+            wanted = quantity - len(claimed)
+            batch, candidates = candidates[:wanted], candidates[wanted:]
+            won = _claim(batch, changes)
+            if won == len(batch):
+                claimed += batch
+            elif won:
+                # Lost some rows to other buyers; find out which ones are ours
+                claimed += Ticket.objects.filter(
+                    id__in=batch, user=changes['user'], status=changes['status'],
+                    last_modified=changes['last_modified'],
+                ).values_list('id', flat=True)
+
+    return claimed
+
@@ -0,0 +1,80 @@
+"""
+Active announcement feed, served from the cache.
+
+Announcements change a few times a day but are shown on every dashboard, so
+the feed is kept in the cache as plain data next to a version token. Saving
+or deleting an announcement (views, admin or shell) increments the token once
+its transaction commits, and the feed is only served while its token is
+current, so a read is one ``get_many`` and no SQL. The feed also goes stale
+on its own when its first announcement passes ``valid_until``.
+
+``version`` changes with every rebuild and is what the dashboard and
+``announcements_api`` use as their ETag.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Q, When
+from django.utils import timezone
+
+FEED_KEY = 'announcements:feed'
+TOKEN_KEY = 'announcements:token'
+
+
+def invalidate():
+    """Rebuild the feed on the next read once the current transaction commits"""
+    def bump():
+        try:
+            cache.incr(TOKEN_KEY)
+        except ValueError:
+            pass  # No token, so no feed can be current anyway
+    transaction.on_commit(bump)
+
+
+def active_feed():
+    """``{'version', 'announcements', 'valid_until'}``, highest priority first"""
+    found = cache.get_many([FEED_KEY, TOKEN_KEY])
+    token, feed = found.get(TOKEN_KEY), found.get(FEED_KEY)
+    if feed is not None and token is not None and feed['token'] == token:
+        if feed['valid_until'] is None or feed['valid_until'] > timezone.now():
+            return feed
+    if token is None:
+        # Random, so a feed cached before an eviction of the token never matches again
+        cache.add(TOKEN_KEY, random.getrandbits(62), timeout=None)
+        token = cache.get(TOKEN_KEY)
+    feed = {'token': token, **build_feed()}
+    cache.set(FEED_KEY, feed, timeout=getattr(settings, 'ANNOUNCEMENT_FEED_TTL', 3600))
+    return feed
+
+
+def build_feed():
+    from .models import Announcement
+
+    now = timezone.now()
+    rows = Announcement.objects.filter(
+        Q(valid_until__isnull=True) | Q(valid_until__gt=now), is_active=True
+    ).order_by(
+        # By rank; '-priority' sorted the names alphabetically, putting MEDIUM above HIGH
+        Case(When(priority='HIGH', then=0), When(priority='MEDIUM', then=1), default=2),
+        '-created_at',
+    )
+    announcements = [
+        {
+            'id': announcement.id,
+            'title': announcement.title,
+            'content': announcement.content,
+            'priority': announcement.priority,
+            'priority_display': announcement.get_priority_display(),
+            'created_at': announcement.created_at,
+            'valid_until': announcement.valid_until,
+        }
+        for announcement in rows
+    ]
+    ends = [announcement['valid_until'] for announcement in announcements if announcement['valid_until']]
+    return {
+        'version': f"{random.getrandbits(32):08x}",  # New with every rebuild
+        'announcements': announcements,
+        'valid_until': min(ends, default=None),
+    }
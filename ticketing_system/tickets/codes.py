@@ -0,0 +1,128 @@
+"""
+Ticket code allocation.
+
+Codes are produced by running a keyed permutation (a four round Feistel
+network) over values taken from a counter. Distinct counter values always map
+to distinct codes, so no lookup against the Ticket table is needed, and without
+the key the sequence of issued codes cannot be predicted or walked.
+
+Each process reserves a block of counter values from ``CodeSequence`` with one
+atomic UPDATE and then hands out codes from memory. Reservations made inside an
+outer transaction are sized to the request and never cached, so a rollback
+cannot leave a process holding values that another process will reserve again.
+
+Keep ``TICKET_CODE_SECRET`` stable once tickets have been issued; changing it
+changes the permutation. Codes issued before this allocator existed are random
+and are still protected by the unique index on ``Ticket.unique_code``.
+"""
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+# Crockford base32: unambiguous, upper case and alphanumeric, so codes keep
+# passing the 17 character ``isalnum`` check used by claim_ticket.
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CODE_LENGTH = 17
+HALF_BITS = 42  # 84 bit permutation domain fits in 17 base32 characters
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+SEQUENCE_NAME = 'ticket_code'
+BLOCK_SIZE = getattr(settings, 'TICKET_CODE_BLOCK_SIZE', 1000)
+
+
+def _derive_key():
+    secret = getattr(settings, 'TICKET_CODE_SECRET', None) or settings.SECRET_KEY
+    return hashlib.blake2b(secret.encode(), person=b'ticket-codes', digest_size=32).digest()
+
+
+def _round(key, number, half):
+    data = number.to_bytes(1, 'big') + half.to_bytes(6, 'big')
+    digest = hashlib.blake2b(data, key=key, digest_size=6).digest()
+    return int.from_bytes(digest, 'big') & HALF_MASK
+
+
+def permute(value, key):
+    """Map a counter value to a unique, unpredictable 84 bit integer."""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for number in range(ROUNDS):
+        left, right = right, left ^ _round(key, number, right)
+    return (left << HALF_BITS) | right
+
+
+def encode(number):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, index = divmod(number, 32)
+        chars.append(ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+def reserve_block(size):
+    """Atomically reserve ``size`` counter values and return the first one."""
+    from .models import CodeSequence
+
+    sequence = CodeSequence.objects.filter(name=SEQUENCE_NAME)
+    with transaction.atomic():
+        if not sequence.update(next_value=F('next_value') + size):
+            CodeSequence.objects.get_or_create(name=SEQUENCE_NAME)
+            sequence.update(next_value=F('next_value') + size)
+        end = CodeSequence.objects.values_list('next_value', flat=True).get(name=SEQUENCE_NAME)
+    return end - size
+
+
+class CodeAllocator:
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._key = None
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._next = 0
+        self._end = 0
+
+    def allocate(self, count=1):
+        """Return a list of ``count`` new ticket codes."""
+        with self._lock:
+            if self._key is None:
+                self._key = _derive_key()
+            if self._pid != os.getpid():
+                # A forked child must not reuse the parent's block
+                self._reset()
+
+            if connection.in_atomic_block:
+                start = reserve_block(count)
+                values = range(start, start + count)
+            else:
+                values = self._take(count)
+
+            return [encode(permute(value, self._key)) for value in values]
+
+    def _take(self, count):
+        values = []
+        while len(values) < count:
+            if self._next >= self._end:
+                size = max(self.block_size, count - len(values))
+                self._next = reserve_block(size)
+                self._end = self._next + size
+            take = min(count - len(values), self._end - self._next)
+            values.extend(range(self._next, self._next + take))
+            self._next += take
+        return values
+
+
+allocator = CodeAllocator()
+
+
+def allocate_codes(count):
+    return allocator.allocate(count)
+
+
+def new_code():
+    return allocator.allocate(1)[0]
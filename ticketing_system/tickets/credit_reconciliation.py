@@ -0,0 +1,158 @@
+"""
+Check that ``Profile.credits`` matches each user's ledger.
+
+Transactions and profiles are streamed by primary key in large chunks as
+integer cents (the rounding and debit sign are applied in SQL), turned into
+NumPy arrays and summed per user with ``np.bincount``. Memory is bounded by
+the chunk size plus a few arrays with one entry per user, so tens of millions
+of ledger rows can be checked in minutes.
+
+A run covers the ledger up to the newest row that existed when it started
+(the high-water mark). Users whose balance moved after that are compared
+against the ``balance_after`` of their last row at or below it rather than
+against ``Profile.credits``, so purchases committed during a run are not
+reported as mismatches.
+
+Incremental runs only re-check users with ledger rows written since the last
+run, using the high-water mark stored in ``ReconciliationCheckpoint``.
+"""
+import logging
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+from django.conf import settings
+from django.db.models import BigIntegerField, Case, F, Max, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+
+from .ledger import DEBIT_TYPES
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = getattr(settings, 'CREDIT_RECONCILIATION_CHUNK_SIZE', 200000)
+USER_BATCH_SIZE = 500
+CHECKPOINT_NAME = 'credits'
+UNKNOWN = np.iinfo(np.int64).min  # balance_after is only recorded since the ledger was introduced
+
+
+@dataclass
+class Report:
+    users_checked: int = 0
+    transactions_read: int = 0
+    seconds: float = 0.0
+    mismatches: list = field(default_factory=list)  # (user_id, expected, actual) in cents
+
+
+def _cents(name):
+    return Cast(Round(F(name) * 100), BigIntegerField())
+
+
+def _stream(queryset, columns, chunk_size):
+    """Yield ``(n, len(columns))`` int64 arrays, walking ``queryset`` by id"""
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', *columns)[:chunk_size])
+        if not rows:
+            return
+        chunk = np.array(rows, dtype=np.int64)
+        last_id = int(chunk[-1, 0])
+        yield chunk[:, 1:]
+
+
+def _signed_ledger(high_water, user_ids=None):
+    from .models import Transaction
+
+    entries = Transaction.objects.filter(id__lte=high_water)
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    return entries.annotate(
+        signed_cents=Case(
+            When(transaction_type__in=DEBIT_TYPES, then=_cents('amount') * Value(-1)),
+            default=_cents('amount'),
+            output_field=BigIntegerField(),
+        ),
+        balance_cents=Coalesce(_cents('balance_after'), Value(UNKNOWN), output_field=BigIntegerField()),
+    )
+
+
+def _check(report, user_ids, high_water, chunk_size):
+    """Compare ledger sums up to ``high_water`` with balances for ``user_ids`` (``None`` means everyone)"""
+    from .models import Profile, Transaction
+
+    # Arrays are indexed by user id for a full run, by position in user_ids otherwise
+    if user_ids is None:
+        keys = None
+        size = (Profile.objects.aggregate(top=Max('user_id'))['top'] or 0) + 1
+    else:
+        keys = np.asarray(sorted(user_ids), dtype=np.int64)
+        size = len(keys)
+
+    def slots(users):
+        return users if keys is None else np.searchsorted(keys, users)
+
+    expected = np.zeros(size, dtype=np.int64)
+    latest = np.full(size, UNKNOWN, dtype=np.int64)  # balance_after of each user's last row
+    columns = ('user_id', 'signed_cents', 'balance_cents')
+    for chunk in _stream(_signed_ledger(high_water, user_ids), columns, chunk_size):
+        at = slots(chunk[:, 0])
+        sums = np.bincount(at, weights=chunk[:, 1], minlength=size)[:size]
+        expected += np.rint(sums).astype(np.int64)
+        # Rows come in id order, so a user's last row in the chunk is their newest
+        last = len(at) - 1 - np.unique(at[::-1], return_index=True)[1]
+        latest[at[last]] = chunk[last, 2]
+        report.transactions_read += len(chunk)
+
+    profiles = Profile.objects.annotate(cents=_cents('credits'))
+    if user_ids is None:
+        profiles = profiles.filter(user_id__lt=size)  # Users created since the run started have no rows to check
+    else:
+        profiles = profiles.filter(user_id__in=user_ids)
+    chunks = list(_stream(profiles, ('user_id', 'cents'), chunk_size))
+    if not chunks:
+        return
+    users, actual = np.concatenate(chunks).T
+
+    # Read after the profiles, so every balance that moved since high_water is in here
+    moved = Transaction.objects.filter(id__gt=high_water)
+    if user_ids is not None:
+        moved = moved.filter(user_id__in=user_ids)
+    moved = np.isin(users, list(moved.values_list('user_id', flat=True).distinct()))
+    actual = np.where(moved, latest[slots(users)], actual)
+
+    checked = actual != UNKNOWN
+    wrong = np.nonzero(checked & (expected[slots(users)] != actual))[0]
+    report.mismatches += [(int(users[i]), int(expected[slots(users[i])]), int(actual[i])) for i in wrong]
+    report.users_checked += int(checked.sum())
+
+
+def reconcile_credits(incremental=False, chunk_size=None):
+    """
+    Check balances against the ledger and return a ``Report``. With
+    ``incremental`` only users with ledger rows newer than the last run are
+    checked. Either way the checkpoint is moved to the newest ledger row seen
+    at the start of the run.
+    """
+    from .models import ReconciliationCheckpoint, Transaction
+
+    chunk_size = chunk_size or CHUNK_SIZE
+    report = Report()
+    start = time.perf_counter()
+    high_water = Transaction.objects.aggregate(top=Max('id'))['top'] or 0
+    checkpoint, _ = ReconciliationCheckpoint.objects.get_or_create(name=CHECKPOINT_NAME)
+
+    if incremental:
+        touched = set()
+        new_entries = Transaction.objects.filter(id__gt=checkpoint.last_transaction_id, id__lte=high_water)
+        for chunk in _stream(new_entries, ('user_id',), chunk_size):
+            touched.update(np.unique(chunk[:, 0]).tolist())
+        touched = sorted(touched)
+        for i in range(0, len(touched), USER_BATCH_SIZE):
+            _check(report, touched[i:i + USER_BATCH_SIZE], high_water, chunk_size)
+    else:
+        _check(report, None, high_water, chunk_size)
+
+    ReconciliationCheckpoint.objects.filter(pk=checkpoint.pk).update(last_transaction_id=high_water)
+    report.seconds = time.perf_counter() - start
+    logger.info(f"Checked {report.users_checked} balances against {report.transactions_read} ledger rows "
+                f"in {report.seconds:.1f}s, {len(report.mismatches)} mismatches")
+    return report
@@ -0,0 +1,155 @@
+"""
+In-process validation cache for events whose doors are open.
+
+The first scan for an event inside its entry window (``GATE_CACHE_DOORS_OPEN_HOURS``
+before the start until ``TICKET_QR_GRACE_HOURS`` after) loads all of its
+PURCHASED and USED tickets with one query into a dict of
+``code -> Entry(ticket_id, status, holder)``. Later scans are answered from
+memory and only touch the database to admit a ticket.
+
+Staying correct with several gate workers:
+
+* Only PURCHASED and USED are cached, and tickets only move forward from
+  PURCHASED to USED during an event. Admission is still the conditional
+  ``UPDATE ... WHERE status = 'PURCHASED'``, so a worker whose cache still
+  says PURCHASED for a ticket another worker admitted simply loses that
+  UPDATE and reports the ticket as used. Admissions are written through to
+  the local cache either way.
+* Anything else (a code that is not cached, e.g. a ticket sold after
+  warming) falls back to the database.
+* Changes that go backwards (staff edits, a USED ticket reset) are saved
+  through ``Ticket.save()``, whose ``post_save`` handler bumps a per-event
+  generation in the cache backend. Every worker compares its copy with that
+  generation at most every ``GATE_CACHE_CHECK_SECONDS`` and rebuilds it when
+  it changed.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CACHED_STATUSES = ('PURCHASED', 'USED')
+
+Entry = namedtuple('Entry', 'ticket_id status holder')
+
+
+class _EventCache:
+    __slots__ = ('event_id', 'name', 'date', 'entries', 'generation', 'checked_at')
+
+    def __init__(self, event_id, name, date, entries, generation):
+        self.event_id = event_id
+        self.name = name
+        self.date = date
+        self.entries = entries  # None while the event is outside its entry window
+        self.generation = generation
+        self.checked_at = time.monotonic()
+
+
+_events = {}
+_lock = threading.Lock()
+
+
+def _generation_key(event_id):
+    return f'gate-cache:{event_id}:generation'
+
+
+def invalidate(event_id):
+    """Make every worker rebuild its cache for ``event_id`` on its next check"""
+    key = _generation_key(event_id)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:  # Evicted between add and incr
+        cache.set(key, 1, timeout=None)
+
+
+def is_open(event, now=None):
+    now = now or timezone.now()
+    doors_open = getattr(settings, 'GATE_CACHE_DOORS_OPEN_HOURS', 3)
+    grace = getattr(settings, 'TICKET_QR_GRACE_HOURS', 24)
+    return event.date - timedelta(hours=doors_open) <= now <= event.date + timedelta(hours=grace)
+
+
+def warm(event_id):
+    """(Re)load the cache for ``event_id``; a no-op load outside the entry window"""
+    from .models import Event, Ticket
+
+    generation = cache.get(_generation_key(event_id), 0)
+    event = Event.objects.only('name', 'date').get(pk=event_id)
+    entries = None
+    if is_open(event):
+        rows = Ticket.objects.filter(event_id=event_id, status__in=CACHED_STATUSES).values_list(
+            'id', 'unique_code', 'status', 'user__first_name', 'user__last_name', 'user__username'
+        )
+        entries = {
+            code: Entry(ticket_id, status, f'{first} {last}'.strip() or username or '')
+            for ticket_id, code, status, first, last, username in rows.iterator(chunk_size=5000)
+        }
+        logger.info(f"Warmed gate cache for Event ID: {event_id} with {len(entries)} tickets")
+    events = _EventCache(event_id, event.name, event.date, entries, generation)
+    with _lock:
+        _events[event_id] = events
+    return events
+
+
+def _event_cache(event_id):
+    events = _events.get(event_id)
+    check_seconds = getattr(settings, 'GATE_CACHE_CHECK_SECONDS', 1.0)
+    if events is not None and time.monotonic() - events.checked_at >= check_seconds:
+        if cache.get(_generation_key(event_id), 0) != events.generation or \
+                (events.entries is None) == is_open(events):
+            events = None  # Invalidated elsewhere, or the doors opened or closed
+        else:
+            events.checked_at = time.monotonic()
+    if events is None:
+        events = warm(event_id)
+    return events
+
+
+def prime(event_id):
+    """This worker's cache for ``event_id``, warmed or refreshed as needed; ``None`` if unavailable"""
+    try:
+        return _event_cache(event_id)
+    except Exception:  # Event deleted, cache backend down, ...: fall back to the database
+        logger.warning(f"Gate cache unavailable for Event ID: {event_id}", exc_info=True)
+        return None
+
+
+def lookup(event_id, code):
+    """
+    ``(event, entry)`` for ``code`` from the cache, where ``event`` has
+    ``name`` and ``date``; ``None`` when the caller has to ask the database.
+    """
+    events = prime(event_id)
+    if events is None or events.entries is None:
+        return None
+    entry = events.entries.get(code)
+    return (events, entry) if entry is not None else None
+
+
+def find(code):
+    """``lookup`` for a code whose event is unknown (legacy payloads), among the warm events"""
+    for event_id in list(_events):
+        hit = lookup(event_id, code)
+        if hit is not None:
+            return hit
+    return None
+
+
+def mark_used(event_id, code):
+    """Write an admission through to this worker's cache"""
+    events = _events.get(event_id)
+    if events is not None and events.entries is not None and code in events.entries:
+        events.entries[code] = events.entries[code]._replace(status='USED')
+
+
+def clear():
+    with _lock:
+        _events.clear()
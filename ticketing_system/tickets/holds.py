@@ -0,0 +1,130 @@
+"""
+Timed ticket holds.
+
+A hold takes tickets out of AVAILABLE for ``TICKET_HOLD_SECONDS`` while the
+buyer confirms (``allocate_tickets(..., hold_until=...)``). Confirming turns
+unexpired holds into PURCHASED with one conditional UPDATE. Holds that run out
+are handed back by ``release_expired_holds`` (``manage.py sweep_holds``),
+which walks the (status, hold_expires_at) index in batches, so neither the
+purchase path nor the hold path ever has to look for stale holds.
+
+Released tickets get a fresh ``unique_code``: the holder could see the old
+one (dashboard, QR image), and an AVAILABLE ticket with no owner is exactly
+what ``claim_ticket`` hands out for a code, so keeping it would turn every
+released hold into a free ticket. Stored QR images of released tickets
+show the old code, so they are deleted once the release commits.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .codes import allocate_codes
+from .inventory import record_transition
+from .models import Ticket
+
+logger = logging.getLogger(__name__)
+
+HOLD_SECONDS = getattr(settings, 'TICKET_HOLD_SECONDS', 300)
+SWEEP_BATCH_SIZE = getattr(settings, 'TICKET_HOLD_SWEEP_BATCH_SIZE', 1000)
+
+RELEASED = {'status': 'AVAILABLE', 'user': None, 'hold_expires_at': None, 'qr_code': ''}
+
+
+def _release(ids, **conditions):
+    """Return the HELD tickets among ``ids`` to AVAILABLE under new codes, in one UPDATE"""
+    held = Ticket.objects.filter(id__in=ids, status='HELD', **conditions)
+    images = dict(held.exclude(qr_code='').values_list('id', 'qr_code'))  # Usually none; images render on demand
+    codes = allocate_codes(len(ids))
+    released = held.update(
+        unique_code=Case(*(When(id=ticket_id, then=Value(code)) for ticket_id, code in zip(ids, codes)),
+                         default=F('unique_code')),
+        last_modified=timezone.now(),
+        **RELEASED
+    )
+    if images:
+        # Only rows this UPDATE cleared; a hold confirmed in the meantime keeps its image
+        cleared = Ticket.objects.filter(id__in=list(images), qr_code='').values_list('id', flat=True)
+        _delete_images([images[ticket_id] for ticket_id in cleared])
+    return released
+
+
+def _delete_images(names):
+    storage = Ticket._meta.get_field('qr_code').storage
+
+    def delete():
+        for name in names:
+            storage.delete(name)
+    transaction.on_commit(delete)
+
+
+def hold_expiry(now=None):
+    return (now or timezone.now()) + timedelta(seconds=HOLD_SECONDS)
+
+
+def active_holds(event, user, now=None):
+    """Tickets of ``event`` that ``user`` holds and that have not expired yet"""
+    return Ticket.objects.filter(event=event, user=user, status='HELD',
+                                 hold_expires_at__gt=now or timezone.now())
+
+
+def confirm_holds(event, user, ids, now=None):
+    """
+    Turn ``user``'s unexpired holds on ``ids`` into purchases. Must be called
+    inside a transaction. Returns how many tickets were converted; fewer than
+    ``len(ids)`` means some holds expired (or were swept) in the meantime.
+    """
+    now = now or timezone.now()
+    confirmed = active_holds(event, user, now).filter(id__in=ids).update(
+        status='PURCHASED', purchased_at=now, hold_expires_at=None, last_modified=now
+    )
+    record_transition(event.id, 'HELD', 'PURCHASED', count=confirmed)
+    return confirmed
+
+
+def release_holds(event, user):
+    """Give back every ticket ``user`` holds for ``event``. Returns the number released."""
+    with transaction.atomic():
+        ids = list(Ticket.objects.filter(event=event, user=user, status='HELD').values_list('id', flat=True))
+        released = _release(ids, user=user) if ids else 0
+        record_transition(event.id, 'HELD', 'AVAILABLE', count=released)
+    return released
+
+
+def release_expired_holds(batch_size=None, now=None):
+    """
+    Return expired holds to AVAILABLE, ``batch_size`` tickets per transaction.
+    Each batch is one index range read plus one conditional UPDATE per event,
+    so a hold confirmed while the sweep runs is left alone. Returns the number
+    of tickets released.
+    """
+    batch_size = batch_size or SWEEP_BATCH_SIZE
+    now = now or timezone.now()
+    expired = Ticket.objects.filter(status='HELD', hold_expires_at__lte=now).order_by('hold_expires_at')
+    released = 0
+
+    while True:
+        rows = list(expired.values_list('id', 'event_id')[:batch_size])
+        if not rows:
+            break
+
+        by_event = defaultdict(list)
+        for ticket_id, event_id in rows:
+            by_event[event_id].append(ticket_id)
+
+        with transaction.atomic():
+            for event_id, ids in by_event.items():
+                count = _release(ids, hold_expires_at__lte=now)
+                record_transition(event_id, 'HELD', 'AVAILABLE', count=count)
+                released += count
+
+        if len(rows) < batch_size:
+            break
+
+    if released:
+        logger.info(f"Released {released} expired ticket holds")
+    return released
@@ -0,0 +1,81 @@
+"""
+Idempotency keys for endpoints that move money.
+
+Clients send an ``Idempotency-Key`` header (any unique string, e.g. a UUID per
+checkout attempt). The first request with a key runs normally and its
+response is kept in the cache for ``IDEMPOTENCY_KEY_TTL`` seconds; retries
+with the same key get the stored response back without running the view, so
+no ``Profile`` or ``Ticket`` row is read or locked again. A retry that arrives
+while the first request is still running gets a 409. Keys are scoped to the
+user and path, and reusing a key with a different body is rejected.
+"""
+import hashlib
+import logging
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+KEY_TTL = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600)
+IN_PROGRESS_TTL = 60  # Upper bound on how long the first request may take
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADERS = ('Content-Type', 'Location')
+TRANSIENT_STATUSES = (409, 429)  # Worth retrying with the same key, so not stored
+
+
+def _cache_key(request, key):
+    scope = hashlib.sha256(f'{request.user.pk}:{request.path}:{key}'.encode()).hexdigest()
+    return f'idempotency:{scope}'
+
+
+def _replay(stored):
+    response = HttpResponse(stored['content'], status=stored['status'])
+    for header, value in stored['headers'].items():
+        response[header] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_func):
+    """Honour the ``Idempotency-Key`` header on a view (requests without one run as usual)"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return view_func(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'success': False, 'error': 'Idempotency-Key is too long.'}, status=400)
+
+        cache_key = _cache_key(request, key)
+        body_hash = hashlib.sha256(request.body).hexdigest()
+        stored = cache.get(cache_key)
+        if stored is not None:
+            if stored['body_hash'] != body_hash:
+                return JsonResponse({'success': False, 'error': 'Idempotency-Key was already used for a different request.'}, status=422)
+            logger.info(f"Replaying response for Idempotency-Key on {request.path} for User: {request.user.pk}")
+            return _replay(stored)
+
+        lock_key = f'{cache_key}:lock'
+        if not cache.add(lock_key, 1, timeout=IN_PROGRESS_TTL):
+            response = JsonResponse({'success': False, 'error': 'A request with this Idempotency-Key is still being processed.'}, status=409)
+            response['Retry-After'] = '1'
+            return response
+
+        try:
+            response = view_func(request, *args, **kwargs)
+            if response.status_code < 500 and response.status_code not in TRANSIENT_STATUSES \
+                    and not response.streaming:
+                cache.set(cache_key, {
+                    'status': response.status_code,
+                    'content': response.content,
+                    'headers': {h: response[h] for h in REPLAYED_HEADERS if response.has_header(h)},
+                    'body_hash': body_hash,
+                }, timeout=KEY_TTL)
+        finally:
+            cache.delete(lock_key)
+        return response
+    return wrapper
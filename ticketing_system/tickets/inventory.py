@@ -0,0 +1,91 @@
+"""
+Per-event ticket inventory counters.
+
+``Event.available_count``, ``held_count``, ``sold_count`` and ``used_count`` mirror the ticket
+table so inventory reads never have to count tickets. Every code path that
+creates tickets or changes a ticket's status reports it here, and the counters
+are adjusted with a single ``F()`` UPDATE inside the caller's transaction.
+``reconcile`` (``manage.py reconcile_inventory``) rebuilds them from the
+ticket table if they ever drift, e.g. after edits through the admin.
+"""
+import logging
+
+from django.db.models import Count, F, Q
+
+logger = logging.getLogger(__name__)
+
+SOLD_STATUSES = ('PURCHASED', 'USED')
+CLAIMED_STATUSES = ('HELD',) + SOLD_STATUSES  # Count toward a buyer's per-event limit
+
+
+def _counts_for(status):
+    return {
+        'available_count': int(status == 'AVAILABLE'),
+        'held_count': int(status == 'HELD'),
+        'sold_count': int(status in SOLD_STATUSES),
+        'used_count': int(status == 'USED'),
+    }
+
+
+def adjust(event_id, **deltas):
+    """
+    Apply counter deltas, e.g. ``adjust(1, available_count=-1, sold_count=1)``.
+    The event's stats version moves in the same UPDATE (see stats.py).
+    """
+    from . import stats
+    from .models import Event
+
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if changes:
+        Event.objects.filter(pk=event_id).update(stats_version=F('stats_version') + 1, **changes)
+        stats.invalidate([event_id])
+
+
+def record_created(event_id, status='AVAILABLE', count=1):
+    adjust(event_id, **{field: value * count for field, value in _counts_for(status).items()})
+
+
+def record_transition(event_id, old_status, new_status, count=1):
+    """Record ``count`` tickets moving from ``old_status`` to ``new_status``"""
+    old, new = _counts_for(old_status), _counts_for(new_status)
+    adjust(event_id, **{field: (new[field] - old[field]) * count for field in new})
+
+
+def count_from_tickets(event_ids=None):
+    """Recompute the counters from the ticket table with one grouped query"""
+    from .models import Ticket
+
+    tickets = Ticket.objects.all()
+    if event_ids is not None:
+        tickets = tickets.filter(event_id__in=event_ids)
+    rows = tickets.values('event_id').order_by().annotate(
+        available_count=Count('id', filter=Q(status='AVAILABLE')),
+        held_count=Count('id', filter=Q(status='HELD')),
+        sold_count=Count('id', filter=Q(status__in=SOLD_STATUSES)),
+        used_count=Count('id', filter=Q(status='USED')),
+    )
+    return {row.pop('event_id'): row for row in rows}
+
+
+def reconcile(event_ids=None):
+    """
+    Overwrite drifted counters with values recomputed from the ticket table.
+    Returns a list of ``(event, stored, actual)`` for the events that were fixed.
+    """
+    from .models import Event
+
+    actual = count_from_tickets(event_ids)
+    events = Event.objects.only('id', 'name', 'available_count', 'held_count', 'sold_count', 'used_count')
+    if event_ids is not None:
+        events = events.filter(id__in=event_ids)
+
+    fixed = []
+    empty = {'available_count': 0, 'held_count': 0, 'sold_count': 0, 'used_count': 0}
+    for event in events.iterator():
+        expected = actual.get(event.id, empty)
+        stored = {field: getattr(event, field) for field in expected}
+        if stored != expected:
+            Event.objects.filter(pk=event.id).update(**expected)
+            logger.warning(f"Inventory drift for Event ID: {event.id}: stored {stored}, actual {expected}")
+            fixed.append((event, stored, expected))
+    return fixed
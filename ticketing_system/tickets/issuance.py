@@ -0,0 +1,48 @@
+"""
+Bulk ticket issuance.
+
+Tickets are written in chunks with ``bulk_create``, each chunk in its own short
+transaction, so issuing a large run never holds one long lock on the event.
+Codes for a chunk come from the code allocator before the chunk's transaction
+opens, and QR images are not rendered here - see ``Ticket.generate_qr_code``.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from .codes import allocate_codes
+from .inventory import record_created
+from .models import Ticket
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = getattr(settings, 'TICKET_ISSUE_CHUNK_SIZE', 1000)
+
+
+def issue_tickets(event, quantity, chunk_size=None, progress=None):
+    """
+    Create ``quantity`` AVAILABLE tickets for ``event``.
+
+    ``progress`` is an optional callable invoked as ``progress(created, total)``
+    after every committed chunk. Returns the number of tickets created.
+    """
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    created = 0
+
+    while created < quantity:
+        size = min(chunk_size, quantity - created)
+        codes = allocate_codes(size)
+        with transaction.atomic():
+            Ticket.objects.bulk_create(
+                [Ticket(event=event, unique_code=code) for code in codes],
+                batch_size=size,
+            )
+            record_created(event.id, 'AVAILABLE', count=size)
+        created += size
+
+        logger.debug(f"Issued {created}/{quantity} tickets for Event ID: {event.id}")
+        if progress:
+            progress(created, quantity)
+
+    return created
@@ -0,0 +1,62 @@
+"""
+Credit ledger.
+
+Every change to ``Profile.credits`` goes through ``debit`` or ``credit``. The
+balance is moved with a single conditional ``F()`` UPDATE (a debit only
+matches while ``credits >= amount``), so concurrent requests can neither lose
+an update nor overdraw, and no other profile column is rewritten. Each change
+appends a ``Transaction`` row that records the balance it produced; rows are
+never updated or deleted.
+
+The current balance is simply ``Profile.credits``, and the balance as of any
+ledger row is that row's ``balance_after``.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+DEBIT_TYPES = ('TICKET_PURCHASE', 'ADJUSTMENT_DEBIT')
+
+
+class InsufficientCredits(Exception):
+    pass
+
+
+def signed_amount(entry):
+    """Effect of a ledger row on the balance (amounts are stored unsigned)"""
+    return -entry.amount if entry.transaction_type in DEBIT_TYPES else entry.amount
+
+
+def _append(user, amount, transaction_type):
+    from .models import Profile, Transaction
+
+    balance = Profile.objects.filter(user=user).values_list('credits', flat=True).get()
+    return Transaction.objects.create(
+        user=user, amount=amount, transaction_type=transaction_type, balance_after=balance
+    )
+
+
+def debit(user, amount, transaction_type='TICKET_PURCHASE'):
+    """
+    Take ``amount`` from ``user``'s balance and return the ledger row.
+    Raises ``InsufficientCredits`` (and changes nothing) if the balance is too low.
+    """
+    from .models import Profile
+
+    amount = Decimal(amount)
+    with transaction.atomic():
+        if not Profile.objects.filter(user=user, credits__gte=amount).update(credits=F('credits') - amount):
+            raise InsufficientCredits(f"User {user.pk} cannot cover {amount}")
+        return _append(user, amount, transaction_type)
+
+
+def credit(user, amount, transaction_type='REDEMPTION'):
+    """Add ``amount`` to ``user``'s balance and return the ledger row"""
+    from .models import Profile
+
+    amount = Decimal(amount)
+    with transaction.atomic():
+        Profile.objects.filter(user=user).update(credits=F('credits') + amount)
+        return _append(user, amount, transaction_type)
+
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from tickets import gate_cache, scan_log
+from tickets.inventory import count_from_tickets
+from tickets.issuance import issue_tickets
+from tickets.models import Event, ScanLog, Ticket
+
+MODES = ('single', 'batch', 'socket')
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class Command(BaseCommand):
+    help = ("Seed a throwaway event that is about to start with purchased tickets and scan them with "
+            "concurrent simulated scanners through the single, batch and WebSocket validation paths. "
+            "Reports scans/second, p50/p95/p99 latency and double admissions, and can save the results "
+            "as JSON to compare runs. The event and its accounts are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=2000)
+        parser.add_argument('--scanners', default='1,4,16', help='Comma separated scanner counts to compare')
+        parser.add_argument('--modes', default=','.join(MODES), help=f'Comma separated, from {", ".join(MODES)}')
+        parser.add_argument('--duplicate-rate', type=float, default=0.2,
+                            help='Extra scans of already scanned tickets, as a fraction of --tickets')
+        parser.add_argument('--batch-size', type=int, default=50, help='Codes per request in batch mode')
+        parser.add_argument('--window', type=int, default=16,
+                            help='Scans each WebSocket scanner keeps in flight')
+        parser.add_argument('--cold', action='store_true',
+                            help='Keep the gate cache off, so every scan reads the database')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--label', default='', help='Free text stored with the JSON results')
+
+    def handle(self, *args, **options):
+        modes = options['modes'].split(',')
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown mode(s): {', '.join(sorted(unknown))}")
+        scanner_counts = [int(n) for n in options['scanners'].split(',')]
+
+        overrides = {'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}}
+        if options['cold']:
+            overrides['GATE_CACHE_DOORS_OPEN_HOURS'] = -1  # The event is never inside its entry window
+        with override_settings(**overrides):
+            runs = self.run_all(options, modes, scanner_counts)
+
+        self.stdout.write(f"Backend: {connection.vendor}, {options['tickets']} tickets, "
+                          f"gate cache {'off' if options['cold'] else 'on'}")
+        self.stdout.write("  mode     scanners    scans/s   p50 ms   p95 ms   p99 ms  admitted  double  errors")
+        for run in runs:
+            self.stdout.write(
+                f"  {run['mode']:<7}  {run['scanners']:>8}  {run['throughput']:>9,.0f}  {run['p50_ms']:>7.2f}  "
+                f"{run['p95_ms']:>7.2f}  {run['p99_ms']:>7.2f}  {run['admitted']:>8}  "
+                f"{run['double_admits']:>6}  {run['errors']:>6}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'label': options['label'],
+                    'timestamp': timezone.now().isoformat(),
+                    'backend': connection.vendor,
+                    'tickets': options['tickets'],
+                    'duplicate_rate': options['duplicate_rate'],
+                    'gate_cache': not options['cold'],
+                    'runs': runs,
+                }, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def run_all(self, options, modes, scanner_counts):
+        event = Event.objects.create(
+            name='Gate benchmark',
+            date=timezone.now() + timedelta(hours=1),
+            location='Benchmark',
+            price=Decimal('1.00'),
+            ticket_count=options['tickets'],
+        )
+        holder = User.objects.create(username=f'bench-holder-{event.id}')
+        staff = User.objects.create(username=f'bench-gate-{event.id}')
+        staff.profile.role = 'staff'
+        staff.profile.save()
+        try:
+            issue_tickets(event, options['tickets'])
+            tickets = Ticket.objects.filter(event=event)
+            tickets.update(user=holder)
+            payloads = [ticket.qr_payload() for ticket in tickets.select_related('event')]
+
+            runs = []
+            for mode in modes:
+                for scanners in scanner_counts:
+                    self.reset(event)
+                    scans = payloads + random.choices(payloads, k=int(len(payloads) * options['duplicate_rate']))
+                    random.shuffle(scans)
+                    runs.append(self.run(mode, scanners, scans, event, staff, options))
+            return runs
+        finally:
+            gate_cache.clear()
+            # Scan log rows don't cascade (no database constraint), so write out the buffer and drop ours
+            scan_log.flush()
+            ScanLog.objects.filter(event_id=event.id).delete()
+            event.delete()
+            User.objects.filter(id__in=[holder.id, staff.id]).delete()
+
+    def reset(self, event):
+        Ticket.objects.filter(event=event).update(status='PURCHASED', used_at=None, last_modified=timezone.now())
+        Event.objects.filter(pk=event.id).update(**count_from_tickets([event.id])[event.id])
+        gate_cache.invalidate(event.id)
+        gate_cache.clear()
+
+    def run(self, mode, scanners, scans, event, staff, options):
+        shares = [scans[i::scanners] for i in range(scanners)]
+        start = time.perf_counter()
+        if mode == 'socket':
+            latencies, verdicts = async_to_sync(self.scan_socket)(shares, event, staff, options['window'])
+        else:
+            scan = self.scan_single if mode == 'single' else self.scan_batch
+            latencies, verdicts = [], []
+            with ThreadPoolExecutor(max_workers=scanners) as pool:
+                for share_latencies, share_verdicts in pool.map(lambda share: scan(share, staff, options), shares):
+                    latencies.extend(share_latencies)
+                    verdicts.extend(share_verdicts)
+        elapsed = time.perf_counter() - start
+
+        admissions = Counter(code for code, verdict in verdicts
+                             if verdict.get('status') == 'success' and verdict['ticket']['is_valid'])
+        latencies.sort()
+        return {
+            'mode': mode,
+            'scanners': scanners,
+            'scans': len(scans),
+            'seconds': round(elapsed, 3),
+            'throughput': len(scans) / elapsed,
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'admitted': len(admissions),
+            'double_admits': sum(count - 1 for count in admissions.values()),
+            'used_in_database': Ticket.objects.filter(event=event, status='USED').count(),
+            'errors': sum(1 for _, verdict in verdicts if verdict.get('status') != 'success'),
+        }
+
+    def scan_single(self, codes, staff, options):
+        client = Client(raise_request_exception=False)
+        client.force_login(staff)
+        url = reverse('validate_ticket_api')
+        latencies, verdicts = [], []
+        try:
+            for code in codes:
+                began = time.perf_counter()
+                response = client.post(url, data=json.dumps({'code': code}), content_type='application/json')
+                latencies.append((time.perf_counter() - began) * 1000)
+                verdicts.append((code, response.json() if response.status_code < 500 else {'status': 'error'}))
+        finally:
+            connection.close()
+        return latencies, verdicts
+
+    def scan_batch(self, codes, staff, options):
+        client = Client(raise_request_exception=False)
+        client.force_login(staff)  # Batch validation is staff only
+        url = reverse('validate_tickets_batch')
+        size = options['batch_size']
+        latencies, verdicts = [], []
+        try:
+            for offset in range(0, len(codes), size):
+                batch = codes[offset:offset + size]
+                began = time.perf_counter()
+                response = client.post(url, data=json.dumps({'codes': batch}), content_type='application/json')
+                elapsed = (time.perf_counter() - began) * 1000
+                latencies.extend([elapsed] * len(batch))  # Every scan in the batch waits for the whole request
+                results = response.json()['results'] if response.status_code == 200 else [{'status': 'error'}] * len(batch)
+                verdicts.extend(zip(batch, results))
+        finally:
+            connection.close()
+        return latencies, verdicts
+
+    async def scan_socket(self, shares, event, staff, window):
+        from ticketing_system.routing import websocket_urlpatterns
+
+        async def scanner(codes):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/scanner/{event.id}/')
+            communicator.scope['user'] = staff
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError('The scanner socket refused the connection')
+            await communicator.receive_json_from()  # connection_success
+
+            latencies, verdicts, sent, sent_count = [], [], {}, 0
+            while len(verdicts) < len(codes):
+                while sent_count < len(codes) and len(sent) < window:
+                    sent[sent_count] = time.perf_counter()
+                    await communicator.send_json_to({'id': sent_count, 'code': codes[sent_count]})
+                    sent_count += 1
+                message = await communicator.receive_json_from(timeout=60)
+                if message['type'] != 'verdict':
+                    continue  # Check-in totals
+                latencies.append((time.perf_counter() - sent.pop(message['id'])) * 1000)
+                verdicts.append((codes[message['id']], message))
+            await communicator.disconnect()
+            return latencies, verdicts
+
+        latencies, verdicts = [], []
+        for share_latencies, share_verdicts in await asyncio.gather(*(scanner(share) for share in shares)):
+            latencies.extend(share_latencies)
+            verdicts.extend(share_verdicts)
+        return latencies, verdicts
@@ -0,0 +1,68 @@
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+
+from tickets.issuance import issue_tickets
+from tickets.models import Event, Ticket
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare per-ticket save() issuance with the chunked bulk issuance engine. All rows are rolled back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quantity', type=int, default=20000,
+                            help='Tickets to issue with the bulk engine')
+        parser.add_argument('--legacy-quantity', type=int, default=500,
+                            help='Tickets to issue one by one with Ticket.save()')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            try:
+                with transaction.atomic():
+                    event = Event.objects.create(
+                        name='Issuance benchmark',
+                        date=timezone.now() + timedelta(days=30),
+                        location='Benchmark',
+                        price=Decimal('1.00'),
+                        ticket_count=options['quantity'],
+                    )
+                    legacy_rate = self.run_legacy(event, options['legacy_quantity'])
+                    bulk_rate = self.run_bulk(event, options['quantity'], options['chunk_size'])
+                    raise _Rollback
+            except _Rollback:
+                pass
+
+        speedup = bulk_rate / legacy_rate if legacy_rate else float('inf')
+        self.stdout.write(f"Legacy save(): {legacy_rate:,.0f} tickets/s")
+        self.stdout.write(f"Bulk engine:   {bulk_rate:,.0f} tickets/s")
+        style = self.style.SUCCESS if speedup >= 20 else self.style.WARNING
+        self.stdout.write(style(f"Speedup: {speedup:.1f}x"))
+
+    def run_legacy(self, event, quantity):
+        start = time.perf_counter()
+        with transaction.atomic(), override_settings(TICKET_EAGER_QR_CODES=True):
+            for _ in range(quantity):
+                Ticket(event=event, unique_code=uuid.uuid4().hex[:17].upper()).save()
+        return quantity / (time.perf_counter() - start)
+
+    def run_bulk(self, event, quantity, chunk_size):
+        def progress(created, total):
+            self.stdout.write(f"  {created}/{total}", ending='\r')
+
+        start = time.perf_counter()
+        issue_tickets(event, quantity, chunk_size=chunk_size, progress=progress)
+        elapsed = time.perf_counter() - start
+        self.stdout.write('')
+        return quantity / elapsed
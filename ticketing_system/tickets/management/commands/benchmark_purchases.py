@@ -0,0 +1,75 @@
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from tickets.allocation import allocate_tickets, purchase_slot
+from tickets.issuance import issue_tickets
+from tickets.models import Event
+
+
+class Command(BaseCommand):
+    help = ("Sell out a throwaway event with concurrent buyers for each worker count and report "
+            "purchases/second and oversell. The event and buyer accounts are deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=2000)
+        parser.add_argument('--workers', default='1,2,4,8',
+                            help='Comma separated worker counts to compare')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Backend: {connection.vendor}, SKIP LOCKED: "
+                          f"{connection.features.has_select_for_update_skip_locked}")
+        for workers in [int(n) for n in options['workers'].split(',')]:
+            rate, sold, oversold = self.run(options['tickets'], workers)
+            self.stdout.write(f"{workers:>3} workers: {rate:>8,.0f} purchases/s, "
+                              f"{sold} sold, {oversold} oversold")
+
+    def run(self, quantity, workers):
+        event = Event.objects.create(
+            name='Purchase benchmark',
+            date=timezone.now() + timedelta(days=30),
+            location='Benchmark',
+            price=Decimal('1.00'),
+            ticket_count=quantity,
+        )
+        try:
+            issue_tickets(event, quantity)
+            buyers = [User.objects.create(username=f'bench-buyer-{event.id}-{n}') for n in range(workers)]
+            sold = []
+            lock = threading.Lock()
+
+            def buy(user):
+                try:
+                    while True:
+                        try:
+                            with purchase_slot(event.id), transaction.atomic():
+                                ids = allocate_tickets(event, user, 1)
+                        except OperationalError:
+                            time.sleep(0.001)  # SQLite allows one writer at a time
+                            continue
+                        if not ids:
+                            return
+                        with lock:
+                            sold.extend(ids)
+                finally:
+                    connection.close()
+
+            threads = [threading.Thread(target=buy, args=(user,)) for user in buyers]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            oversold = len(sold) - len(set(sold))
+            return len(sold) / elapsed, len(sold), oversold
+        finally:
+            event.delete()
+            User.objects.filter(username__startswith=f'bench-buyer-{event.id}-').delete()
@@ -0,0 +1,80 @@
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from tickets import waiting_room
+
+
+class Command(BaseCommand):
+    help = ("Flood the waiting room with buyers arriving at a multiple of the admission rate and "
+            "report status endpoint latency per second of the run and the admission rate achieved. "
+            "Uses the cache only; no rows are written.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rate', type=float, default=20.0, help='Admissions per second')
+        parser.add_argument('--overload', type=float, default=10.0,
+                            help='Arrival rate as a multiple of the admission rate')
+        parser.add_argument('--duration', type=int, default=10, help='Seconds of arrivals')
+        parser.add_argument('--poll-interval', type=float, default=0.5)
+        parser.add_argument('--workers', type=int, default=16)
+
+    def handle(self, *args, **options):
+        rate = options['rate']
+        settings = {'ENABLED': True, 'RATE': rate, 'BURST': int(rate)}
+        with override_settings(WAITING_ROOM=settings):
+            windows, admitted, queued = self.run(
+                rate * options['overload'], options['duration'], options['poll_interval'], options['workers']
+            )
+
+        self.stdout.write(f"Admission rate {rate:g}/s, arrivals {rate * options['overload']:g}/s")
+        self.stdout.write("  sec  polls   p50 ms   p99 ms")
+        for second in sorted(windows):
+            latencies = sorted(windows[second])
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            self.stdout.write(f"  {second:>3}  {len(latencies):>5}  {statistics.median(latencies):>7.2f}  {p99:>7.2f}")
+        self.stdout.write(f"Admitted {admitted} of {queued} queued buyers "
+                          f"({admitted / options['duration']:.1f}/s)")
+
+    def run(self, arrival_rate, duration, poll_interval, workers):
+        event_id = 10 ** 12 + int(time.time())  # Never collides with a real event's queue
+        status_url = reverse('waiting_room_status', args=[event_id])
+        local = threading.local()
+        windows = defaultdict(list)
+        lock = threading.Lock()
+        waiting = []
+        admitted = 0
+        start = time.perf_counter()
+
+        def poll(ticket):
+            client = getattr(local, 'client', None) or Client()
+            local.client = client
+            began = time.perf_counter()
+            response = client.get(status_url, {'ticket': ticket})
+            finished = time.perf_counter()
+            with lock:
+                windows[int(finished - start)].append((finished - began) * 1000)
+            return ticket, response.json()['admitted']
+
+        user_id = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while time.perf_counter() - start < duration:
+                tick = time.perf_counter()
+                for _ in range(int(arrival_rate * poll_interval)):
+                    user_id += 1
+                    position = waiting_room.join(event_id, user_id)
+                    waiting.append(waiting_room.queue_ticket(event_id, user_id, position))
+
+                results = list(pool.map(poll, waiting))
+                waiting = [ticket for ticket, is_admitted in results if not is_admitted]
+                admitted += len(results) - len(waiting)
+                time.sleep(max(0.0, poll_interval - (time.perf_counter() - tick)))
+
+        cache.delete_many([waiting_room._key(event_id, name) for name in ('tail', 'frontier', 'bucket')])
+        return windows, admitted, user_id
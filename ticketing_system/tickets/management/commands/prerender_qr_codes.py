@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.models import Event
+from tickets.qr import prerender_event_qr_codes
+
+
+class Command(BaseCommand):
+    help = "Render and store QR images for an event's tickets using a process pool. Safe to re-run after an interruption."
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_id', type=int)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes (defaults to the number of CPUs)')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Tickets written to storage and the database per chunk')
+
+    def handle(self, *args, **options):
+        try:
+            event = Event.objects.get(id=options['event_id'])
+        except Event.DoesNotExist:
+            raise CommandError(f"Event {options['event_id']} does not exist")
+
+        def progress(done, total, rate):
+            self.stdout.write(f"  {done}/{total} ({rate:,.0f} tickets/s)")
+
+        done, elapsed = prerender_event_qr_codes(
+            event,
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            progress=progress,
+        )
+        rate = done / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {done} QR codes for {event.name} in {elapsed:.1f}s ({rate:,.0f} tickets/s)"
+        ))
@@ -0,0 +1,30 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from tickets.credit_reconciliation import reconcile_credits
+
+
+class Command(BaseCommand):
+    help = ("Check every Profile.credits balance against the sum of the user's Transaction rows "
+            "and report mismatches. Nothing is changed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only check users with transactions since the last run')
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--limit', type=int, default=50, help='Mismatches to list')
+
+    def handle(self, *args, **options):
+        report = reconcile_credits(incremental=options['incremental'], chunk_size=options['chunk_size'])
+
+        for user_id, expected, actual in report.mismatches[:options['limit']]:
+            self.stdout.write(f"User #{user_id}: ledger {Decimal(expected) / 100:.2f}, "
+                              f"balance {Decimal(actual) / 100:.2f}")
+        rate = report.transactions_read / report.seconds if report.seconds else 0
+        summary = (f"Checked {report.users_checked} balance(s) against {report.transactions_read} "
+                   f"transaction(s) in {report.seconds:.1f}s ({rate:,.0f} rows/s)")
+        if report.mismatches:
+            self.stdout.write(self.style.WARNING(f"{summary}: {len(report.mismatches)} mismatch(es)"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{summary}: all balances match"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from tickets.inventory import reconcile
+
+
+class Command(BaseCommand):
+    help = ("Recompute per-event available/held/sold/used counters from the ticket table and fix any drift. "
+            "Run it when sales are quiet; purchases made while it runs may need another pass.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_ids', nargs='*', type=int,
+                            help='Only reconcile these events (default: all)')
+
+    def handle(self, *args, **options):
+        fixed = reconcile(options['event_ids'] or None)
+        for event, stored, actual in fixed:
+            changes = ', '.join(
+                f"{field} {stored[field]} -> {actual[field]}"
+                for field in actual if stored[field] != actual[field]
+            )
+            self.stdout.write(f"{event.name} (#{event.id}): {changes}")
+        self.stdout.write(self.style.SUCCESS(f"Reconciled inventory, {len(fixed)} event(s) corrected"))
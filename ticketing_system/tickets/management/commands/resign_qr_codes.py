@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from tickets.models import Event
+from tickets.qr import clear_stored_qr_codes, prerender_event_qr_codes
+
+
+class Command(BaseCommand):
+    help = ("Replace stored QR images (e.g. unsigned ones, or ones signed with a key being retired) "
+            "with images carrying the current signed payload.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_ids', nargs='*', type=int,
+                            help='Only these events (default: all)')
+        parser.add_argument('--prerender', action='store_true',
+                            help='Render and store new images instead of serving them on demand')
+        parser.add_argument('--workers', type=int, default=None)
+
+    def handle(self, *args, **options):
+        event_ids = options['event_ids'] or None
+        cleared = clear_stored_qr_codes(event_ids)
+        self.stdout.write(f"Cleared {cleared} stored QR image(s)")
+
+        if options['prerender']:
+            events = Event.objects.all() if event_ids is None else Event.objects.filter(id__in=event_ids)
+            for event in events:
+                done, elapsed = prerender_event_qr_codes(event, workers=options['workers'])
+                self.stdout.write(f"  {event.name}: rendered {done} in {elapsed:.1f}s")
+        self.stdout.write(self.style.SUCCESS("Stored QR images now carry signed payloads"))
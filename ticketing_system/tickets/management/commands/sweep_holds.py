@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tickets.holds import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = ("Return expired ticket holds to the available pool. Runs once, or keeps sweeping "
+            "every --interval seconds when given (e.g. as a supervisor-managed process).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Sweep continuously, sleeping this many seconds between passes')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_holds(batch_size=options['batch_size'])
+            if options['interval'] is None:
+                self.stdout.write(self.style.SUCCESS(f"Released {released} expired hold(s)"))
+                return
+            if released:
+                self.stdout.write(f"Released {released} expired hold(s)")
+            time.sleep(options['interval'])
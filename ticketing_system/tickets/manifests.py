@@ -0,0 +1,176 @@
+"""
+Offline gate validation.
+
+Scanners download a manifest of an event's admissible tickets (PURCHASED),
+check codes against it locally and upload the check-ins they recorded once
+they are back online.
+
+Each code is reduced to ``code_hash``: the first 8 bytes of its SHA-256 as a
+big-endian unsigned integer. A manifest is either the sorted hashes packed as
+big-endian ``uint64`` (binary search it) or a Bloom filter over them, where
+bit ``(h1 + i * h2) % m`` is set for ``i`` in ``range(k)``, with ``h1`` the
+upper and ``h2`` the lower 32 bits of the hash (``h2`` forced odd), and bit
+``n`` stored as ``1 << (n % 8)`` of byte ``n // 8``.
+
+The manifest version is the newest ``last_modified`` of the event's tickets in
+microseconds, so every code path that changes a ticket's status must also set
+``last_modified`` (``auto_now`` covers ``save()``; ``update()`` calls set it
+explicitly). ``delta`` returns the hashes added and removed since a version.
+"""
+import hashlib
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import scan_log
+from .inventory import record_transition
+from .models import Ticket
+from .qr_signing import InvalidPayload
+from .validation import parse_payload
+
+FORMATS = ('sorted', 'bloom')
+DEFAULT_FALSE_POSITIVE_RATE = 0.001
+# Changes committed slightly out of timestamp order must not fall between two
+# deltas, so each delta reaches back a little further than the version asked for.
+DELTA_OVERLAP = timedelta(seconds=5)
+OFFLINE_RESULTS = {'admitted': 'ADMITTED', 'duplicate': 'DUPLICATE', 'invalid': 'INVALID'}
+# How far ahead of the server a scanner's clock may run; later scan times are refused
+OFFLINE_CLOCK_SKEW = timedelta(seconds=getattr(settings, 'OFFLINE_SCAN_CLOCK_SKEW_SECONDS', 300))
+
+
+def code_hash(code):
+    return int.from_bytes(hashlib.sha256(code.encode()).digest()[:8], 'big')
+
+
+def _to_version(moment):
+    return int(moment.timestamp() * 1_000_000) if moment else 0
+
+
+def _from_version(version):
+    return datetime.fromtimestamp(version / 1_000_000, tz=dt_timezone.utc)
+
+
+def current_version(event):
+    return _to_version(Ticket.objects.filter(event=event).aggregate(latest=Max('last_modified'))['latest'])
+
+
+def _admissible_hashes(event):
+    codes = Ticket.objects.filter(event=event, status='PURCHASED').values_list('unique_code', flat=True)
+    return np.fromiter((code_hash(code) for code in codes.iterator(chunk_size=5000)), dtype=np.uint64)
+
+
+def sorted_manifest(event):
+    """Return ``(version, blob)``; the blob is the sorted hashes as big-endian uint64"""
+    version = current_version(event)
+    hashes = np.sort(_admissible_hashes(event))
+    return version, hashes.astype('>u8').tobytes()
+
+
+def bloom_manifest(event, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+    """Return ``(version, blob, bits, hash_count)`` for a Bloom filter over the admissible hashes"""
+    version = current_version(event)
+    hashes = _admissible_hashes(event)
+    n = max(1, len(hashes))
+    bits = max(64, math.ceil(-n * math.log(false_positive_rate) / math.log(2) ** 2))
+    hash_count = max(1, round(bits / n * math.log(2)))
+
+    h1 = hashes >> np.uint64(32)
+    h2 = (hashes & np.uint64(0xFFFFFFFF)) | np.uint64(1)
+    filter_bytes = np.zeros((bits + 7) // 8, dtype=np.uint8)
+    for i in range(hash_count):
+        positions = (h1 + np.uint64(i) * h2) % np.uint64(bits)
+        np.bitwise_or.at(filter_bytes, (positions >> np.uint64(3)).astype(np.int64),
+                         (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+    return version, filter_bytes.tobytes(), bits, hash_count
+
+
+def delta(event, since):
+    """Hashes that became admissible or stopped being admissible after version ``since``"""
+    changed = Ticket.objects.filter(
+        event=event, last_modified__gt=_from_version(since) - DELTA_OVERLAP
+    ).values_list('unique_code', 'status', 'last_modified')
+    added, removed, latest = [], [], since
+    for code, status, modified in changed.iterator(chunk_size=5000):
+        (added if status == 'PURCHASED' else removed).append(f'{code_hash(code):016x}')
+        latest = max(latest, _to_version(modified))
+    return {'version': latest, 'since': since, 'added': added, 'removed': removed}
+
+
+def _ticket_code(data, event):
+    """Ticket code from a scanned payload, or ``None`` if it can't belong to ``event``"""
+    try:
+        code, _, event_id = parse_payload(data)
+    except InvalidPayload:
+        return None
+    return code if event_id in (None, event.id) else None
+
+
+def record_offline_scans(event, scans, scanned_by=None, gate=''):
+    """
+    Apply check-ins recorded offline. ``scans`` is a list of
+    ``{'code': ..., 'scanned_at': datetime}``. The earliest scan of a ticket
+    is its admission, wherever it was recorded: scans are applied oldest
+    first, and an offline scan older than an admission already on record
+    takes its place. Returns one result per scan, in input order, with
+    ``result`` one of ``admitted``, ``duplicate`` or ``invalid``, the
+    ticket's ``first_used_at``, and ``conflict`` set when another scan of
+    the ticket had already been recorded. The scans go to the scan log with
+    the time they were made. A scan dated in the future (beyond
+    ``OFFLINE_CLOCK_SKEW``) is ``invalid``: as the earliest scan it would
+    otherwise hold the ticket's admission time for good.
+    """
+    latest = timezone.now() + OFFLINE_CLOCK_SKEW
+    codes = [_ticket_code(scan['code'], event) if scan['scanned_at'] <= latest else None for scan in scans]
+    tickets = {
+        ticket.unique_code: ticket
+        for ticket in Ticket.objects.filter(event=event, unique_code__in={c for c in codes if c})
+        .only('id', 'unique_code', 'status', 'used_at')
+    }
+
+    results = [None] * len(scans)
+    order = sorted(range(len(scans)), key=lambda i: scans[i]['scanned_at'])
+    with transaction.atomic():
+        for i in order:
+            ticket = tickets.get(codes[i])
+            scanned_at = scans[i]['scanned_at']
+            result = {'code': scans[i]['code'], 'result': 'invalid', 'first_used_at': None, 'conflict': False}
+            results[i] = result
+            if ticket is None or ticket.status not in ('PURCHASED', 'USED'):
+                continue
+
+            if ticket.status == 'PURCHASED':
+                admitted = Ticket.objects.filter(pk=ticket.pk, status='PURCHASED').update(
+                    status='USED', used_at=scanned_at, last_modified=timezone.now()
+                )
+                if admitted:
+                    record_transition(event.id, 'PURCHASED', 'USED')
+                    ticket.status, ticket.used_at = 'USED', scanned_at
+                    result.update(result='admitted', first_used_at=scanned_at)
+                    continue
+                ticket.refresh_from_db(fields=['status', 'used_at'])  # Admitted online meanwhile
+
+            result['conflict'] = True
+            if ticket.used_at is None or scanned_at < ticket.used_at:
+                Ticket.objects.filter(pk=ticket.pk).update(used_at=scanned_at, last_modified=timezone.now())
+                ticket.used_at = scanned_at
+                result['result'] = 'admitted'
+            else:
+                result['result'] = 'duplicate'
+            result['first_used_at'] = ticket.used_at
+
+    scan_log.record([{
+        'code': scan['code'],
+        'scanned_at': scan['scanned_at'],
+        'event_id': event.id,
+        'ticket_id': tickets[code].id if code in tickets else None,
+        'result': OFFLINE_RESULTS[result['result']],
+        'source': 'offline',
+        'gate': gate,
+        'scanned_by_id': getattr(scanned_by, 'pk', None),
+    } for scan, code, result in zip(scans, codes, results)])
+    return results
@@ -14,13 +14,17 @@ import string
 
 def generate_unique_code(apps, schema_editor):
     Ticket = apps.get_model('tickets', 'Ticket')
-    for ticket in Ticket.objects.all():
-        while True:
+    # Load the codes already in use once instead of querying for every candidate
+    used = set(Ticket.objects.exclude(unique_code__isnull=True).values_list('unique_code', flat=True))
+    tickets = []
+    for ticket in Ticket.objects.only('id').iterator():
+        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=17))
+        while code in used:
             code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=17))
-            if not Ticket.objects.filter(unique_code=code).exists():
-                ticket.unique_code = code
-                ticket.save()
-                break
+        used.add(code)
+        ticket.unique_code = code
+        tickets.append(ticket)
+    Ticket.objects.bulk_update(tickets, ['unique_code'], batch_size=500)
 
 class Migration(migrations.Migration):
     dependencies = [
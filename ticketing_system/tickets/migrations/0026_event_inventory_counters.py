@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:20
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_counters(apps, schema_editor):
+    Event = apps.get_model('tickets', 'Event')
+    Ticket = apps.get_model('tickets', 'Ticket')
+    rows = Ticket.objects.values('event_id').order_by().annotate(
+        available_count=Count('id', filter=Q(status='AVAILABLE')),
+        sold_count=Count('id', filter=Q(status__in=['PURCHASED', 'USED'])),
+        used_count=Count('id', filter=Q(status='USED')),
+    )
+    for row in rows:
+        Event.objects.filter(pk=row.pop('event_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0025_codesequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='available_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='sold_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='used_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0026_event_inventory_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['event', 'user'], name='ticket_event_user_idx'),
+        ),
+    ]
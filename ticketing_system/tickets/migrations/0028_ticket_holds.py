@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0027_ticket_event_user_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='held_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='status',
+            field=models.CharField(choices=[('AVAILABLE', 'Available'), ('HELD', 'Held'), ('PURCHASED', 'Purchased'), ('USED', 'Used'), ('EXPIRED', 'Expired')], default='AVAILABLE', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['status', 'hold_expires_at'], name='ticket_status_hold_idx'),
+        ),
+    ]
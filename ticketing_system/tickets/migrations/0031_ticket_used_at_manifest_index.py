@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0030_reconciliation_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='used_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['event', 'last_modified'], name='ticket_event_modified_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tickets', '0031_ticket_used_at_manifest_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scanned_at', models.DateTimeField()),
+                ('code', models.CharField(max_length=255)),
+                ('result', models.CharField(choices=[('ADMITTED', 'Admitted'), ('DUPLICATE', 'Already used'), ('REJECTED', 'Not admissible'), ('INVALID', 'Invalid code')], max_length=10)),
+                ('message', models.CharField(blank=True, max_length=255)),
+                ('source', models.CharField(choices=[('api', 'Validation API'), ('url', 'Validation URL'), ('batch', 'Batch validation'), ('socket', 'Scanner socket'), ('offline', 'Offline upload')], max_length=10)),
+                ('gate', models.CharField(blank=True, max_length=100)),
+                ('event', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='tickets.event')),
+                ('scanned_by', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('ticket', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='tickets.ticket')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['event', 'scanned_at'], name='scanlog_event_time_idx'), models.Index(fields=['ticket', 'scanned_at'], name='scanlog_ticket_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0032_scan_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventStatsSnapshot',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='tickets.event')),
+                ('version', models.PositiveBigIntegerField()),
+                ('data', models.JSONField()),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='stats_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0033_event_stats_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='transaction_user_time_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0034_transaction_history_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['used', 'expiry_date'], name='token_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['expiry_date', 'id'], name='token_expiry_idx'),
+        ),
+    ]
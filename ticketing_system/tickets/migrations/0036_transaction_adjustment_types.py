@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0035_token_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_type',
+            field=models.CharField(choices=[('PURCHASE', 'Token Purchase'), ('REDEMPTION', 'Token Redemption'), ('TICKET_PURCHASE', 'Ticket Purchase'), ('ADJUSTMENT_CREDIT', 'Staff Adjustment (Credit)'), ('ADJUSTMENT_DEBIT', 'Staff Adjustment (Debit)')], max_length=20),
+        ),
+    ]
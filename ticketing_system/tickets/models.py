@@ -3,15 +3,20 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.core.files.base import ContentFile
 from django.core.files import File
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-import qrcode
 import uuid
-from io import BytesIO
+from django.conf import settings
+from django.urls import reverse
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.validators import MinValueValidator
 from django.db import transaction
 from django.core.exceptions import ValidationError
+from . import announcements, gate_cache, stats
+from .codes import new_code
+from .inventory import record_created
+from .qr import fingerprint, render_png
+from .qr_signing import sign_ticket
 
 
 class Event(models.Model):
@@ -25,17 +30,36 @@ class Event(models.Model):
     )
     ticket_count = models.PositiveIntegerField(default=10)
     max_purchase_per_user = models.PositiveIntegerField(default=5)
+    # Inventory counters kept in step with the ticket table (see inventory.py)
+    available_count = models.PositiveIntegerField(default=0, editable=False)
+    sold_count = models.PositiveIntegerField(default=0, editable=False)
+    used_count = models.PositiveIntegerField(default=0, editable=False)
+    held_count = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped with every change to the numbers above and on edits (see stats.py)
+    stats_version = models.PositiveBigIntegerField(default=0, editable=False)
+
+    TRACKED_FIELDS = ('available_count', 'held_count', 'sold_count', 'used_count', 'stats_version')
+
+    def save(self, *args, **kwargs):
+        # Edits must not write back counters read before concurrent purchases or scans
+        if not self._state.adding and not kwargs.get('update_fields') and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.TRACKED_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
     def available_tickets(self):
-        return self.ticket_count - self.tickets.filter(status='PURCHASED').count()
+        return self.available_count
 
 
 class Ticket(models.Model):
     STATUS_CHOICES = [
         ('AVAILABLE', 'Available'),
+        ('HELD', 'Held'),  # Reserved for a buyer until hold_expires_at (see holds.py)
         ('PURCHASED', 'Purchased'),
         ('USED', 'Used'),
         ('EXPIRED', 'Expired')
@@ -48,31 +72,40 @@ class Ticket(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='AVAILABLE')
     purchased_at = models.DateTimeField(null=True, blank=True)  # Set when ticket is actually purchased
+    hold_expires_at = models.DateTimeField(null=True, blank=True)
+    used_at = models.DateTimeField(null=True, blank=True)  # First admission, possibly scanned offline
     last_modified = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Per-user purchase limit checks count a user's tickets for one event
+            models.Index(fields=['event', 'user'], name='ticket_event_user_idx'),
+            # The hold sweeper walks expired holds in expiry order
+            models.Index(fields=['status', 'hold_expires_at'], name='ticket_status_hold_idx'),
+            # Gate manifests are versioned by last_modified (see manifests.py)
+            models.Index(fields=['event', 'last_modified'], name='ticket_event_modified_idx'),
+        ]
+
     def generate_unique_code(self):
-        while True:
-            code = uuid.uuid4().hex[:17].upper()
-            if not Ticket.objects.filter(unique_code=code).exists():
-                return code
+        # Allocated from a keyed permutation, so no existence check is needed
+        return new_code()
+
+    def qr_payload(self):
+        """Signed text encoded in the ticket's QR code (see qr_signing.py)"""
+        return sign_ticket(self)
+
+    @property
+    def qr_url(self):
+        # Pre-rendered image if one was stored, otherwise the on-demand endpoint
+        if self.qr_code:
+            return self.qr_code.url
+        # Versioned by payload so the long-lived cached image changes with the signing key
+        return f"{reverse('ticket_qr', args=[self.unique_code, 'png'])}?v={fingerprint(self.qr_payload(), 'png')[-12:]}"
 
     def generate_qr_code(self):
-        # Your QR generation logic
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(f"Ticket ID: {self.id}, Code: {self.unique_code}")
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        
+        """Render the QR image and store it in ``qr_code`` (does not save the model)"""
         filename = f"ticket_{self.unique_code}.png"
-        self.qr_code.save(filename, ContentFile(buffer.getvalue()), save=False)
+        self.qr_code.save(filename, ContentFile(render_png(self.qr_payload())), save=False)
 
     def clean(self):
         super().clean()
@@ -96,9 +129,15 @@ class Ticket(models.Model):
         # This check should ideally be for new objects or when relevant fields change
         is_new_object = not self.pk
 
-        super().save(*args, **kwargs)  # Save the model first
-
-        if is_new_object and not self.qr_code.name:
+        with transaction.atomic():
+            super().save(*args, **kwargs)  # Save the model first
+            if is_new_object:
+                record_created(self.event_id, self.status)
+
+        # QR images are served on demand by the ticket_qr view; eager rendering
+        # is only done when TICKET_EAGER_QR_CODES is enabled.
+        eager_qr = getattr(settings, 'TICKET_EAGER_QR_CODES', False)
+        if eager_qr and is_new_object and not self.qr_code.name:
             self.generate_qr_code()  # Generates and saves the QR image file to storage
                                      # This method calls self.qr_code.save(..., save=False)
             # Now, save the model again to persist the self.qr_code.name (path to image) in the database
@@ -112,6 +151,15 @@ class Ticket(models.Model):
         return False
 
 
+class CodeSequence(models.Model):
+    """Counter that ticket code allocators reserve blocks of values from (see codes.py)"""
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     phone = models.CharField(max_length=20, blank=True)
@@ -128,24 +176,36 @@ class Profile(models.Model):
     last_otp = models.CharField(max_length=6, blank=True)
     otp_expiry = models.DateTimeField(null=True, blank=True)
 
+    def save(self, *args, **kwargs):
+        # Credits only change through the ledger's F() updates (see ledger.py); a full
+        # save of a profile loaded earlier, e.g. on every login, must not write them back
+        if not self._state.adding and not kwargs.get('update_fields') and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'credits'
+            ]
+        super().save(*args, **kwargs)
+
     def set_pin(self, raw_pin):
         self.pin = make_password(raw_pin)
     
     def check_pin(self, raw_pin):
         return check_password(raw_pin, self.pin)
 
-    def deduct_credits(self, amount):
-        with transaction.atomic():
-            if self.credits >= amount:
-                self.credits -= amount
-                self.save()
-                return True
+    def deduct_credits(self, amount, transaction_type='TICKET_PURCHASE'):
+        from .ledger import InsufficientCredits, debit
+
+        try:
+            entry = debit(self.user, amount, transaction_type)
+        except InsufficientCredits:
             return False
+        self.credits = entry.balance_after
+        return True
 
-    def add_credits(self, amount):
-        with transaction.atomic():
-            self.credits += amount
-            self.save()
+    def add_credits(self, amount, transaction_type='REDEMPTION'):
+        from .ledger import credit
+
+        self.credits = credit(self.user, amount, transaction_type).balance_after
 
 class Token(models.Model):
     code = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
@@ -168,6 +228,14 @@ class Token(models.Model):
     )
     used_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Status filters and counts on the token dashboard
+            models.Index(fields=['used', 'expiry_date'], name='token_status_idx'),
+            # Keyset pages of the unfiltered list (see pagination.py)
+            models.Index(fields=['expiry_date', 'id'], name='token_expiry_idx'),
+        ]
+
     def __str__(self):
         return f"Token {self.code} - ${self.amount}"
 
@@ -214,6 +282,42 @@ def save_user_profile(sender, instance, **kwargs):
     if hasattr(instance, 'profile'):
         instance.profile.save()
 
+
+@receiver(post_save, sender=Event)
+def bump_event_stats(sender, instance, created, **kwargs):
+    if created:
+        stats.invalidate([])  # Nothing to version yet, but the dashboard lists it
+    else:
+        stats.record_change([instance.id])
+
+
+@receiver(post_save, sender=Event)
+def refresh_event_caches(sender, instance, created, **kwargs):
+    # Scans check expiry against the event's current date (see validation.py)
+    if not created:
+        from .validation import forget_event_summary
+
+        forget_event_summary(instance.id)
+        gate_cache.invalidate(instance.id)
+
+
+@receiver(post_delete, sender=Event)
+def drop_event_stats(sender, instance, **kwargs):
+    stats.invalidate([instance.id])
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def bump_token_stats(sender, **kwargs):
+    stats.invalidate([stats.TOKENS])
+
+
+@receiver(post_save, sender=Ticket)
+def invalidate_gate_cache(sender, instance, created, update_fields=None, **kwargs):
+    # New tickets aren't cached yet and QR renders don't change validity
+    if not created and set(update_fields or ()) != {'qr_code'}:
+        gate_cache.invalidate(instance.event_id)
+
 class Announcement(models.Model):
     PRIORITY_CHOICES = [
         ('LOW', 'Low'),
@@ -237,6 +341,12 @@ class Announcement(models.Model):
         return self.title
 
 
+@receiver(post_save, sender=Announcement)
+@receiver(post_delete, sender=Announcement)
+def bump_announcement_feed(sender, **kwargs):
+    announcements.invalidate()
+
+
 class Transaction(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -244,5 +354,84 @@ class Transaction(models.Model):
     transaction_type = models.CharField(max_length=20, choices=[
         ('PURCHASE', 'Token Purchase'),
         ('REDEMPTION', 'Token Redemption'),
-        ('TICKET_PURCHASE', 'Ticket Purchase')
-    ])
\ No newline at end of file
+        ('TICKET_PURCHASE', 'Ticket Purchase'),
+        ('ADJUSTMENT_CREDIT', 'Staff Adjustment (Credit)'),
+        ('ADJUSTMENT_DEBIT', 'Staff Adjustment (Debit)'),
+    ])
+    # Balance right after this entry; empty on rows written before the ledger
+    balance_after = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pages of a user's history (see pagination.py)
+            models.Index(fields=['user', '-timestamp', '-id'], name='transaction_user_time_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # The ledger is append-only (see ledger.py)
+        if not self._state.adding:
+            raise ValueError("Transactions cannot be modified once recorded")
+        super().save(*args, **kwargs)
+
+
+class ReconciliationCheckpoint(models.Model):
+    """Newest ledger row covered by the last credit reconciliation run"""
+    name = models.CharField(max_length=50, unique=True)
+    last_transaction_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ScanLog(models.Model):
+    """
+    One scan at a gate, admitted or not. Rows are buffered in memory and
+    written in bulk by scan_log.py, and never changed afterwards. The foreign
+    keys carry no database constraint so history survives deleted tickets.
+    """
+    RESULT_CHOICES = [
+        ('ADMITTED', 'Admitted'),
+        ('DUPLICATE', 'Already used'),
+        ('REJECTED', 'Not admissible'),  # Unsold, held or expired ticket
+        ('INVALID', 'Invalid code'),  # Forged, malformed, unknown or for another event
+    ]
+    SOURCE_CHOICES = [
+        ('api', 'Validation API'),
+        ('url', 'Validation URL'),
+        ('batch', 'Batch validation'),
+        ('socket', 'Scanner socket'),
+        ('offline', 'Offline upload'),
+    ]
+
+    scanned_at = models.DateTimeField()
+    event = models.ForeignKey(Event, on_delete=models.DO_NOTHING, db_constraint=False,
+                              null=True, blank=True, related_name='+')
+    ticket = models.ForeignKey(Ticket, on_delete=models.DO_NOTHING, db_constraint=False,
+                               null=True, blank=True, related_name='+')
+    code = models.CharField(max_length=255)
+    result = models.CharField(max_length=10, choices=RESULT_CHOICES)
+    message = models.CharField(max_length=255, blank=True)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    gate = models.CharField(max_length=100, blank=True)
+    scanned_by = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False,
+                                   null=True, blank=True, related_name='+')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['event', 'scanned_at'], name='scanlog_event_time_idx'),
+            models.Index(fields=['ticket', 'scanned_at'], name='scanlog_ticket_time_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Scan log entries cannot be modified once recorded")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.code} {self.result} at {self.scanned_at:%Y-%m-%d %H:%M:%S}"
+
+
+class EventStatsSnapshot(models.Model):
+    """Database copy of an event's stats snapshot, valid while ``version`` matches the event's"""
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    version = models.PositiveBigIntegerField()
+    data = models.JSONField()
+    computed_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,83 @@
+"""
+Keyset (cursor) pagination for long lists such as transaction histories.
+
+Pages are ordered on a unique key, e.g. ``('timestamp', 'id')``, and the next
+page starts after the last row of the previous one:
+``WHERE (timestamp, id) < (last_timestamp, last_id)``. With an index on the
+key every page is an index range scan of ``size + 1`` rows however deep it
+is, unlike OFFSET pagination, which reads and throws away all earlier rows.
+Rows added while someone pages don't shift or repeat what they see.
+
+A cursor is the key of the last row shown, as URL-safe base64 JSON. It only
+says where to start, so filtering the queryset (e.g. by user) is still what
+decides which rows can be seen.
+"""
+import base64
+import json
+from dataclasses import dataclass
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Page:
+    items: list
+    next_cursor: str  # None on the last page
+    first: bool
+
+
+def _json_default(value):
+    # Unlike DjangoJSONEncoder, keeps microseconds; the cursor must match the row exactly
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def encode_cursor(values):
+    data = json.dumps(list(values), default=_json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, key):
+    """The key values in ``cursor``, converted to ``model``'s field types"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(key):
+            raise ValueError('wrong length')
+        return [model._meta.get_field(name).to_python(value) for name, value in zip(key, values)]
+    except (ValueError, TypeError, ValidationError) as e:
+        raise InvalidCursor(f'Invalid cursor: {e}')
+
+
+def after(key, values, descending=True):
+    """``Q`` for the rows that come after ``values`` in ``key`` order"""
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for i, name in enumerate(key):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)
+        tie = {prior: values[j] for j, prior in enumerate(key[:i])}
+        condition |= Q(**tie, **{f'{name}__{lookup}': values[i]})
+    return condition
+
+
+def keyset_page(queryset, key, cursor=None, size=50, descending=True):
+    """
+    One page of ``queryset`` ordered on ``key``, the page after ``cursor``
+    when one is given. Raises ``InvalidCursor`` for cursors that don't decode.
+    """
+    ordering = [f'-{name}' if descending else name for name in key]
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(after(key, decode_cursor(cursor, queryset.model, key), descending))
+    rows = list(queryset[:size + 1])
+    items = rows[:size]
+    next_cursor = None
+    if len(rows) > size:
+        last = items[-1]
+        next_cursor = encode_cursor(
+            last[name] if isinstance(last, dict) else getattr(last, name) for name in key
+        )
+    return Page(items, next_cursor, first=not cursor)
@@ -0,0 +1,187 @@
+"""
+QR code rendering.
+
+Images are rendered from a ticket's QR payload when they are requested rather
+than when the ticket is created. Rendered images are kept in a bounded
+in-process LRU and, when the ``qr_codes`` cache alias is configured, in that
+(file based) cache so other workers and restarts can reuse them.
+
+Printed tickets can be pre-rendered in bulk with ``prerender_event_qr_codes``
+(or ``manage.py prerender_qr_codes``).
+"""
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.core.files.base import ContentFile
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+CACHE_ALIAS = 'qr_codes'
+MEMORY_CACHE_SIZE = getattr(settings, 'QR_MEMORY_CACHE_SIZE', 512)
+
+
+def _make_qr(data, image_factory=None):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+        image_factory=image_factory,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def render_png(data):
+    img = _make_qr(data).make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_svg(data):
+    img = _make_qr(data, image_factory=qrcode.image.svg.SvgPathImage).make_image()
+    buffer = BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    'png': render_png,
+    'svg': render_svg,
+}
+
+
+def fingerprint(data, fmt):
+    return f"{fmt}-{hashlib.sha256(data.encode()).hexdigest()[:32]}"
+
+
+def etag_for(data, fmt):
+    return f'"{fingerprint(data, fmt)}"'
+
+
+def _disk_cache():
+    try:
+        return caches[CACHE_ALIAS]
+    except InvalidCacheBackendError:
+        return None
+
+
+@lru_cache(maxsize=MEMORY_CACHE_SIZE)
+def render(data, fmt='png'):
+    """Return the image bytes for ``data`` in ``fmt``, using the caches when possible."""
+    cache = _disk_cache()
+    key = f'qr:{fingerprint(data, fmt)}'
+    if cache is not None:
+        image = cache.get(key)
+        if image is not None:
+            return image
+
+    image = RENDERERS[fmt](data)
+    if cache is not None:
+        cache.set(key, image, timeout=None)
+    return image
+
+
+def _render_batch(items):
+    """Process pool worker: render PNGs for ``[(ticket_id, code, payload), ...]``"""
+    return [(ticket_id, code, render_png(payload)) for ticket_id, code, payload in items]
+
+
+def prerender_event_qr_codes(event, workers=None, chunk_size=1000, progress=None):
+    """
+    Render and store PNG images for every ticket of ``event`` that has none yet.
+
+    Rendering is spread over a ``ProcessPoolExecutor``; images are written to
+    storage and the ``qr_code`` column is updated one chunk at a time, so an
+    interrupted run resumes where it stopped. ``progress`` is called as
+    ``progress(done, total, rate)`` after each chunk. Returns ``(done, seconds)``.
+    """
+    from django.core.files.storage import default_storage
+    from django.db import transaction
+    from .models import Ticket
+
+    pending = Ticket.objects.filter(event=event, qr_code='').order_by('id')
+    total = pending.count()
+    workers = workers or os.cpu_count() or 1
+    batch_size = max(1, chunk_size // (workers * 4))
+    done = 0
+    last_id = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            tickets = list(pending.filter(id__gt=last_id)[:chunk_size])
+            if not tickets:
+                break
+            last_id = tickets[-1].id
+
+            for ticket in tickets:
+                ticket.event = event  # The signed payload needs the event date; avoid a query per ticket
+            items = [(t.id, t.unique_code, t.qr_payload()) for t in tickets]
+            batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+            names = {}
+            for results in pool.map(_render_batch, batches):
+                for ticket_id, code, image in results:
+                    name = f"qr_codes/ticket_{code}.png"
+                    if default_storage.exists(name):
+                        default_storage.delete(name)  # Left over from an interrupted run
+                    names[ticket_id] = default_storage.save(name, ContentFile(image))
+
+            for ticket in tickets:
+                ticket.qr_code.name = names[ticket.id]
+            with transaction.atomic():
+                Ticket.objects.bulk_update(tickets, ['qr_code'])
+
+            done += len(tickets)
+            elapsed = time.perf_counter() - start
+            logger.debug(f"Pre-rendered {done}/{total} QR codes for Event ID: {event.id}")
+            if progress:
+                progress(done, total, done / elapsed if elapsed else 0.0)
+
+    return done, time.perf_counter() - start
+
+
+def clear_stored_qr_codes(event_ids=None, chunk_size=1000):
+    """
+    Delete stored QR images and blank ``qr_code`` so tickets fall back to the
+    on-demand endpoint, which renders the current payload. Used to move
+    tickets printed with an old payload format (or key) to the new one.
+    Returns the number of tickets cleared.
+    """
+    from django.core.files.storage import default_storage
+    from .models import Ticket
+
+    stored = Ticket.objects.exclude(qr_code='').order_by('id')
+    if event_ids is not None:
+        stored = stored.filter(event_id__in=event_ids)
+    cleared = 0
+    last_id = 0
+
+    while True:
+        rows = list(stored.filter(id__gt=last_id).values_list('id', 'qr_code')[:chunk_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        Ticket.objects.filter(id__in=[ticket_id for ticket_id, _ in rows]).update(qr_code='')
+        for _, name in rows:
+            if default_storage.exists(name):
+                default_storage.delete(name)
+        cleared += len(rows)
+
+    return cleared
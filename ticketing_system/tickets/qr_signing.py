@@ -0,0 +1,131 @@
+"""
+Signed QR payloads.
+
+A ticket's QR code carries everything needed to check it offline::
+
+    T1.<key version>.<event id>.<ticket id>.<code>.<expiry>.<mac>
+
+``expiry`` is a unix timestamp (the event date plus ``TICKET_QR_GRACE_HOURS``
+at signing time) and ``mac`` is a truncated HMAC-SHA256 over the rest, keyed
+by the version in the payload. ``verify`` rejects forged, tampered or garbage
+scans without touching the database.
+
+Printed and emailed codes outlive edits to the event, so whether a ticket
+has expired is decided at the gate from the event's current date
+(``has_expired``), not from the signed ``expiry``. The signed value only
+tells how long codes signed with a key stay in circulation, i.e. when that
+key can be retired.
+
+Keys live in ``TICKET_QR_KEYS`` (``{version: secret}``) and new payloads are
+signed with ``TICKET_QR_KEY_VERSION``. To rotate, add a new version, make it
+current, and drop the old one once tickets signed with it are no longer in
+circulation. Without configuration, version 1 is derived from SECRET_KEY.
+
+Tickets issued before signing carry ``Ticket ID: X, Code: Y`` (or just the
+code). They are still looked up in the database while
+``TICKET_QR_ACCEPT_LEGACY`` is on; ``manage.py resign_qr_codes`` replaces
+their stored images so they are served with signed payloads instead.
+"""
+import base64
+import hashlib
+import hmac
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+
+PREFIX = 'T1'
+SEPARATOR = '.'
+MAC_BYTES = 12
+
+
+class InvalidPayload(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Claims:
+    key_version: int
+    event_id: int
+    ticket_id: int
+    code: str
+    expires_at: int
+
+
+def signing_keys():
+    configured = getattr(settings, 'TICKET_QR_KEYS', None) or {1: settings.SECRET_KEY}
+    return {
+        int(version): hashlib.blake2b(secret.encode(), person=b'ticket-qr', digest_size=32).digest()
+        for version, secret in configured.items()
+    }
+
+
+def current_key_version():
+    return int(getattr(settings, 'TICKET_QR_KEY_VERSION', 1))
+
+
+def _mac(key, message):
+    digest = hmac.new(key, message.encode(), hashlib.sha256).digest()[:MAC_BYTES]
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def sign(event_id, ticket_id, code, expires_at, key_version=None):
+    key_version = current_key_version() if key_version is None else key_version
+    message = SEPARATOR.join(str(part) for part in (PREFIX, key_version, event_id, ticket_id, code, int(expires_at)))
+    return f"{message}{SEPARATOR}{_mac(signing_keys()[key_version], message)}"
+
+
+def expiry_at(event_date):
+    """Unix time after which tickets for an event starting at ``event_date`` are no longer admitted"""
+    grace = getattr(settings, 'TICKET_QR_GRACE_HOURS', 24)
+    return int(event_date.timestamp()) + grace * 3600
+
+
+def expiry_for(event):
+    return expiry_at(event.date)
+
+
+def has_expired(expires_at, now=None):
+    return expires_at < (time.time() if now is None else now)
+
+
+def sign_ticket(ticket):
+    return sign(ticket.event_id, ticket.id, ticket.unique_code, expiry_for(ticket.event))
+
+
+def is_signed(data):
+    return data.startswith(PREFIX + SEPARATOR)
+
+
+def verify(data):
+    """
+    Return the ``Claims`` of a signed payload or raise ``InvalidPayload``.
+    Never queries; expiry is checked against the event by the caller.
+    """
+    parts = data.split(SEPARATOR)
+    if len(parts) != 7 or parts[0] != PREFIX:
+        raise InvalidPayload('Malformed ticket code')
+    message, mac = data.rsplit(SEPARATOR, 1)
+    try:
+        claims = Claims(int(parts[1]), int(parts[2]), int(parts[3]), parts[4], int(parts[5]))
+    except ValueError:
+        raise InvalidPayload('Malformed ticket code')
+
+    key = signing_keys().get(claims.key_version)
+    if key is None:
+        raise InvalidPayload('Ticket code was signed with a retired key')
+    if not hmac.compare_digest(mac, _mac(key, message)):
+        raise InvalidPayload('Ticket code signature is invalid')
+    return claims
+
+
+def parse_legacy(data):
+    """
+    Ticket code from a pre-signing payload (``Ticket ID: X, Code: Y`` or a bare
+    code), or ``None`` if legacy payloads are no longer accepted.
+    """
+    if not getattr(settings, 'TICKET_QR_ACCEPT_LEGACY', True):
+        return None
+    if 'Code:' in data:
+        return data.split('Code:', 1)[1].split(',')[0].strip() or None
+    return data.strip() or None
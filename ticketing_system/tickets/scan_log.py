@@ -0,0 +1,127 @@
+"""
+Scan history for the gates.
+
+Every scan (admitted, duplicate, rejected or invalid) is appended to
+``ScanLog``, but never from the request that made it: ``record`` only
+appends a dict to an in-process buffer. A background thread writes the
+buffer with ``bulk_create`` every ``FLUSH_SECONDS``, or as soon as it holds
+``FLUSH_SIZE`` entries, and an ``atexit`` hook writes whatever is left when
+the process shuts down gracefully (gunicorn/daphne workers exit normally on
+SIGTERM). A crash loses at most the last few seconds of history.
+
+If a flush fails the entries go back into the buffer for the next one. The
+buffer is capped at ``MAX_BUFFER`` entries; past that the oldest are dropped
+with a warning rather than letting a database outage exhaust memory.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'FLUSH_SIZE': 500,
+    'FLUSH_SECONDS': 2.0,
+    'MAX_BUFFER': 50000,
+    'BACKGROUND': True,  # Off to flush only when flush() is called
+}
+
+_buffer = []
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_wake = threading.Event()
+_thread = None
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'SCAN_LOG', {})}
+
+
+def result_for(verdict):
+    """``ScanLog`` result for a verdict as returned by validation.validate_codes"""
+    if verdict['status'] != 'success':
+        return 'INVALID'
+    if verdict['ticket']['is_valid']:
+        return 'ADMITTED'
+    return 'DUPLICATE' if verdict['ticket']['status'] == 'USED' else 'REJECTED'
+
+
+def record(entries):
+    """
+    Queue scans for the log. Each entry is a dict of ``ScanLog`` field values
+    (``event_id``, ``ticket_id``, ``code``, ``result``, ...); ``scanned_at``
+    defaults to now. Never touches the database.
+    """
+    options = config()
+    if not options['ENABLED'] or not entries:
+        return
+    now = timezone.now()
+    with _lock:
+        for entry in entries:
+            entry.setdefault('scanned_at', now)
+            entry['code'] = entry['code'][:255]
+            entry['message'] = entry.get('message', '')[:255]
+        _buffer.extend(entries)
+        overflow = len(_buffer) - options['MAX_BUFFER']
+        if overflow > 0:
+            del _buffer[:overflow]
+            logger.warning(f"Scan log buffer full, dropped {overflow} oldest entries")
+        pending = len(_buffer)
+    if options['BACKGROUND']:
+        _ensure_thread()
+        if pending >= options['FLUSH_SIZE']:
+            _wake.set()
+
+
+def flush():
+    """Write everything buffered so far; returns the number of entries written"""
+    from . import stats
+    from .models import ScanLog
+
+    with _flush_lock:
+        with _lock:
+            entries = _buffer[:]
+            del _buffer[:]
+        if not entries:
+            return 0
+        try:
+            ScanLog.objects.bulk_create([ScanLog(**entry) for entry in entries], batch_size=500)
+        except Exception:
+            logger.exception(f"Scan log flush of {len(entries)} entries failed, will retry")
+            with _lock:
+                _buffer[:0] = entries  # Keep them ahead of newer scans
+            return 0
+        # Cache only: a version bump here would write to the event rows on every flush
+        stats.invalidate({entry['event_id'] for entry in entries if entry.get('event_id')}, dashboard=False)
+    return len(entries)
+
+
+def discard():
+    with _lock:
+        del _buffer[:]
+
+
+def _run():
+    while True:
+        _wake.wait(config()['FLUSH_SECONDS'])
+        _wake.clear()
+        close_old_connections()
+        flush()
+
+
+def _ensure_thread():
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name='scan-log-flush', daemon=True)
+            _thread.start()
+
+
+atexit.register(flush)
@@ -6,6 +6,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const modalCurrentBalanceEl = document.getElementById('currentBalance'); // In modal
     const pageAccountBalanceEl = document.getElementById('accountBalance'); // On page
     const insufficientFundsAlertEl = document.getElementById('insufficientFundsAlert');
+    const quantityInputEl = document.getElementById('purchaseQuantity');
 
     // Toast elements
     const purchaseToastEl = document.getElementById('purchaseToast');
@@ -16,6 +17,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const errorToastInstance = errorToastEl ? new bootstrap.Toast(errorToastEl) : null;
 
     let eventIdToPurchase = null; // To store the event ID for the confirm button
+    let eventPriceToPurchase = 0;
     let originalConfirmButtonText = confirmPurchaseButton ? confirmPurchaseButton.innerHTML : "Confirm Purchase";
 
     const confirmationModalInstance = confirmationModalEl ? new bootstrap.Modal(confirmationModalEl) : null;
@@ -25,29 +27,49 @@ document.addEventListener('DOMContentLoaded', function() {
         button.addEventListener('click', function() {
             eventIdToPurchase = this.dataset.eventId;
             const eventName = this.dataset.eventName;
-            const eventPrice = parseFloat(this.dataset.eventPrice);
-            const currentAccountBalance = parseFloat(pageAccountBalanceEl.textContent.replace('$', ''));
+            eventPriceToPurchase = parseFloat(this.dataset.eventPrice);
 
             if (modalEventNameEl) modalEventNameEl.textContent = eventName;
-            if (chargeAmountEl) chargeAmountEl.textContent = eventPrice.toFixed(2);
-            if (modalCurrentBalanceEl) modalCurrentBalanceEl.textContent = currentAccountBalance.toFixed(2);
-
-            if (currentAccountBalance < eventPrice) {
-                if (insufficientFundsAlertEl) insufficientFundsAlertEl.classList.remove('d-none');
-                if (confirmPurchaseButton) {
-                    confirmPurchaseButton.disabled = true;
-                    confirmPurchaseButton.innerHTML = "Insufficient Credits";
-                }
-            } else {
-                if (insufficientFundsAlertEl) insufficientFundsAlertEl.classList.add('d-none');
-                if (confirmPurchaseButton) {
-                    confirmPurchaseButton.disabled = false;
-                    confirmPurchaseButton.innerHTML = originalConfirmButtonText;
-                }
+            if (quantityInputEl) {
+                quantityInputEl.value = 1;
+                quantityInputEl.max = this.dataset.maxQuantity || 1;
             }
+            updatePurchaseTotal();
         });
     });
 
+    if (quantityInputEl) {
+        quantityInputEl.addEventListener('input', updatePurchaseTotal);
+    }
+
+    function selectedQuantity() {
+        const quantity = quantityInputEl ? parseInt(quantityInputEl.value, 10) : 1;
+        return Number.isNaN(quantity) || quantity < 1 ? 1 : quantity;
+    }
+
+    // Recalculate the charge for the chosen quantity and check it against the balance
+    function updatePurchaseTotal() {
+        const totalPrice = eventPriceToPurchase * selectedQuantity();
+        const currentAccountBalance = parseFloat(pageAccountBalanceEl.textContent.replace('$', ''));
+
+        if (chargeAmountEl) chargeAmountEl.textContent = totalPrice.toFixed(2);
+        if (modalCurrentBalanceEl) modalCurrentBalanceEl.textContent = currentAccountBalance.toFixed(2);
+
+        if (currentAccountBalance < totalPrice) {
+            if (insufficientFundsAlertEl) insufficientFundsAlertEl.classList.remove('d-none');
+            if (confirmPurchaseButton) {
+                confirmPurchaseButton.disabled = true;
+                confirmPurchaseButton.innerHTML = "Insufficient Credits";
+            }
+        } else {
+            if (insufficientFundsAlertEl) insufficientFundsAlertEl.classList.add('d-none');
+            if (confirmPurchaseButton) {
+                confirmPurchaseButton.disabled = false;
+                confirmPurchaseButton.innerHTML = originalConfirmButtonText;
+            }
+        }
+    }
+
     // Event listener for the actual "Confirm Purchase" button in the modal
     if (confirmPurchaseButton) {
         confirmPurchaseButton.addEventListener('click', function() {
@@ -60,13 +82,26 @@ document.addEventListener('DOMContentLoaded', function() {
             this.innerHTML = '<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> Processing...';
             this.disabled = true;
 
-            fetch(`/purchase_ticket/${eventIdToPurchase}/`, {
+            const button = this;
+            // One key per checkout attempt, so network retries are never charged twice
+            const idempotencyKey = window.crypto && crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`;
+            const submitPurchase = () => fetch(`/purchase_ticket/${eventIdToPurchase}/`, {
                 method: 'POST',
                 headers: {
-                    'X-CSRFToken': getCookie('csrftoken'),
+                    'X-CSRFToken': csrfToken(),
                     'Content-Type': 'application/json',
+                    'Idempotency-Key': idempotencyKey,
                 },
-                body: JSON.stringify({}),
+                body: JSON.stringify({ quantity: selectedQuantity() }),
+            });
+
+            submitPurchase()
+            .then(response => {
+                if (response.status === 429) {
+                    // Flash sale: wait for admission from the waiting room, then try again
+                    return waitForAdmission(eventIdToPurchase, button).then(submitPurchase);
+                }
+                return response;
             })
             .then(response => {
                 if (!response.ok) {
@@ -96,6 +131,32 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    function waitForAdmission(eventId, button) {
+        return fetch(`/waiting-room/${eventId}/join/`, {
+                method: 'POST',
+                headers: { 'X-CSRFToken': csrfToken() },
+            })
+            .then(response => response.json())
+            .then(joined => new Promise((resolve, reject) => {
+                const poll = () => {
+                    fetch(`${joined.status_url}?ticket=${encodeURIComponent(joined.queue_ticket)}`)
+                        .then(response => response.json())
+                        .then(status => {
+                            if (!status.success) {
+                                reject(new Error(status.error || 'Lost your place in the queue'));
+                            } else if (status.admitted) {
+                                resolve();
+                            } else {
+                                button.innerHTML = `<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> In queue: ${status.ahead} ahead (~${Math.ceil(status.estimated_wait_seconds)}s)`;
+                                setTimeout(poll, Math.min(5000, Math.max(1000, status.estimated_wait_seconds * 250)));
+                            }
+                        })
+                        .catch(reject);
+                };
+                poll();
+            }));
+    }
+
     function getCookie(name) {
         let cookieValue = null;
         if (document.cookie && document.cookie !== '') {
@@ -111,6 +172,11 @@ document.addEventListener('DOMContentLoaded', function() {
         return cookieValue;
     }
 
+    // CSRF_USE_SESSIONS keeps the token out of cookies, so fall back to the one rendered in the page
+    function csrfToken() {
+        return getCookie('my_csrftoken') || document.querySelector('[name=csrfmiddlewaretoken]')?.value;
+    }
+
     function showAlert(type, message) {
         if (type === 'success' && purchaseToastInstance) {
             // If toast has a body for message, set it here, e.g.,
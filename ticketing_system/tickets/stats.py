@@ -0,0 +1,193 @@
+"""
+Versioned stats snapshots for the staff dashboard and the stats API.
+
+Each event has a ``stats_version`` that moves with every change to its
+numbers. ``inventory.adjust`` bumps it in the same UPDATE as the counters
+(purchases, holds, claims, admissions), and edits and token changes go
+through ``record_change``/``invalidate``. Scan counts are not versioned:
+scan log flushes only drop the cached snapshot, so gate traffic never
+writes to the event row, and the counts are read again with it.
+
+Reads are served from the cache. A snapshot is stored together with a
+cache-side token for its scope (one per event, ``all`` for the dashboard and
+``tokens`` for the token counts), and a change increments the token once its
+transaction commits. Snapshots that depend on the clock, e.g. on tokens
+expiring, also carry a ``valid_until`` after which they are recomputed.
+A snapshot is only served while its token is current, so a repeat read
+costs one ``get_many`` and no SQL. Because the token is read before
+recomputing, a change that lands mid-way is never hidden by the recomputed
+snapshot. On a miss, per-event stats come from ``EventStatsSnapshot`` when
+its version still matches the event's, and are recomputed otherwise.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+DASHBOARD = 'all'
+TOKENS = 'tokens'
+
+
+def _ttl():
+    # Upper bound on staleness for what no write path reports, e.g. tokens expiring
+    return getattr(settings, 'STATS_SNAPSHOT_TTL', 300)
+
+
+def _keys(scope):
+    return f'event-stats:{scope}', f'event-stats:{scope}:token'
+
+
+def invalidate(scopes, dashboard=True):
+    """Drop the snapshots of ``scopes`` (event ids or ``TOKENS``) and of the dashboard once the current transaction commits"""
+    scopes = [*scopes, DASHBOARD] if dashboard else list(scopes)
+
+    def bump():
+        for scope in scopes:
+            try:
+                cache.incr(_keys(scope)[1])
+            except ValueError:
+                pass  # No token, so no snapshot can be current anyway
+    transaction.on_commit(bump)
+
+
+def record_change(event_ids):
+    """Bump the stats version of ``event_ids`` for changes that don't go through the inventory counters"""
+    from .models import Event
+
+    Event.objects.filter(id__in=event_ids).update(stats_version=F('stats_version') + 1)
+    invalidate(event_ids)
+
+
+def _cached(scope, compute):
+    key, token_key = _keys(scope)
+    found = cache.get_many([key, token_key])
+    token, snapshot = found.get(token_key), found.get(key)
+    if snapshot is not None and token is not None and snapshot['token'] == token:
+        valid_until = snapshot['data'].get('valid_until')
+        if valid_until is None or valid_until > timezone.now():
+            return snapshot['data']
+    if token is None:
+        # Random, so snapshots from before an eviction of the token never match again
+        cache.add(token_key, random.getrandbits(62), timeout=None)
+        token = cache.get(token_key)
+    data = compute()
+    cache.set(key, {'token': token, 'data': data}, timeout=_ttl())
+    return data
+
+
+def event_stats(event_id):
+    """Sales, availability, check-in and scan numbers for one event; raises ``Event.DoesNotExist``"""
+    return _cached(event_id, lambda: _with_scans(_stored_event_stats(event_id)))
+
+
+def _with_scans(data):
+    from .models import ScanLog
+
+    scans = dict(ScanLog.objects.filter(event_id=data['event_id']).values_list('result')
+                 .annotate(count=Count('id')).order_by())
+    return {**data, 'scans': {result: scans.get(result, 0) for result, _ in ScanLog.RESULT_CHOICES}}
+
+
+def _stored_event_stats(event_id):
+    from .models import EventStatsSnapshot
+
+    stored = EventStatsSnapshot.objects.filter(
+        event_id=event_id, version=F('event__stats_version')
+    ).values_list('data', flat=True).first()
+    return stored if stored is not None else compute_event_stats(event_id)
+
+
+def compute_event_stats(event_id):
+    from .models import Event, EventStatsSnapshot
+
+    event = Event.objects.only(
+        'name', 'date', 'price', 'ticket_count', 'stats_version',
+        'available_count', 'held_count', 'sold_count', 'used_count',
+    ).get(pk=event_id)
+    issued = event.available_count + event.held_count + event.sold_count
+    data = {
+        'event_id': event.id,
+        'name': event.name,
+        'date': event.date.isoformat(),
+        'version': event.stats_version,
+        'capacity': event.ticket_count,
+        'issued': issued,
+        'available': event.available_count,
+        'held': event.held_count,
+        'sold': event.sold_count,
+        'checked_in': event.used_count,
+        'not_checked_in': event.sold_count - event.used_count,
+        'sell_through': round(100 * event.sold_count / issued, 1) if issued else 0.0,
+        'revenue': str(event.price * event.sold_count),
+        'computed_at': timezone.now().isoformat(),
+    }
+    EventStatsSnapshot.objects.update_or_create(event_id=event_id,
+                                                defaults={'version': event.stats_version, 'data': data})
+    return data
+
+
+def dashboard_stats():
+    """
+    Upcoming events with their numbers, totals over them and the active
+    token count, as plain data. ``version`` changes whenever any of it does.
+    """
+    return _cached(DASHBOARD, compute_dashboard_stats)
+
+
+def compute_dashboard_stats():
+    from .models import Event, Token
+
+    now = timezone.now()
+    events = Event.objects.filter(date__gte=now).order_by('date')
+    rows = list(events.annotate(
+        tickets_total=F('available_count') + F('held_count') + F('sold_count')
+    ).values('id', 'name', 'date', 'tickets_total', 'sold_count', 'used_count', 'stats_version'))
+    totals = events.aggregate(
+        event_count=Count('id'),
+        tickets_total=Coalesce(Sum(F('available_count') + F('held_count') + F('sold_count')), 0),
+        active_tickets=Coalesce(Sum(F('sold_count') - F('used_count')), 0),
+        checked_in=Coalesce(Sum('used_count'), 0),
+    )
+    tokens = Token.objects.filter(used=False, expiry_date__gt=now).aggregate(
+        count=Count('id'), next_expiry=Min('expiry_date')
+    )
+    # The next event to start drops off the list, the next token to expire off the count
+    changes_at = [moment for moment in (rows[0]['date'] if rows else None, tokens['next_expiry']) if moment]
+    return {
+        'version': f"{random.getrandbits(32):08x}",  # New with every recomputation
+        'events': rows,
+        'stats': totals,
+        'active_tokens_count': tokens['count'],
+        'computed_at': now,
+        'valid_until': min(changes_at, default=None),
+    }
+
+
+def token_counts():
+    """
+    Token totals by status (``total``, ``active``, ``used``, ``expired``).
+    As in the dashboard's filter, ``expired`` is every token that is no longer
+    active, used ones included.
+    """
+    return _cached(TOKENS, compute_token_counts)
+
+
+def compute_token_counts():
+    from .models import Token
+
+    now = timezone.now()
+    active = Q(used=False, expiry_date__gt=now)
+    counts = Token.objects.aggregate(  # One pass over token_status_idx
+        total=Count('id'),
+        active=Count('id', filter=active),
+        used_count=Count('id', filter=Q(used=True)),  # An alias can't shadow the field
+        next_expiry=Min('expiry_date', filter=active),
+    )
+    counts['used'] = counts.pop('used_count')
+    counts['expired'] = counts['total'] - counts['active']  # Same rows as token_status_filter('expired')
+    counts['valid_until'] = counts.pop('next_expiry')  # The active count drops then
+    return counts
@@ -5,4 +5,1615 @@ from ticketing_system.asgi import application
 async def test_csrf_protection():
     communicator = WebsocketCommunicator(application, "/ws/chat/")
     connected, _ = await communicator.connect()
-    assert connected is False  # Should fail without CSRF token
\ No newline at end of file
+    assert connected is False  # Should fail without CSRF token
+
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from tickets.issuance import issue_tickets
+from tickets.models import Event, Ticket
+
+
+def make_event(**kwargs):
+    defaults = {
+        'name': 'Test Event',
+        'date': timezone.now() + timedelta(days=7),
+        'location': 'Freetown',
+        'price': Decimal('10.00'),
+        'ticket_count': 100,
+    }
+    defaults.update(kwargs)
+    return Event.objects.create(**defaults)
+
+
+def give_credits(user, amount):
+    """Set a balance directly; Profile.save never writes credits (see ledger.py)"""
+    from tickets.models import Profile
+
+    Profile.objects.filter(user=user).update(credits=amount)
+    user.profile.credits = amount
+
+
+# For tests that scan tickets: the scan log's background thread would write
+# outside the test's transaction (ScanLogTests enable it without the thread)
+without_scan_log = override_settings(SCAN_LOG={'ENABLED': False})
+
+
+class MediaRootMixin:
+    """Keep QR images written during tests out of the project's media directory."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._media_root = tempfile.mkdtemp()
+        cls._media_override = override_settings(MEDIA_ROOT=cls._media_root)
+        cls._media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._media_override.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+        super().tearDownClass()
+
+
+class IssueTicketsTests(MediaRootMixin, TestCase):
+    def test_issues_in_chunks_with_unique_codes(self):
+        event = make_event()
+        calls = []
+
+        created = issue_tickets(event, 250, chunk_size=100, progress=lambda *args: calls.append(args))
+
+        self.assertEqual(created, 250)
+        self.assertEqual(calls, [(100, 250), (200, 250), (250, 250)])
+        codes = list(event.tickets.values_list('unique_code', flat=True))
+        self.assertEqual(len(set(codes)), 250)
+        self.assertTrue(all(len(code) == 17 for code in codes))
+        self.assertFalse(event.tickets.exclude(status='AVAILABLE').exists())
+
+    def test_bulk_create_view_skips_qr_rendering(self):
+        event = make_event(ticket_count=50)
+        staff = User.objects.create_user('staff', password='pw')
+        staff.profile.role = 'staff'
+        staff.profile.save()
+        self.client.force_login(staff)
+
+        response = self.client.post('/bulk-tickets/', {'event': event.id, 'quantity': 40})
+
+        self.assertRedirects(response, '/dashboard/', fetch_redirect_response=False)
+        self.assertEqual(event.tickets.count(), 40)
+        self.assertFalse(event.tickets.exclude(qr_code='').exists())
+
+
+class CodeAllocatorTests(TestCase):
+    def test_codes_are_distinct_and_well_formed(self):
+        from tickets.codes import ALPHABET, allocate_codes
+
+        codes = allocate_codes(2000) + allocate_codes(2000)
+
+        self.assertEqual(len(set(codes)), 4000)
+        for code in codes:
+            self.assertEqual(len(code), 17)
+            self.assertTrue(set(code) <= set(ALPHABET))
+
+    def test_allocation_makes_no_ticket_lookups(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from tickets.codes import allocate_codes
+
+        with CaptureQueriesContext(connection) as queries:
+            allocate_codes(500)
+
+        self.assertFalse([q for q in queries if 'tickets_ticket' in q['sql']])
+        self.assertLessEqual(len(queries), 9)  # counter reservation only, independent of count
+
+    def test_permutation_is_keyed(self):
+        from tickets.codes import permute
+
+        self.assertNotEqual(
+            [permute(n, b'a' * 32) for n in range(5)],
+            [permute(n, b'b' * 32) for n in range(5)],
+        )
+        self.assertEqual(len({permute(n, b'a' * 32) for n in range(10000)}), 10000)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'qr_codes': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'qr-tests'},
+})
+class TicketQRViewTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.ticket = Ticket.objects.create(event=make_event(), user=self.owner, status='PURCHASED')
+        self.url = f'/tickets/{self.ticket.unique_code}/qr.png'
+
+    def test_creation_does_not_render_image(self):
+        self.assertFalse(self.ticket.qr_code)
+        self.assertTrue(self.ticket.qr_url.startswith(self.url + '?v='))
+
+    def test_renders_png_with_cache_headers(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertIn('immutable', response['Cache-Control'])
+
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_renders_svg(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(f'/tickets/{self.ticket.unique_code}/qr.svg')
+
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+
+    def test_other_customers_are_refused(self):
+        self.client.force_login(User.objects.create_user('other', password='pw'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class PrerenderQRCodesTests(MediaRootMixin, TestCase):
+    def test_renders_missing_images_and_resumes(self):
+        from tickets.qr import prerender_event_qr_codes
+
+        event = make_event()
+        issue_tickets(event, 30)
+        event.tickets.filter(id__in=event.tickets.values('id')[:5]).update(qr_code='qr_codes/existing.png')
+
+        done, _ = prerender_event_qr_codes(event, workers=2, chunk_size=10)
+
+        self.assertEqual(done, 25)
+        self.assertFalse(event.tickets.filter(qr_code='').exists())
+        ticket = event.tickets.exclude(qr_code='qr_codes/existing.png').first()
+        self.assertEqual(ticket.qr_code.name, f'qr_codes/ticket_{ticket.unique_code}.png')
+        self.assertEqual(prerender_event_qr_codes(event, workers=2)[0], 0)
+
+
+@without_scan_log
+class InventoryCounterTests(TestCase):
+    def setUp(self):
+        self.event = make_event()
+        self.buyer = User.objects.create_user('buyer', password='pw')
+        give_credits(self.buyer, Decimal('100.00'))
+
+    def counters(self):
+        self.event.refresh_from_db()
+        return self.event.available_count, self.event.sold_count, self.event.used_count
+
+    def test_counters_follow_issue_purchase_and_validation(self):
+        issue_tickets(self.event, 5)
+        self.assertEqual(self.counters(), (5, 0, 0))
+
+        self.client.force_login(self.buyer)
+        self.client.post(f'/purchase_ticket/{self.event.id}/')
+        self.assertEqual(self.counters(), (4, 1, 0))
+
+        code = self.event.tickets.get(status='PURCHASED').unique_code
+        self.client.get('/api/validate-ticket/', {'code': code})
+        self.client.get('/api/validate-ticket/', {'code': code})
+        self.assertEqual(self.counters(), (4, 1, 1))
+        self.assertEqual(self.event.available_tickets(), 4)
+
+    def test_available_tickets_does_not_query(self):
+        issue_tickets(self.event, 3)
+        event = Event.objects.get(pk=self.event.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(event.available_tickets(), 3)
+
+    def test_reconcile_fixes_drift(self):
+        from tickets.inventory import reconcile
+
+        issue_tickets(self.event, 4)
+        self.event.tickets.filter(id=self.event.tickets.first().id).update(status='USED')
+        Event.objects.filter(pk=self.event.pk).update(sold_count=9)
+
+        fixed = reconcile()
+
+        self.assertEqual(len(fixed), 1)
+        self.assertEqual(self.counters(), (3, 1, 1))
+        self.assertEqual(reconcile(), [])
+
+
+class ConcurrentAllocationTests(TransactionTestCase):
+    def test_concurrent_buyers_never_oversell(self):
+        import threading
+        import time
+        from django.db import OperationalError, connection, transaction
+        from tickets.allocation import allocate_tickets
+
+        event = make_event()
+        issue_tickets(event, 20)
+        buyers = [User.objects.create(username=f'buyer{n}') for n in range(8)]
+        claimed = []
+        lock = threading.Lock()
+
+        def buy(user):
+            try:
+                for _ in range(5):
+                    while True:
+                        try:
+                            # No purchase_slot here, so buyers really race on the rows
+                            with transaction.atomic():
+                                ids = allocate_tickets(event, user, 1)
+                            break
+                        except OperationalError:
+                            time.sleep(0.005)  # SQLite lock contention, retry the purchase
+                    with lock:
+                        claimed.extend(ids)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(user,)) for user in buyers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(claimed), 20)
+        self.assertEqual(len(set(claimed)), 20)
+        self.assertEqual(event.tickets.filter(status='PURCHASED').count(), 20)
+        event.refresh_from_db()
+        self.assertEqual((event.available_count, event.sold_count), (0, 20))
+
+    def test_benchmark_cleans_up_after_a_failed_run(self):
+        import io
+        from unittest import mock
+        from django.core.management import call_command
+
+        with mock.patch('tickets.management.commands.benchmark_purchases.issue_tickets',
+                        side_effect=RuntimeError('benchmark failed')):
+            with self.assertRaises(RuntimeError):
+                call_command('benchmark_purchases', tickets=5, workers='2', stdout=io.StringIO())
+
+        self.assertFalse(Event.objects.exists())
+        self.assertFalse(User.objects.filter(username__startswith='bench-buyer-').exists())
+
+
+class MultiQuantityPurchaseTests(TestCase):
+    def setUp(self):
+        self.event = make_event(price=Decimal('10.00'), max_purchase_per_user=4)
+        issue_tickets(self.event, 10)
+        self.buyer = User.objects.create_user('buyer', password='pw')
+        give_credits(self.buyer, Decimal('100.00'))
+        self.client.force_login(self.buyer)
+
+    def purchase(self, quantity):
+        return self.client.post(
+            f'/purchase_ticket/{self.event.id}/',
+            data=json.dumps({'quantity': quantity}),
+            content_type='application/json',
+        )
+
+    def test_buys_several_tickets_with_one_charge(self):
+        from tickets.models import Transaction
+
+        response = self.purchase(3)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['ticket_ids']), 3)
+        self.assertEqual(self.event.tickets.filter(user=self.buyer, status='PURCHASED').count(), 3)
+        self.buyer.profile.refresh_from_db()
+        self.assertEqual(self.buyer.profile.credits, Decimal('70.00'))
+        self.assertEqual(list(Transaction.objects.filter(user=self.buyer).values_list('amount', flat=True)),
+                         [Decimal('30.00')])
+
+    def test_event_counters_are_the_last_write(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.purchase(2).status_code, 200)
+
+        writes = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertTrue(writes[-1].startswith('UPDATE "tickets_event"'), writes[-1])
+        self.assertEqual(sum(sql.startswith('UPDATE "tickets_event"') for sql in writes), 1)
+
+    def test_per_user_limit_is_enforced_across_orders(self):
+        self.assertEqual(self.purchase(3).status_code, 200)
+
+        response = self.purchase(2)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.event.tickets.filter(user=self.buyer).count(), 3)
+        self.buyer.profile.refresh_from_db()
+        self.assertEqual(self.buyer.profile.credits, Decimal('70.00'))
+
+    def test_order_larger_than_stock_is_refused_whole(self):
+        Event.objects.filter(pk=self.event.pk).update(max_purchase_per_user=20)
+        self.assertEqual(self.purchase(11).status_code, 404)
+        self.assertFalse(self.event.tickets.filter(user=self.buyer).exists())
+
+
+@override_settings(WAITING_ROOM={'ENABLED': True, 'RATE': 2.0, 'BURST': 2})
+class WaitingRoomTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.event = make_event(price=Decimal('10.00'))
+        issue_tickets(self.event, 5)
+        self.buyer = User.objects.create_user('queued', password='pw')
+        give_credits(self.buyer, Decimal('100.00'))
+        self.client.force_login(self.buyer)
+
+    def test_token_bucket_paces_admissions(self):
+        from tickets import waiting_room
+
+        for user_id in range(1, 7):
+            waiting_room.join(self.event.id, user_id)
+        self.assertEqual(waiting_room.join(self.event.id, 3), 3)  # Re-joining keeps the place
+
+        self.assertEqual(waiting_room.advance(self.event.id, now=100.0), 2)   # Burst
+        self.assertEqual(waiting_room.advance(self.event.id, now=100.25), 2)  # Half a token
+        self.assertEqual(waiting_room.advance(self.event.id, now=100.5), 3)
+        self.assertEqual(waiting_room.advance(self.event.id, now=101.0), 4)
+        self.assertEqual(waiting_room.advance(self.event.id, now=160.0), 6)   # Burst cap, then queue end
+
+    def test_purchase_requires_admission(self):
+        response = self.client.post(f'/purchase_ticket/{self.event.id}/')
+        self.assertEqual(response.status_code, 429)
+
+        joined = self.client.post(f'/waiting-room/{self.event.id}/join/').json()
+        with self.assertNumQueries(0):  # The queue ticket stands in for the session
+            status = self.client_class().get(joined['status_url'], {'ticket': joined['queue_ticket']})
+        self.assertTrue(status.json()['admitted'])
+
+        response = self.client.post(f'/purchase_ticket/{self.event.id}/',
+                                    HTTP_X_ADMISSION_PASS=status['X-Admission-Pass'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_joining_requires_a_csrf_token(self):
+        from tickets import waiting_room
+
+        client = self.client_class(enforce_csrf_checks=True)
+        client.force_login(self.buyer)
+        self.assertEqual(client.post(f'/waiting-room/{self.event.id}/join/').status_code, 403)
+        self.assertEqual(waiting_room.join(self.event.id, self.buyer.id), 1)  # No place was taken
+
+    def test_status_reports_wait_behind_frontier(self):
+        from tickets import waiting_room
+
+        for user_id in range(1000, 1010):
+            waiting_room.join(self.event.id, user_id)
+        joined = self.client.post(f'/waiting-room/{self.event.id}/join/').json()
+
+        data = self.client.get(joined['status_url'], {'ticket': joined['queue_ticket']}).json()
+
+        self.assertFalse(data['admitted'])
+        self.assertEqual(data['ahead'], 9)
+        self.assertEqual(data['estimated_wait_seconds'], 4.5)
+
+
+class TicketHoldTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.event = make_event(price=Decimal('10.00'), max_purchase_per_user=4)
+        issue_tickets(self.event, 6)
+        self.buyer = User.objects.create_user('holder', password='pw')
+        give_credits(self.buyer, Decimal('100.00'))
+        self.client.force_login(self.buyer)
+
+    def hold(self, quantity):
+        return self.client.post(f'/holds/{self.event.id}/', data=json.dumps({'quantity': quantity}),
+                                content_type='application/json')
+
+    def counters(self):
+        self.event.refresh_from_db()
+        return self.event.available_count, self.event.held_count, self.event.sold_count
+
+    def test_hold_then_confirm(self):
+        self.assertEqual(self.hold(2).status_code, 200)
+        self.assertEqual(self.counters(), (4, 2, 0))
+        self.buyer.profile.refresh_from_db()
+        self.assertEqual(self.buyer.profile.credits, Decimal('100.00'))  # Not charged yet
+
+        response = self.client.post(f'/holds/{self.event.id}/confirm/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counters(), (4, 0, 2))
+        self.buyer.profile.refresh_from_db()
+        self.assertEqual(self.buyer.profile.credits, Decimal('80.00'))
+
+    def test_holds_count_toward_purchase_limit(self):
+        self.hold(3)
+        response = self.client.post(f'/purchase_ticket/{self.event.id}/', data=json.dumps({'quantity': 2}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_sweeper_releases_expired_holds_in_batches(self):
+        from tickets.holds import release_expired_holds
+
+        self.hold(3)
+        later = timezone.now() + timedelta(hours=1)
+
+        self.assertEqual(release_expired_holds(batch_size=2, now=later), 3)
+
+        self.assertEqual(self.counters(), (6, 0, 0))
+        self.assertFalse(self.event.tickets.exclude(user=None).exists())
+        response = self.client.post(f'/holds/{self.event.id}/confirm/')
+        self.assertEqual(response.status_code, 410)
+
+    def test_sweeper_leaves_live_holds_alone(self):
+        from tickets.holds import release_expired_holds
+
+        self.hold(2)
+        self.assertEqual(release_expired_holds(), 0)
+        self.assertEqual(self.counters(), (4, 2, 0))
+
+    def test_released_holds_lose_their_stored_images(self):
+        ids = self.hold(2).json()['ticket_ids']
+        tickets = list(Ticket.objects.filter(pk__in=ids))
+        for ticket in tickets:
+            ticket.generate_qr_code()
+            ticket.save(update_fields=['qr_code'])
+        storage = tickets[0].qr_code.storage
+        self.assertTrue(all(storage.exists(ticket.qr_code.name) for ticket in tickets))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/holds/{self.event.id}/release/')
+        self.assertFalse(any(storage.exists(ticket.qr_code.name) for ticket in tickets))
+        self.assertFalse(Ticket.objects.filter(pk__in=ids).exclude(qr_code='').exists())
+
+    def test_hold_endpoints_require_a_csrf_token(self):
+        client = self.client_class(enforce_csrf_checks=True)
+        client.force_login(self.buyer)
+        for url in (f'/holds/{self.event.id}/', f'/holds/{self.event.id}/confirm/', f'/holds/{self.event.id}/release/'):
+            self.assertEqual(client.post(url).status_code, 403, url)
+        self.assertEqual(self.counters(), (6, 0, 0))
+
+    def test_released_hold_cannot_be_claimed_for_free(self):
+        from tickets.holds import release_expired_holds
+
+        freeloader = User.objects.create_user('freeloader', password='pw')
+        self.client.force_login(freeloader)
+        ticket_id = self.hold(1).json()['ticket_ids'][0]
+        code = Ticket.objects.get(pk=ticket_id).unique_code
+        self.assertEqual(self.client.get(f'/tickets/{code}/qr.svg').status_code, 403)
+        self.assertNotContains(self.client.get('/dashboard/'), code)
+
+        self.assertEqual(self.client.post(f'/holds/{self.event.id}/release/').json()['released'], 1)
+        self.client.post('/claim-ticket/', {'code': code})
+        swept_id = self.hold(1).json()['ticket_ids'][0]
+        swept_code = Ticket.objects.get(pk=swept_id).unique_code
+        release_expired_holds(now=timezone.now() + timedelta(hours=1))
+        self.client.post('/claim-ticket/', {'code': swept_code})
+
+        for ticket_id, old_code in ((ticket_id, code), (swept_id, swept_code)):
+            ticket = Ticket.objects.get(pk=ticket_id)
+            self.assertEqual((ticket.status, ticket.user_id), ('AVAILABLE', None))
+            self.assertNotEqual(ticket.unique_code, old_code)
+        self.assertFalse(Ticket.objects.filter(user=freeloader).exists())
+        self.assertEqual(self.counters(), (6, 0, 0))
+        freeloader.profile.refresh_from_db()
+        self.assertEqual(freeloader.profile.credits, Decimal('0.00'))
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.event = make_event(price=Decimal('10.00'))
+        issue_tickets(self.event, 5)
+        self.buyer = User.objects.create_user('retrier', password='pw')
+        give_credits(self.buyer, Decimal('50.00'))
+        self.client.force_login(self.buyer)
+
+    def purchase(self, key, quantity=1):
+        return self.client.post(f'/purchase_ticket/{self.event.id}/', data=json.dumps({'quantity': quantity}),
+                                content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_purchase_is_charged_once(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        first = self.purchase('checkout-1')
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.purchase('checkout-1')
+
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['ticket_ids'], first.json()['ticket_ids'])
+        touched = [q['sql'] for q in ctx.captured_queries
+                   if 'tickets_ticket' in q['sql'] or 'tickets_profile' in q['sql']]
+        self.assertEqual(touched, [])
+        self.buyer.profile.refresh_from_db()
+        self.assertEqual(self.buyer.profile.credits, Decimal('40.00'))
+        self.assertEqual(self.event.tickets.filter(user=self.buyer).count(), 1)
+
+    def test_new_key_is_a_new_purchase(self):
+        self.purchase('checkout-1')
+        self.purchase('checkout-2')
+        self.assertEqual(self.event.tickets.filter(user=self.buyer).count(), 2)
+
+    def test_key_reused_with_different_body_is_rejected(self):
+        self.purchase('checkout-1')
+        self.assertEqual(self.purchase('checkout-1', quantity=2).status_code, 422)
+
+    def test_retried_redemption_credits_once(self):
+        from tickets.models import Token
+
+        token = Token.objects.create(amount=Decimal('25.00'), expiry_date=timezone.now() + timedelta(days=1))
+        for _ in range(2):
+            response = self.client.post('/redeem-token/', {'token_code': str(token.code)},
+                                        HTTP_IDEMPOTENCY_KEY='redeem-1')
+            self.assertEqual(response.status_code, 302)
+
+        self.buyer.profile.refresh_from_db()
+        self.assertEqual(self.buyer.profile.credits, Decimal('75.00'))
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ledger', password='pw')
+        give_credits(self.user, Decimal('30.00'))
+
+    def test_debit_is_conditional_and_recorded(self):
+        from tickets import ledger
+
+        entry = ledger.debit(self.user, Decimal('20.00'))
+        self.assertEqual(entry.balance_after, Decimal('10.00'))
+
+        with self.assertRaises(ledger.InsufficientCredits):
+            ledger.debit(self.user, Decimal('10.01'))
+
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.credits, Decimal('10.00'))
+        self.assertEqual(self.user.transaction_set.count(), 1)
+
+    def test_profile_saves_never_write_credits_back(self):
+        from tickets import ledger
+
+        stale = User.objects.select_related('profile').get(pk=self.user.pk)  # Loaded before the purchase
+        ledger.debit(self.user, Decimal('20.00'))
+        stale.last_login = timezone.now()
+        stale.save()  # As on login; post_save saves the stale profile too
+        stale.profile.phone = '555'
+        stale.profile.save()
+
+        self.user.profile.refresh_from_db()
+        self.assertEqual((self.user.profile.credits, self.user.profile.phone), (Decimal('10.00'), '555'))
+
+    def test_admin_credit_edits_are_posted_to_the_ledger(self):
+        admin = User.objects.create_superuser('root', password='pw')
+        self.client.force_login(admin)
+        profile = self.user.profile
+        url = f'/admin/tickets/profile/{profile.pk}/change/'
+
+        for credits in ('45.00', '5.00'):
+            response = self.client.post(url, {
+                'user': self.user.pk, 'phone': '', 'role': profile.role, 'credits': credits,
+                'pin': '', 'otp_secret': '', 'last_otp': '', 'otp_expiry_0': '', 'otp_expiry_1': '',
+            })
+            self.assertEqual(response.status_code, 302)
+
+        profile.refresh_from_db()
+        self.assertEqual(profile.credits, Decimal('5.00'))
+        entries = self.user.transaction_set.order_by('id').values_list('transaction_type', 'amount', 'balance_after')
+        self.assertEqual(list(entries),
+                         [('ADJUSTMENT_CREDIT', Decimal('15.00'), Decimal('45.00')),
+                          ('ADJUSTMENT_DEBIT', Decimal('40.00'), Decimal('5.00'))])
+
+    def test_balance_update_leaves_other_columns_alone(self):
+        from tickets.models import Profile
+
+        stale = Profile.objects.get(user=self.user)
+        Profile.objects.filter(user=self.user).update(otp_secret='ROTATED')
+
+        self.assertTrue(stale.deduct_credits(Decimal('5.00')))
+        stale.add_credits(Decimal('1.00'))
+
+        fresh = Profile.objects.get(user=self.user)
+        self.assertEqual(fresh.otp_secret, 'ROTATED')
+        self.assertEqual(fresh.credits, Decimal('26.00'))
+        self.assertEqual(stale.credits, Decimal('26.00'))
+
+    def test_ledger_rows_are_append_only(self):
+        from tickets import ledger
+
+        entry = ledger.credit(self.user, Decimal('5.00'))
+        entry.amount = Decimal('500.00')
+        with self.assertRaises(ValueError):
+            entry.save()
+
+
+class CreditReconciliationTests(TestCase):
+    def setUp(self):
+        from tickets import ledger
+
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        ledger.credit(self.alice, Decimal('20.10'))
+        ledger.debit(self.alice, Decimal('7.35'))
+        ledger.credit(self.bob, Decimal('5.00'))
+
+    def test_balances_matching_the_ledger_pass(self):
+        from tickets.credit_reconciliation import reconcile_credits
+
+        report = reconcile_credits(chunk_size=2)
+
+        self.assertEqual(report.mismatches, [])
+        self.assertEqual(report.transactions_read, 3)
+
+    def test_drift_is_reported_in_cents(self):
+        from tickets.credit_reconciliation import reconcile_credits
+        from tickets.models import Profile
+
+        Profile.objects.filter(user=self.bob).update(credits=Decimal('6.00'))
+
+        report = reconcile_credits(chunk_size=2)
+
+        self.assertEqual(report.mismatches, [(self.bob.id, 500, 600)])
+
+    def test_purchases_during_a_run_are_not_mismatches(self):
+        from unittest import mock
+
+        from tickets import credit_reconciliation, ledger
+        from tickets.models import Profile
+
+        stream = credit_reconciliation._stream
+
+        def purchase_before_profiles(queryset, columns, chunk_size):
+            # Lands after the ledger has been summed and before balances are read
+            if queryset.model is Profile:
+                ledger.debit(self.alice, Decimal('2.00'))
+            return stream(queryset, columns, chunk_size)
+
+        with mock.patch.object(credit_reconciliation, '_stream', side_effect=purchase_before_profiles):
+            full = credit_reconciliation.reconcile_credits(chunk_size=2)
+            incremental = credit_reconciliation.reconcile_credits(incremental=True, chunk_size=2)
+
+        self.assertEqual((full.mismatches, full.users_checked), ([], 2))
+        self.assertEqual((incremental.mismatches, incremental.users_checked), ([], 1))
+
+    def test_incremental_run_only_checks_touched_users(self):
+        from tickets import ledger
+        from tickets.credit_reconciliation import reconcile_credits
+
+        reconcile_credits()
+        ledger.credit(self.bob, Decimal('1.00'))
+
+        report = reconcile_credits(incremental=True)
+
+        self.assertEqual(report.users_checked, 1)
+        self.assertEqual(report.mismatches, [])
+        self.assertEqual(reconcile_credits(incremental=True).users_checked, 0)
+
+
+@override_settings(TICKET_QR_KEYS={1: 'old-key', 2: 'new-key'}, TICKET_QR_KEY_VERSION=2)
+@without_scan_log
+class SignedQRPayloadTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.staff = User.objects.create_user('gate', password='pw', is_staff=True)
+        self.holder = User.objects.create_user('holder', password='pw')
+        self.event = make_event()
+        self.ticket = Ticket.objects.create(event=self.event, user=self.holder, status='PURCHASED')
+        self.client.force_login(self.staff)
+
+    def scan(self, code):
+        return self.client.post('/api/validate-ticket/', data=json.dumps({'code': code}),
+                                content_type='application/json')
+
+    def test_payload_round_trip(self):
+        from tickets import qr_signing
+
+        claims = qr_signing.verify(self.ticket.qr_payload())
+
+        self.assertEqual((claims.key_version, claims.event_id, claims.ticket_id, claims.code),
+                         (2, self.event.id, self.ticket.id, self.ticket.unique_code))
+
+    def test_forged_codes_are_rejected_without_queries(self):
+        from tickets import qr_signing
+
+        payload = self.ticket.qr_payload()
+        forged = payload.replace(f'.{self.ticket.id}.', f'.{self.ticket.id + 1}.')
+        retired = payload.replace('T1.2.', 'T1.9.', 1)
+
+        for code in (forged, retired, 'T1.garbage'):
+            with self.assertNumQueries(0):
+                self.assertRaises(qr_signing.InvalidPayload, qr_signing.verify, code)
+        self.assertEqual(self.scan(forged).status_code, 404)
+
+    def test_expiry_follows_the_current_event_date(self):
+        from tickets import qr_signing
+        from tickets.validation import event_summary
+
+        event_summary(self.event.id)
+        payload = self.ticket.qr_payload()  # Signed while the event was next week
+        self.event.date = timezone.now() - timedelta(days=3)
+        self.event.save()
+        self.assertEqual(self.scan(payload).json(),
+                         {'status': 'error', 'message': 'This ticket has expired.', 'audio_feedback': 'error'})
+
+        self.event.date = timezone.now() + timedelta(days=30)  # Postponed
+        self.event.save()
+        printed = qr_signing.sign(self.event.id, self.ticket.id, self.ticket.unique_code, expires_at=1)
+        self.assertTrue(self.scan(printed).json()['ticket']['is_valid'])  # Signed expiry long past
+
+    def test_valid_scan_flips_the_ticket_and_names_the_holder(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from tickets.validation import event_summary
+
+        event_summary(self.event.id)  # Warm the event cache, as after the first scan
+        payload = self.ticket.qr_payload()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.scan(payload)
+
+        self.assertTrue(response.json()['ticket']['is_valid'])
+        self.assertEqual(response.json()['ticket']['user'], 'holder')
+        ticket_queries = [q['sql'] for q in ctx.captured_queries if 'tickets_ticket' in q['sql']]
+        self.assertEqual(len(ticket_queries), 2)
+        self.assertTrue(ticket_queries[0].startswith('UPDATE'))  # No lookup before admitting
+        self.assertEqual(self.scan(payload).json()['ticket']['message'], 'This ticket has already been used.')
+
+    def test_payloads_for_rotated_codes_are_rejected(self):
+        from tickets import gate_cache
+
+        gate_cache.clear()
+        self.addCleanup(gate_cache.clear)
+        payload = self.ticket.qr_payload()
+        Ticket.objects.filter(pk=self.ticket.pk).update(unique_code='ROTATEDCODE000001')  # As on a released hold
+
+        response = self.scan(payload)
+
+        self.assertEqual((response.status_code, response.json()['message']), (404, 'Ticket not found'))
+        self.assertEqual(Ticket.objects.get(pk=self.ticket.pk).status, 'PURCHASED')
+
+    def test_codes_signed_with_previous_key_still_verify(self):
+        from tickets import qr_signing
+
+        with override_settings(TICKET_QR_KEY_VERSION=1):
+            old = self.ticket.qr_payload()
+        self.assertEqual(qr_signing.verify(old).key_version, 1)
+
+    def test_legacy_payloads_follow_the_setting(self):
+        legacy = f'Ticket ID: {self.ticket.id}, Code: {self.ticket.unique_code}'
+        with override_settings(TICKET_QR_ACCEPT_LEGACY=False):
+            self.assertEqual(self.scan(legacy).status_code, 404)
+        self.assertTrue(self.scan(legacy).json()['ticket']['is_valid'])
+
+
+@without_scan_log
+class OfflineManifestTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('scanner', password='pw')
+        self.staff.profile.role = 'staff'
+        self.staff.profile.save()
+        self.holder = User.objects.create_user('fan', password='pw')
+        self.event = make_event()
+        issue_tickets(self.event, 3)
+        self.sold = list(self.event.tickets.order_by('id')[:2])
+        Ticket.objects.filter(pk__in=[t.pk for t in self.sold]).update(
+            user=self.holder, status='PURCHASED', last_modified=timezone.now())
+        self.client.force_login(self.staff)
+
+    def test_sorted_manifest_lists_admissible_hashes(self):
+        from tickets.manifests import code_hash
+
+        response = self.client.get(f'/api/events/{self.event.id}/manifest/')
+
+        hashes = [int.from_bytes(response.content[i:i + 8], 'big') for i in range(0, len(response.content), 8)]
+        self.assertEqual(hashes, sorted(code_hash(t.unique_code) for t in self.sold))
+        cached = self.client.get(f'/api/events/{self.event.id}/manifest/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_bloom_manifest_contains_admissible_hashes(self):
+        from tickets.manifests import code_hash
+
+        response = self.client.get(f'/api/events/{self.event.id}/manifest/', {'format': 'bloom'})
+        bits, k, blob = int(response['X-Bloom-Bits']), int(response['X-Bloom-Hashes']), response.content
+
+        def contains(code):
+            value = code_hash(code)
+            h1, h2 = value >> 32, (value & 0xFFFFFFFF) | 1
+            positions = [(h1 + i * h2) % bits for i in range(k)]
+            return all(blob[p // 8] & (1 << (p % 8)) for p in positions)
+
+        self.assertTrue(all(contains(t.unique_code) for t in self.sold))
+
+    def test_delta_reports_admitted_tickets_as_removed(self):
+        from tickets.manifests import code_hash
+
+        version = int(self.client.get(f'/api/events/{self.event.id}/manifest/')['X-Manifest-Version'])
+        self.client.post('/api/validate-ticket/', data=json.dumps({'code': self.sold[0].qr_payload()}),
+                         content_type='application/json')
+
+        data = self.client.get(f'/api/events/{self.event.id}/manifest/delta/', {'since': version}).json()
+
+        self.assertIn(f'{code_hash(self.sold[0].unique_code):016x}', data['removed'])
+        self.assertGreater(data['version'], version)
+
+    def test_offline_checkins_resolve_double_entry(self):
+        first, second = self.sold
+        now = timezone.now()
+        scans = [
+            {'code': first.qr_payload(), 'scanned_at': (now - timedelta(minutes=1)).isoformat()},
+            {'code': first.qr_payload(), 'scanned_at': (now - timedelta(minutes=5)).isoformat()},
+            {'code': second.unique_code, 'scanned_at': now.isoformat()},
+            {'code': 'T1.1.2.3.NOPE.4.forged', 'scanned_at': now.isoformat()},
+        ]
+
+        response = self.client.post(f'/api/events/{self.event.id}/checkins/',
+                                    data=json.dumps({'scans': scans}), content_type='application/json')
+
+        results = [(r['result'], r['conflict']) for r in response.json()['results']]
+        self.assertEqual(results, [('duplicate', True), ('admitted', False), ('admitted', False), ('invalid', False)])
+        first.refresh_from_db()
+        self.assertEqual(first.used_at, now - timedelta(minutes=5))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.used_count, 2)
+
+    def test_offline_scans_dated_in_the_future_are_refused(self):
+        ticket = self.sold[0]
+        future = timezone.now() + timedelta(hours=2)
+
+        response = self.client.post(f'/api/events/{self.event.id}/checkins/', content_type='application/json',
+                                    data=json.dumps({'scans': [{'code': ticket.qr_payload(), 'scanned_at': future.isoformat()}]}))
+
+        self.assertEqual(response.json()['results'][0]['result'], 'invalid')
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.status, ticket.used_at), ('PURCHASED', None))
+
+    def test_checkin_uploads_must_be_json_with_a_csrf_token(self):
+        url = f'/api/events/{self.event.id}/checkins/'
+        body = json.dumps({'scans': [{'code': self.sold[0].qr_payload(), 'scanned_at': timezone.now().isoformat()}]})
+
+        self.assertEqual(self.client.post(url, data=body, content_type='text/plain').status_code, 400)
+        client = self.client_class(enforce_csrf_checks=True)
+        client.force_login(self.staff)
+        self.assertEqual(client.post(url, data=body, content_type='application/json').status_code, 403)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.used_count, 0)
+
+    def test_offline_scan_older_than_online_admission_wins(self):
+        ticket = self.sold[0]
+        self.client.post('/api/validate-ticket/', data=json.dumps({'code': ticket.qr_payload()}),
+                         content_type='application/json')
+        earlier = timezone.now() - timedelta(minutes=10)
+
+        response = self.client.post(f'/api/events/{self.event.id}/checkins/', content_type='application/json',
+                                    data=json.dumps({'scans': [{'code': ticket.qr_payload(), 'scanned_at': earlier.isoformat()}]}))
+
+        self.assertEqual(response.json()['results'][0]['result'], 'admitted')
+        self.assertTrue(response.json()['results'][0]['conflict'])
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.used_at, earlier)
+
+
+@without_scan_log
+class BatchValidationTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from tickets import gate_cache
+
+        cache.clear()
+        gate_cache.clear()
+        self.addCleanup(gate_cache.clear)
+        self.holder = User.objects.create_user('batch', password='pw')
+        self.event = make_event()
+        issue_tickets(self.event, 4)
+        self.tickets = list(self.event.tickets.order_by('id'))
+        Ticket.objects.filter(pk__in=[t.pk for t in self.tickets[:3]]).update(user=self.holder, status='PURCHASED')
+        Ticket.objects.filter(pk=self.tickets[2].pk).update(status='USED')
+        self.staff = User.objects.create_user('gatekeeper', password='pw')
+        self.staff.profile.role = 'staff'
+        self.staff.profile.save()
+        self.client.force_login(self.staff)
+
+    def validate(self, codes):
+        return self.client.post('/api/validate-tickets/', data=json.dumps({'codes': codes}),
+                                content_type='application/json')
+
+    def test_only_gate_staff_can_validate(self):
+        codes = [self.tickets[0].qr_payload()]
+        self.client.logout()
+        self.assertEqual(self.validate(codes).status_code, 403)
+        self.client.force_login(self.holder)
+        self.assertEqual(self.validate(codes).status_code, 403)
+        self.assertEqual(Ticket.objects.get(pk=self.tickets[0].pk).status, 'PURCHASED')
+
+        client = self.client_class(enforce_csrf_checks=True)
+        client.force_login(self.staff)
+        response = client.post('/api/validate-tickets/', data=json.dumps({'codes': codes}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_verdicts_in_input_order_with_one_lookup_and_one_update(self):
+        from tickets import gate_cache
+
+        a, b, used, unsold = self.tickets
+        codes = [b.qr_payload(), 'T1.1.1.1.X.1.bad', a.unique_code, used.unique_code, unsold.unique_code,
+                 a.unique_code, 'NOSUCHCODE']
+
+        gate_cache.prime(self.event.id)  # As after the event's first scan on this worker
+        # Session, user and profile for the staff check, then one IN query, one
+        # conditional UPDATE and one counter update (plus the savepoint)
+        with self.assertNumQueries(8):
+            results = self.validate(codes).json()['results']
+
+        summary = [(r['ticket']['is_valid'], r['ticket']['message']) if r['status'] == 'success'
+                   else (False, r['message']) for r in results]
+        self.assertEqual(summary, [
+            (True, 'Ticket is valid. Access granted!'),
+            (False, 'Ticket code signature is invalid'),
+            (True, 'Ticket is valid. Access granted!'),
+            (False, 'This ticket has already been used.'),
+            (False, 'This ticket has not been purchased.'),
+            (False, 'This ticket has already been used.'),
+            (False, 'Ticket not found'),
+        ])
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.used_count, 2)  # The fixture's USED ticket bypassed the counters
+
+    def test_rows_taken_by_another_scanner_are_not_admitted_twice(self):
+        from unittest import mock
+        from tickets import validation
+
+        a, b = self.tickets[:2]
+        real_update = validation.Ticket.objects.filter
+
+        def scanned_elsewhere_first(*args, **kwargs):
+            # Simulate a concurrent single scan that admits `a` just before our UPDATE
+            if args:  # The admitting UPDATE's (id, event, code) condition
+                Ticket.objects.filter(pk=a.pk).update(status='USED', used_at=timezone.now() - timedelta(seconds=1))
+            return real_update(*args, **kwargs)
+
+        with mock.patch.object(validation.Ticket.objects, 'filter', side_effect=scanned_elsewhere_first):
+            results = self.validate([a.unique_code, b.unique_code]).json()['results']
+
+        self.assertEqual([r['ticket']['is_valid'] for r in results], [False, True])
+
+
+@without_scan_log
+class GateCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from tickets import gate_cache
+
+        cache.clear()
+        gate_cache.clear()
+        self.addCleanup(gate_cache.clear)
+        self.holder = User.objects.create_user('fan', password='pw', first_name='Ada', last_name='Lovelace')
+        self.event = make_event(date=timezone.now() + timedelta(hours=1))
+        self.purchased = Ticket.objects.create(event=self.event, user=self.holder, status='PURCHASED')
+        self.used = Ticket.objects.create(event=self.event, user=self.holder, status='USED')
+
+    def scan(self, code):
+        return self.client.post('/api/validate-ticket/', data=json.dumps({'code': code}),
+                                content_type='application/json').json()
+
+    def test_repeat_scans_are_answered_from_memory(self):
+        self.scan('NOSUCHCODE')  # Any scan warms the event's cache on this worker
+        self.scan(self.used.qr_payload())
+
+        with self.assertNumQueries(0):
+            result = self.scan(self.used.qr_payload())['ticket']
+        self.assertEqual((result['is_valid'], result['user'], result['event']),
+                         (False, 'Ada Lovelace', 'Test Event'))
+
+    def test_admissions_are_written_through(self):
+        from tickets import gate_cache
+
+        gate_cache.prime(self.event.id)
+        payload = self.purchased.qr_payload()
+        self.assertTrue(self.scan(payload)['ticket']['is_valid'])
+
+        with self.assertNumQueries(0):
+            result = self.scan(payload)['ticket']
+        self.assertEqual(result['message'], 'This ticket has already been used.')
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.used_count, 2)
+
+    def test_admission_by_another_worker_is_not_repeated(self):
+        from tickets import gate_cache
+
+        gate_cache.prime(self.event.id)
+        # Another worker admits the ticket; this worker's copy still says PURCHASED
+        Ticket.objects.filter(pk=self.purchased.pk).update(status='USED')
+
+        result = self.scan(self.purchased.unique_code)['ticket']
+        self.assertEqual((result['is_valid'], result['status']), (False, 'USED'))
+
+    @override_settings(GATE_CACHE_CHECK_SECONDS=0)
+    def test_saved_changes_invalidate_every_worker(self):
+        from tickets import gate_cache
+
+        gate_cache.prime(self.event.id)
+        self.used.status = 'PURCHASED'  # Staff undo an accidental scan
+        self.used.save()
+
+        self.assertTrue(self.scan(self.used.qr_payload())['ticket']['is_valid'])
+
+    def test_events_outside_their_entry_window_are_not_cached(self):
+        from tickets import gate_cache
+
+        later = make_event(date=timezone.now() + timedelta(days=7))
+        ticket = Ticket.objects.create(event=later, user=self.holder, status='PURCHASED')
+
+        self.assertIsNone(gate_cache.lookup(later.id, ticket.unique_code))
+        self.assertTrue(self.scan(ticket.qr_payload())['ticket']['is_valid'])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+@without_scan_log
+class ScannerConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('gatekeeper', password='pw')
+        self.staff.profile.role = 'staff'
+        self.staff.profile.save()
+        self.holder = User.objects.create_user('ticketholder', password='pw')
+        self.event = make_event()
+        self.tickets = [Ticket.objects.create(event=self.event, user=self.holder, status='PURCHASED')
+                        for _ in range(3)]
+
+    def communicator(self, user, event_id=None):
+        from channels.routing import URLRouter
+        from ticketing_system.routing import websocket_urlpatterns
+
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns),
+                                             f'/ws/scanner/{event_id or self.event.id}/')
+        communicator.scope['user'] = user
+        return communicator
+
+    def test_pipelined_scans_get_verdicts_and_totals(self):
+        from asgiref.sync import async_to_sync
+
+        other_event = make_event(name='Other')
+        stranger = Ticket.objects.create(event=other_event, user=self.holder, status='PURCHASED')
+        codes = [t.qr_payload() for t in self.tickets] + [self.tickets[0].qr_payload(), stranger.qr_payload()]
+
+        async def run():
+            scanner, watcher = self.communicator(self.staff), self.communicator(self.staff)
+            self.assertTrue((await scanner.connect())[0])
+            self.assertTrue((await watcher.connect())[0])
+            hello = await watcher.receive_json_from()
+            self.assertEqual(hello['totals'], {'checked_in': 0, 'sold': 3, 'remaining': 3})
+            await scanner.receive_json_from()
+
+            for index, code in enumerate(codes):  # Sent back to back, without waiting for verdicts
+                await scanner.send_json_to({'id': index, 'code': code})
+            verdicts, totals = {}, None
+            while len(verdicts) < len(codes):
+                message = await scanner.receive_json_from(timeout=5)
+                if message['type'] == 'verdict':
+                    verdicts[message['id']] = message
+            while True:
+                message = await watcher.receive_json_from(timeout=5)
+                totals = message
+                if message['checked_in'] == 3:
+                    break
+            await scanner.disconnect()
+            await watcher.disconnect()
+            return verdicts, totals
+
+        verdicts, totals = async_to_sync(run)()
+
+        self.assertEqual([verdicts[i]['ticket']['is_valid'] for i in range(4)], [True, True, True, False])
+        self.assertEqual(verdicts[4]['message'], 'Ticket not found')
+        self.assertEqual(totals, {'type': 'totals', 'checked_in': 3, 'sold': 3, 'remaining': 0})
+        self.assertFalse(Ticket.objects.filter(pk=stranger.pk, status='USED').exists())
+
+    def test_only_staff_can_connect(self):
+        from asgiref.sync import async_to_sync
+
+        async def run():
+            connected, _ = await self.communicator(self.holder).connect()
+            return connected
+
+        self.assertFalse(async_to_sync(run)())
+
+
+@without_scan_log
+class GateBenchmarkTests(TransactionTestCase):
+    @override_settings(SCAN_LOG={'ENABLED': True, 'BACKGROUND': False})
+    def test_every_mode_admits_each_ticket_once(self):
+        import io
+        import os
+        from django.core.management import call_command
+        from tickets import scan_log
+        from tickets.models import ScanLog
+
+        self.addCleanup(scan_log.discard)
+
+        output = os.path.join(tempfile.mkdtemp(), 'gate.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        # One scanner per mode: the shared in-memory test database fails concurrent writers outright
+        call_command('benchmark_gate', tickets=30, scanners='1', batch_size=7, output=output,
+                     stdout=io.StringIO())
+
+        with open(output) as f:
+            runs = json.load(f)['runs']
+        self.assertEqual([run['mode'] for run in runs], ['single', 'batch', 'socket'])
+        for run in runs:
+            self.assertEqual((run['scans'], run['admitted'], run['double_admits'], run['used_in_database'],
+                              run['errors']), (36, 30, 0, 30, 0), run['mode'])
+        self.assertFalse(Event.objects.exists())
+        scan_log.flush()
+        self.assertFalse(ScanLog.objects.exists())  # Logged, then cleaned up with the event
+
+
+@without_scan_log
+class ValidationCoreTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from tickets import gate_cache
+
+        cache.clear()
+        gate_cache.clear()
+        self.addCleanup(gate_cache.clear)
+        self.holder = User.objects.create_user('scanned', password='pw')
+        self.event = make_event()
+        gate_cache.prime(self.event.id)
+
+    def ticket(self, status='PURCHASED'):
+        return Ticket.objects.create(event=self.event, user=self.holder, status=status)
+
+    def test_each_payload_format_takes_a_fixed_number_of_queries(self):
+        from tickets.validation import event_summary, validate_code
+
+        event_summary(self.event.id)
+        formats = {
+            # Signed: the UPDATE needs no lookup, then the holder's name is read back;
+            # a rescan finds nothing to update and looks the ticket up
+            'signed': (lambda t: t.qr_payload(), 5, 4),
+            # Legacy: one indexed lookup by unique_code, then the UPDATE (savepoint, update, counters)
+            'legacy': (lambda t: f'Ticket ID: {t.id}, Code: {t.unique_code}', 5, 1),
+            'bare': (lambda t: t.unique_code, 5, 1),
+        }
+        for name, (payload, first_scan, rescan) in formats.items():
+            code = payload(self.ticket())
+            with self.assertNumQueries(first_scan):
+                self.assertTrue(validate_code(code)['ticket']['is_valid'], name)
+            with self.assertNumQueries(rescan):
+                self.assertEqual(validate_code(code)['ticket']['message'], 'This ticket has already been used.')
+
+    def test_legacy_url_only_admits_purchased_tickets(self):
+        staff = User.objects.create_user('door', password='pw')
+        self.client.force_login(staff)
+        unsold, sold = self.ticket('AVAILABLE'), self.ticket()
+
+        response = self.client.get(f'/validate/Ticket ID: {unsold.id}, Code: {unsold.unique_code}/')
+        self.assertEqual(response.json(), {'valid': False, 'message': 'This ticket has not been purchased.'})
+        unsold.refresh_from_db()
+        self.assertEqual(unsold.status, 'AVAILABLE')
+
+        url = f'/validate/Ticket ID: {sold.id}, Code: {sold.unique_code}/'
+        self.assertEqual(self.client.get(url).json(), {'valid': True, 'event': 'Test Event', 'user': 'scanned'})
+        self.assertEqual(self.client.get(url).json(), {'valid': False, 'message': 'Ticket already used'})
+
+
+@override_settings(SCAN_LOG={'ENABLED': True, 'BACKGROUND': False})
+class ScanLogTests(TestCase):
+    def setUp(self):
+        from tickets import scan_log
+
+        scan_log.discard()
+        self.addCleanup(scan_log.discard)
+        self.holder = User.objects.create_user('logged', password='pw')
+        self.event = make_event()
+        self.sold = Ticket.objects.create(event=self.event, user=self.holder, status='PURCHASED')
+        self.unsold = Ticket.objects.create(event=self.event, status='AVAILABLE')
+
+    def scan(self, code):
+        return self.client.post('/api/validate-ticket/', data=json.dumps({'code': code}),
+                                content_type='application/json', HTTP_X_GATE='North 2')
+
+    def test_every_scan_is_logged_in_bulk_after_the_response(self):
+        from tickets import scan_log
+        from tickets.models import ScanLog
+
+        for code in (self.sold.qr_payload(), self.sold.qr_payload(), self.unsold.unique_code, 'T1.forged'):
+            self.scan(code)
+        self.assertFalse(ScanLog.objects.exists())  # Nothing written on the request path
+
+        with self.assertNumQueries(1):  # The insert; the event rows aren't touched
+            self.assertEqual(scan_log.flush(), 4)
+        rows = list(ScanLog.objects.order_by('id').values_list('result', 'ticket_id', 'event_id', 'gate', 'source'))
+        self.assertEqual(rows, [
+            ('ADMITTED', self.sold.id, self.event.id, 'North 2', 'api'),
+            ('DUPLICATE', self.sold.id, self.event.id, 'North 2', 'api'),
+            ('REJECTED', self.unsold.id, self.event.id, 'North 2', 'api'),
+            ('INVALID', None, None, 'North 2', 'api'),
+        ])
+
+    def test_flushes_refresh_scan_counts_without_a_new_version(self):
+        from django.core.cache import cache
+        from tickets import scan_log, stats
+
+        cache.clear()
+        before = stats.event_stats(self.event.id)
+        self.scan(self.unsold.unique_code)
+        with self.captureOnCommitCallbacks(execute=True):
+            scan_log.flush()
+
+        after = stats.event_stats(self.event.id)
+        self.assertEqual((after['version'], after['scans']['REJECTED']), (before['version'], 1))
+
+    def test_failed_flush_keeps_entries_for_the_next_one(self):
+        from unittest import mock
+        from tickets import scan_log
+        from tickets.models import ScanLog
+
+        self.scan(self.sold.unique_code)
+        with mock.patch.object(ScanLog.objects, 'bulk_create', side_effect=RuntimeError('database down')):
+            self.assertEqual(scan_log.flush(), 0)
+        self.assertEqual(scan_log.flush(), 1)
+        self.assertEqual(ScanLog.objects.get().result, 'ADMITTED')
+
+    def test_entries_are_append_only(self):
+        from tickets import scan_log
+        from tickets.models import ScanLog
+
+        self.scan(self.sold.unique_code)
+        scan_log.flush()
+        entry = ScanLog.objects.get()
+        entry.result = 'INVALID'
+        self.assertRaises(ValueError, entry.save)
+
+
+class ScanLogFlushThreadTests(TransactionTestCase):
+    @override_settings(SCAN_LOG={'ENABLED': True, 'FLUSH_SIZE': 3, 'FLUSH_SECONDS': 60})
+    def test_background_thread_flushes_once_the_buffer_is_full(self):
+        import time
+        from tickets import scan_log
+        from tickets.models import ScanLog
+
+        self.addCleanup(scan_log.discard)
+        scan_log.record([{'code': f'CODE{n}', 'result': 'INVALID', 'source': 'api'} for n in range(3)])
+        deadline = time.monotonic() + 5
+        while not ScanLog.objects.exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(ScanLog.objects.count(), 3)
+
+
+class DashboardQueryTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.staff = User.objects.create_user('organiser', password='pw')
+        self.staff.profile.role = 'staff'
+        self.staff.profile.save()
+        self.customer = User.objects.create_user('attendee', password='pw')
+        self.events = [make_event(name=f'Event {n}') for n in range(2)]
+        for event in self.events:
+            issue_tickets(event, 5)
+        self.clients = {}
+
+    def load(self, user, **headers):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        if user not in self.clients:
+            self.clients[user] = self.client_class()
+            self.clients[user].force_login(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.clients[user].get('/dashboard/', **headers)
+        self.assertIn(response.status_code, (200, 304))
+        return response, len(ctx.captured_queries)
+
+    def test_query_budget_does_not_grow_with_tickets_or_events(self):
+        from tickets.allocation import allocate_tickets
+
+        with self.captureOnCommitCallbacks(execute=True):
+            allocate_tickets(self.events[0], self.customer, 2)
+        for user in (self.staff, self.customer):
+            self.load(user)  # The first page view also stores the session's CSRF token
+        budgets = {user: self.load(user)[1] for user in (self.staff, self.customer)}
+        # Session, user and profile; announcements and staff numbers come from the cache
+        self.assertEqual(budgets, {self.staff: 3, self.customer: 5})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(3):
+                event = make_event(name=f'Big {n}')
+                issue_tickets(event, 200)
+            allocate_tickets(self.events[1], self.customer, 3)
+        response, queries = self.load(self.staff)
+        self.assertEqual(response.context['stats']['event_count'], 5)  # Recomputed after the changes
+        self.assertEqual({user: self.load(user)[1] for user in (self.staff, self.customer)}, budgets)
+
+    def test_staff_counts_come_from_sql(self):
+        from tickets.allocation import allocate_tickets
+
+        allocate_tickets(self.events[0], self.customer, 2)
+        response, _ = self.load(self.staff)
+
+        stats = response.context['stats']
+        self.assertEqual((stats['event_count'], stats['tickets_total'], stats['active_tickets']), (2, 10, 2))
+        self.assertEqual([event['tickets_total'] for event in response.context['events']], [5, 5])
+
+    def test_unchanged_staff_dashboard_is_not_modified(self):
+        from tickets.allocation import allocate_tickets
+
+        first, _ = self.load(self.staff)
+        repeat, _ = self.load(self.staff, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            allocate_tickets(self.events[0], self.customer, 1)
+        changed, _ = self.load(self.staff, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        self.assertEqual(changed.context['stats']['active_tickets'], 1)
+
+    def test_new_login_gets_a_page_with_its_own_csrf_token(self):
+        first, _ = self.load(self.staff)
+
+        client = self.clients[self.staff]
+        client.logout()
+        client.login(username='organiser', password='pw')
+        fresh, _ = self.load(self.staff, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh['ETag'], first['ETag'])
+        self.assertIn('Cookie', fresh['Vary'])
+
+
+@without_scan_log
+class EventStatsTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.staff = User.objects.create_user('organiser', password='pw')
+        self.staff.profile.role = 'staff'
+        self.staff.profile.save()
+        self.customer = User.objects.create_user('attendee', password='pw')
+        self.event = make_event(date=timezone.now() + timedelta(hours=1))
+        issue_tickets(self.event, 4)
+        self.client.force_login(self.staff)
+        self.url = f'/api/events/{self.event.id}/stats/'
+
+    def test_stats_and_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['stats']
+        self.assertEqual((data['issued'], data['available'], data['sold'], data['checked_in']), (4, 4, 0, 0))
+        self.assertEqual(response.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_repeat_reads_are_cache_only(self):
+        from tickets import stats
+
+        first = stats.event_stats(self.event.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.event_stats(self.event.id), first)
+
+    def test_purchase_and_validation_bump_the_version(self):
+        from tickets import stats
+        from tickets.allocation import allocate_tickets
+        from tickets.validation import validate_code
+
+        before = stats.event_stats(self.event.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket = Ticket.objects.get(pk=allocate_tickets(self.event, self.customer, 1)[0])
+        sold = stats.event_stats(self.event.id)
+        self.assertGreater(sold['version'], before['version'])
+        self.assertEqual((sold['available'], sold['sold']), (3, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            validate_code(ticket.qr_payload())
+        used = stats.event_stats(self.event.id)
+        self.assertGreater(used['version'], sold['version'])
+        self.assertEqual(used['checked_in'], 1)
+
+    def test_edits_bump_the_version_without_touching_counters(self):
+        from tickets import stats
+
+        before = stats.event_stats(self.event.id)
+        stale = Event.objects.get(pk=self.event.id)
+        Event.objects.filter(pk=self.event.id).update(sold_count=2)  # e.g. a concurrent purchase
+        with self.captureOnCommitCallbacks(execute=True):
+            stale.name = 'Renamed'
+            stale.save()
+        after = stats.event_stats(self.event.id)
+        self.assertEqual((after['name'], after['sold']), ('Renamed', 2))
+        self.assertGreater(after['version'], before['version'])
+
+    def test_falls_back_to_the_stored_snapshot(self):
+        from django.core.cache import cache
+        from tickets import stats
+
+        first = stats.event_stats(self.event.id)
+        cache.clear()
+        with self.assertNumQueries(2):  # The stored snapshot and the scan counts
+            self.assertEqual(stats.event_stats(self.event.id), first)
+
+    def test_staff_only(self):
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+class TransactionHistoryTests(TestCase):
+    def setUp(self):
+        from tickets import ledger
+        from tickets.models import Transaction
+
+        self.user = User.objects.create_user('spender', password='pw')
+        self.other = User.objects.create_user('someone', password='pw')
+        for n in range(7):
+            ledger.credit(self.user, Decimal(n + 1))
+        ledger.credit(self.other, Decimal('99.00'))
+        # Several entries in the same instant, so pages must break ties on id
+        tied = Transaction.objects.filter(user=self.user).order_by('id').values_list('id', flat=True)[2:5]
+        Transaction.objects.filter(id__in=list(tied)).update(timestamp=timezone.now())
+        self.client.force_login(self.user)
+
+    def test_keyset_pages_cover_the_history_once_newest_first(self):
+        from unittest import mock
+        from tickets.models import Transaction
+
+        seen, cursor = [], ''
+        with mock.patch('tickets.views.TRANSACTION_PAGE_SIZE', 3):
+            while True:
+                response = self.client.get('/transaction-history/', {'cursor': cursor} if cursor else {})
+                self.assertEqual(response.status_code, 200)
+                seen += [entry.id for entry in response.context['transactions']]
+                cursor = response.context['page'].next_cursor
+                if not cursor:
+                    break
+        expected = list(Transaction.objects.filter(user=self.user).order_by('-timestamp', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor_is_rejected(self):
+        self.assertEqual(self.client.get('/transaction-history/', {'cursor': 'not-a-cursor'}).status_code, 400)
+
+    def test_streamed_exports(self):
+        response = self.client.get('/transaction-history/export.csv')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,timestamp,transaction_type,amount,balance_after')
+        self.assertEqual(len(lines), 8)
+
+        response = self.client.get('/transaction-history/export.ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(sorted(row['amount'] for row in rows), [f'{n}.00' for n in range(1, 8)])
+        self.assertEqual(self.client.get('/transaction-history/export.xml').status_code, 404)
+
+
+class TokenDashboardTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from tickets.models import Token
+
+        cache.clear()
+        self.staff = User.objects.create_user('organiser', password='pw')
+        self.staff.profile.role = 'staff'
+        self.staff.profile.save()
+        now = timezone.now()
+        Token.objects.bulk_create(
+            [Token(amount=Decimal('50.00'), expiry_date=now + timedelta(days=n + 1), created_by=self.staff)
+             for n in range(5)]
+            + [Token(amount=Decimal('50.00'), expiry_date=now - timedelta(days=n + 1)) for n in range(3)]
+            + [Token(amount=Decimal('50.00'), expiry_date=now + timedelta(days=1), used=True) for n in range(2)]
+        )
+        self.client.force_login(self.staff)
+
+    def pages(self, status):
+        from unittest import mock
+
+        seen, cursor = [], None
+        with mock.patch('tickets.views.TOKEN_PAGE_SIZE', 2):
+            while True:
+                params = {'status': status, **({'cursor': cursor} if cursor else {})}
+                response = self.client.get('/token-dashboard/', params)
+                self.assertEqual(response.status_code, 200)
+                seen += response.context['tokens']
+                cursor = response.context['page'].next_cursor
+                if not cursor:
+                    return seen, response
+
+    def test_status_pages_and_counts(self):
+        tokens, response = self.pages('all')
+        self.assertEqual(len({token.id for token in tokens}), 10)
+        self.assertEqual([token.expiry_date for token in tokens],
+                         sorted((token.expiry_date for token in tokens), reverse=True))
+        self.assertEqual(response.context['counts'],
+                         {'total': 10, 'active': 5, 'used': 2, 'expired': 5,
+                          'valid_until': min(t.expiry_date for t in tokens if not t.is_expired)})
+
+        active, _ = self.pages('active')
+        self.assertEqual((len(active), any(token.is_expired for token in active)), (5, False))
+        expired, _ = self.pages('expired')
+        self.assertEqual((len(expired), all(token.is_expired for token in expired)), (5, True))
+        self.assertEqual(len(expired), response.context['counts']['expired'])  # The badge counts the list
+
+    def test_query_budget_does_not_grow_with_tokens(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from tickets.models import Token
+
+        def load():
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get('/token-dashboard/').status_code, 200)
+            return len(ctx.captured_queries)
+
+        load()  # Stores the session's CSRF token and the counts
+        budget = load()
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.bulk_create([Token(amount=Decimal('50.00'), expiry_date=timezone.now() + timedelta(days=3))
+                                       for _ in range(200)])
+        self.assertEqual(load(), budget)
+
+    def test_revoking_refreshes_the_counts(self):
+        from tickets.models import Token
+
+        self.client.get('/token-dashboard/')
+        token = Token.objects.filter(used=False, expiry_date__gt=timezone.now()).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/tokens/{token.id}/revoke/')
+        counts = self.client.get('/token-dashboard/').context['counts']
+        self.assertEqual((counts['active'], counts['expired']), (4, 6))
+
+
+class AnnouncementFeedTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from tickets.models import Announcement
+
+        cache.clear()
+        self.user = User.objects.create_user('attendee', password='pw')
+        self.soon = Announcement.objects.create(title='Doors open early', content='From 6pm', priority='HIGH',
+                                                valid_until=timezone.now() + timedelta(hours=1))
+        Announcement.objects.create(title='Open ended', content='No end date')
+        Announcement.objects.create(title='Over', content='Past', valid_until=timezone.now() - timedelta(hours=1))
+        Announcement.objects.create(title='Draft', content='Hidden', is_active=False)
+
+    def test_feed_is_cached_until_an_announcement_changes(self):
+        from tickets import announcements
+        from tickets.models import Announcement
+
+        feed = announcements.active_feed()
+        self.assertEqual({a['title'] for a in feed['announcements']}, {'Doors open early', 'Open ended'})
+        self.assertEqual(feed['valid_until'], self.soon.valid_until)
+        with self.assertNumQueries(0):
+            self.assertEqual(announcements.active_feed()['version'], feed['version'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Announcement.objects.create(title='New', content='Fresh')
+        refreshed = announcements.active_feed()
+        self.assertNotEqual(refreshed['version'], feed['version'])
+        self.assertEqual(len(refreshed['announcements']), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soon.delete()
+        self.assertEqual(len(announcements.active_feed()['announcements']), 2)
+
+    def test_feed_expires_with_its_first_announcement(self):
+        from unittest import mock
+        from tickets import announcements
+
+        feed = announcements.active_feed()
+        later = self.soon.valid_until + timedelta(seconds=1)
+        with mock.patch('tickets.announcements.timezone.now', return_value=later):
+            self.assertNotIn('Doors open early', [a['title'] for a in announcements.active_feed()['announcements']])
+        self.assertNotEqual(announcements.active_feed()['version'], feed['version'])
+
+    def test_api_conditional_get(self):
+        self.assertEqual(self.client.get('/api/announcements/feed/').status_code, 302)  # Logged-in users only
+
+        self.client.force_login(self.user)
+        response = self.client.get('/api/announcements/feed/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['announcements'][0]['priority_display'], 'High')
+        with self.assertNumQueries(2):  # Session and user; the feed comes from the cache
+            repeat = self.client.get('/api/announcements/feed/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+
+    def test_dashboard_shows_the_feed(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/dashboard/')
+        self.assertContains(response, 'Doors open early')
+        self.assertNotContains(response, 'Hidden')
@@ -14,19 +14,32 @@ from .views import (
     token_dashboard,
     validate_ticket,
     validate_ticket_api,
+    validate_tickets_batch,
+    ticket_qr,
+    event_manifest,
+    event_manifest_delta,
+    event_stats_api,
+    upload_checkins,
     ticket_validator,
     send_message,
     purchase_ticket,
+    hold_tickets,
+    confirm_hold,
+    release_hold,
+    waiting_room_join,
+    waiting_room_status,
     claim_ticket, 
     purchase_token,
     redeem_token,
     token_management,
     transaction_history,
+    export_transactions,
     add_credits_placeholder_view,
     create_announcement,
     edit_announcement,
     delete_announcement,
-    manage_announcements
+    manage_announcements,
+    announcements_api,
 )
 from django.contrib.auth.views import LogoutView
 
@@ -42,11 +55,17 @@ urlpatterns = [
     path('create-event/', create_event, name='create_event'),
     path('bulk-tickets/', bulk_create_tickets, name='bulk_create_tickets'),
     path('purchase_ticket/<int:event_id>/', purchase_ticket, name='purchase_ticket'),
+    path('holds/<int:event_id>/', hold_tickets, name='hold_tickets'),
+    path('holds/<int:event_id>/confirm/', confirm_hold, name='confirm_hold'),
+    path('holds/<int:event_id>/release/', release_hold, name='release_hold'),
+    path('waiting-room/<int:event_id>/join/', waiting_room_join, name='waiting_room_join'),
+    path('waiting-room/<int:event_id>/status/', waiting_room_status, name='waiting_room_status'),
     path('claim-ticket/', claim_ticket, name='claim_ticket'),
     path('purchase-token/', purchase_token, name='purchase_token'),
     path('redeem-token/', redeem_token, name='redeem_token'),
     path('token-management/', token_management, name='token_management'),
     path('transaction-history/', transaction_history, name='transaction_history'),
+    path('transaction-history/export.<str:fmt>', export_transactions, name='export_transactions'),
     path('token-dashboard/', token_dashboard, name='token_dashboard'),
     path('add-credits/', add_credits_placeholder_view, name='add_credits_placeholder'),
     path('tokens/<int:token_id>/revoke/', revoke_token, name='revoke_token'),
@@ -61,11 +80,18 @@ urlpatterns = [
     path('announcements/create/', create_announcement, name='create_announcement'),
     path('announcements/<int:announcement_id>/edit/', edit_announcement, name='edit_announcement'),
     path('announcements/<int:announcement_id>/delete/', delete_announcement, name='delete_announcement'),
+    path('api/announcements/feed/', announcements_api, name='announcements_api'),
     
     # API Endpoints
     path('create/<int:event_id>/', create_ticket, name='create_ticket'),
+    path('tickets/<str:code>/qr.<str:fmt>', ticket_qr, name='ticket_qr'),
     path('validate/<str:qr_data>/', validate_ticket, name='validate_ticket'),
     path('api/validate-ticket/', validate_ticket_api, name='validate_ticket_api'),
+    path('api/validate-tickets/', validate_tickets_batch, name='validate_tickets_batch'),
+    path('api/events/<int:event_id>/manifest/', event_manifest, name='event_manifest'),
+    path('api/events/<int:event_id>/manifest/delta/', event_manifest_delta, name='event_manifest_delta'),
+    path('api/events/<int:event_id>/stats/', event_stats_api, name='event_stats_api'),
+    path('api/events/<int:event_id>/checkins/', upload_checkins, name='upload_checkins'),
     # Chatbot endpoint - requires login
     path('chatbot/', login_required(send_message), name='send_message'),
 ]
\ No newline at end of file
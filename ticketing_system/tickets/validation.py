@@ -0,0 +1,298 @@
+"""
+Ticket validation core shared by every scan endpoint: ``validate_ticket_api``,
+the legacy ``validate_ticket`` URL, the batch endpoint and the scanner
+WebSocket (offline check-ins reuse ``parse_payload``).
+
+``validate_codes`` accepts any supported payload (signed ``T1.`` codes,
+``Ticket ID: X, Code: Y`` and bare codes) and needs a fixed, small number of
+queries however many codes it is given:
+
+* tickets in the gate cache (events in progress, see gate_cache.py) are
+  known without a lookup; USED ones are rejected with no query at all;
+* when every other code is signed, their ticket ids are known from the
+  signature, so they are admitted straight away; the holders' names for the
+  gate staff's check are read back for the admitted ones, and only the ones
+  that weren't admissible are looked up;
+* everything else is resolved with one ``unique_code IN (...)`` query.
+
+Signed codes are refused once their event, at its current date, is past
+``TICKET_QR_GRACE_HOURS`` (see qr_signing.py); the date comes from the gate
+cache, the lookup or the cached event summary, so this costs no query.
+
+Admission is always one conditional UPDATE (``... WHERE status =
+'PURCHASED'``) per phase. Only when another scanner got to some of those rows
+first does it re-read them to find out which ones this call admitted, so
+first-scan-wins holds across scanners and within a batch. Every scan,
+admitted or not, is queued for the scan log (see scan_log.py).
+"""
+from collections import Counter, namedtuple
+from functools import reduce
+from operator import or_
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import gate_cache, scan_log
+from .inventory import record_transition
+from .models import Event, Ticket
+from .qr_signing import InvalidPayload, expiry_at, has_expired, is_signed, parse_legacy, verify
+
+MAX_BATCH_SIZE = 500
+
+STATUS_MESSAGES = {
+    'USED': 'This ticket has already been used.',
+    'EXPIRED': 'This ticket has expired.',
+    'AVAILABLE': 'This ticket has not been purchased.',
+    'HELD': 'This ticket has not been purchased.',
+}
+ADMITTED_MESSAGE = 'Ticket is valid. Access granted!'
+
+Found = namedtuple('Found', 'ticket_id event_id code status event event_date holder expires_at')
+
+
+def _error(message):
+    return {'status': 'error', 'message': message, 'audio_feedback': 'error'}
+
+
+def _format_date(date):
+    return date.strftime('%Y-%m-%d %H:%M')
+
+
+def _summary_key(event_id):
+    return f'event-summary:{event_id}'
+
+
+def event_summary(event_id):
+    """
+    Event name, date and ticket expiry for scan results, cached so valid scans
+    skip the event query. Dropped by ``forget_event_summary`` when the event is saved.
+    """
+    summary = cache.get(_summary_key(event_id))
+    if summary is None:
+        event = Event.objects.only('name', 'date').get(pk=event_id)
+        summary = {'event': event.name, 'event_date': _format_date(event.date), 'expires_at': expiry_at(event.date)}
+        cache.set(_summary_key(event_id), summary, timeout=300)
+    return summary
+
+
+def forget_event_summary(event_id):
+    cache.delete(_summary_key(event_id))
+
+
+def _expiry_of(event_id):
+    """Cached ticket expiry of ``event_id``, ``None`` if the event is gone"""
+    try:
+        return event_summary(event_id)['expires_at']
+    except Event.DoesNotExist:
+        return None
+
+
+def parse_payload(data):
+    """
+    ``(code, ticket_id, event_id)`` of a scanned payload; the ids are ``None``
+    for legacy payloads. Raises ``InvalidPayload`` without touching the database.
+    """
+    if is_signed(data):
+        claims = verify(data)
+        return claims.code, claims.ticket_id, claims.event_id
+    code = parse_legacy(data)
+    if code is None:
+        raise InvalidPayload('Unsigned ticket codes are no longer accepted')
+    return code, None, None
+
+
+def _parse(data, event_id):
+    try:
+        code, ticket_id, claimed_event = parse_payload(data)
+    except InvalidPayload as e:
+        return _error(str(e))
+    if event_id is not None and claimed_event not in (None, event_id):
+        return _error('Ticket not found')
+    return code, ticket_id, claimed_event if claimed_event is not None else event_id
+
+
+def _cached(code, ticket_id, event_id):
+    hit = gate_cache.lookup(event_id, code) if event_id is not None else gate_cache.find(code)
+    if hit is None or (ticket_id is not None and hit[1].ticket_id != ticket_id):
+        return None
+    events, entry = hit
+    return Found(entry.ticket_id, events.event_id, code, entry.status, events.name,
+                 _format_date(events.date), entry.holder, expiry_at(events.date))
+
+
+def _holder(user_id, first, last, username):
+    return (f'{first} {last}'.strip() or username) if user_id else ''
+
+
+def _holders(ticket_ids):
+    """``ticket_id -> holder name`` for ``ticket_ids`` with one indexed query"""
+    rows = Ticket.objects.filter(id__in=ticket_ids).values_list(
+        'id', 'user_id', 'user__first_name', 'user__last_name', 'user__username'
+    )
+    return {ticket_id: _holder(*user) for ticket_id, *user in rows}
+
+
+def _lookup(codes, event_id):
+    """``code -> Found`` for ``codes`` with one indexed query"""
+    tickets = Ticket.objects.filter(unique_code__in=codes)
+    if event_id is not None:
+        tickets = tickets.filter(event_id=event_id)
+    rows = tickets.values_list('id', 'event_id', 'unique_code', 'status', 'event__name', 'event__date',
+                               'user_id', 'user__first_name', 'user__last_name', 'user__username')
+    return {
+        code: Found(ticket_id, event, code, status, name, _format_date(date),
+                    _holder(user_id, first, last, username), expiry_at(date))
+        for ticket_id, event, code, status, name, date, user_id, first, last, username in rows
+    }
+
+
+def _verdict(ticket, status, admitted):
+    return {
+        'status': 'success',
+        'ticket': {
+            'code': ticket.code,
+            'event': ticket.event,
+            'event_date': ticket.event_date,
+            'user': ticket.holder,
+            'status': status,
+            'is_valid': admitted,
+            'message': ADMITTED_MESSAGE if admitted else STATUS_MESSAGES.get(status, ''),
+            'audio_feedback': 'success' if admitted else 'error',
+        }
+    }
+
+
+def _admit(candidates):
+    """
+    Flip ``{ticket_id: (event_id, code)}`` from PURCHASED to USED in one
+    UPDATE; return the ids this call won. A row only matches with the scanned
+    code and event, so a signed payload for a code rotated since it was signed
+    (e.g. a released hold) admits nothing.
+    """
+    now = timezone.now()
+    scanned = Ticket.objects.filter(reduce(or_, (
+        Q(id=ticket_id, event_id=event_id, unique_code=code) for ticket_id, (event_id, code) in candidates.items()
+    )))
+    updated = scanned.filter(status='PURCHASED').update(status='USED', used_at=now, last_modified=now)
+    if updated == len(candidates):
+        return set(candidates)
+    if not updated:
+        return set()
+    # Another scanner admitted some of these first; ours carry this call's timestamp
+    return set(scanned.filter(status='USED', used_at=now).values_list('id', flat=True))
+
+
+def _admit_and_count(candidates):
+    """Admit ``{ticket_id: (event_id, code)}`` and update the event counters; return the ids won"""
+    if not candidates:
+        return set()
+    with transaction.atomic():
+        admitted = _admit(candidates)
+        for event_id, count in Counter(candidates[ticket_id][0] for ticket_id in admitted).items():
+            record_transition(event_id, 'PURCHASED', 'USED', count=count)
+    return admitted
+
+
+def validate_codes(codes, event_id=None, source='api', scanned_by=None, gate=''):
+    """
+    Validate and admit a batch of scanned codes. Returns one verdict per code,
+    in order. With ``event_id``, tickets for other events are not found.
+    Every scan is queued for the scan log with ``source``, ``scanned_by`` and
+    ``gate``.
+    """
+    scans = [_parse(data, event_id) for data in codes]
+    parsed = [scan for scan in scans if isinstance(scan, tuple)]
+
+    tickets = {}  # code -> Found
+    for code, ticket_id, event in parsed:
+        if code not in tickets:
+            hit = _cached(code, ticket_id, event)
+            if hit is not None:
+                tickets[code] = hit
+
+    # Admit what is known without a lookup. Signed codes only skip the lookup
+    # when nothing else needs one, so the lookup is never needed on top of it.
+    signed = {code for code, ticket_id, _ in parsed if ticket_id is not None}
+    attempted = {}  # ticket_id -> (event_id, code), in first-scan order
+    blind = all(ticket_id is not None for code, ticket_id, _ in parsed if code not in tickets)
+    for code, ticket_id, event in parsed:
+        hit = tickets.get(code)
+        if hit is not None and hit.status == 'PURCHASED' and not _expired(hit, signed):
+            attempted.setdefault(hit.ticket_id, (hit.event_id, code))
+        elif hit is None and blind:
+            expires_at = _expiry_of(event)
+            if expires_at is not None and not has_expired(expires_at):
+                attempted.setdefault(ticket_id, (event, code))
+    admitted = _admit_and_count(attempted)
+    won_blind = [ticket_id for ticket_id in admitted if attempted[ticket_id][1] not in tickets]
+    holders = _holders(won_blind) if won_blind else {}
+    for ticket_id in won_blind:
+        event, code = attempted[ticket_id]
+        tickets[code] = Found(ticket_id, event, code, 'USED', holder=holders.get(ticket_id, ''),
+                              **event_summary(event))
+
+    missing = {code for code, _, _ in parsed if code not in tickets}
+    if missing:
+        tickets.update(_lookup(missing, event_id))
+        later = {}
+        for code, _, _ in parsed:
+            ticket = tickets.get(code)
+            if ticket is not None and ticket.status == 'PURCHASED' and ticket.ticket_id not in attempted \
+                    and not _expired(ticket, signed):
+                later.setdefault(ticket.ticket_id, (ticket.event_id, code))
+        admitted |= _admit_and_count(later)
+        attempted.update(later)
+
+    for event, code in attempted.values():
+        gate_cache.mark_used(event, code)  # Admitted here or by another scanner, USED either way
+
+    verdicts, answered, log = [], set(), []
+    for data, scan in zip(codes, scans):
+        ticket, claimed_event = None, event_id
+        if isinstance(scan, tuple):
+            code, ticket_id, claimed_event = scan
+            ticket = tickets.get(code)
+            if ticket is not None and ticket_id is not None and ticket.ticket_id != ticket_id:
+                ticket = None
+            verdict = _scan_verdict(ticket, admitted, attempted, answered, _expired(ticket, signed))
+        else:
+            verdict = scan
+        verdicts.append(verdict)
+        log.append({
+            'code': data,
+            'event_id': ticket.event_id if ticket else claimed_event,
+            'ticket_id': ticket.ticket_id if ticket else None,
+            'result': scan_log.result_for(verdict),
+            'message': verdict.get('message') or verdict['ticket']['message'],
+            'source': source,
+            'gate': gate,
+            'scanned_by_id': getattr(scanned_by, 'pk', None),
+        })
+    scan_log.record(log)
+    return verdicts
+
+
+def _expired(ticket, signed):
+    """Whether ``ticket`` was scanned from a signed code and its event is over (legacy codes never expire)"""
+    return ticket is not None and ticket.code in signed and has_expired(ticket.expires_at)
+
+
+def _scan_verdict(ticket, admitted, attempted, answered, expired):
+    if ticket is None:
+        return _error('Ticket not found')
+    if ticket.ticket_id in admitted and ticket.ticket_id not in answered:
+        answered.add(ticket.ticket_id)
+        return _verdict(ticket, 'USED', True)  # Only the first scan in the batch admits
+    if expired:
+        return _error(STATUS_MESSAGES['EXPIRED'])
+    if ticket.ticket_id in attempted:
+        # Lost the UPDATE or scanned again in this batch; a PURCHASED status read before it is stale
+        return _verdict(ticket, 'USED' if ticket.status == 'PURCHASED' else ticket.status, False)
+    return _verdict(ticket, ticket.status, False)
+
+
+def validate_code(data, event_id=None, **context):
+    """Validate and admit a single scanned payload; see ``validate_codes``"""
+    return validate_codes([data], event_id, **context)[0]
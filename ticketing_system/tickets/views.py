@@ -2,12 +2,13 @@
 import logging
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils.dateparse import parse_datetime  # Add this import
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import login, authenticate
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.views import LoginView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.core import signing
 from django.contrib import messages
 from django.views.decorators.http import require_POST, require_http_methods
 from django.db import transaction, IntegrityError, models
@@ -15,6 +16,11 @@ from django.core.mail import send_mail
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.db.models import Count, Q
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.middleware.csrf import get_token
+from django.utils.crypto import salted_hmac
+from django.core.serializers.json import DjangoJSONEncoder
+import csv
 import json
 import uuid
 import binascii
@@ -28,8 +34,23 @@ from decimal import Decimal
 from .models import Token, Transaction, Announcement
 from .models import Ticket, Event, Profile, ChatMessage
 from .forms import RegisterForm, SecurePurchaseForm, AnnouncementForm
+from .issuance import issue_tickets
+from .inventory import CLAIMED_STATUSES, SOLD_STATUSES, record_transition
+from .allocation import allocate_tickets, purchase_slot
+from . import qr
+from . import validation
+from . import announcements
+from . import holds
+from . import stats
+from . import manifests
+from . import pagination
+from . import ledger
+from .idempotency import idempotent
+from . import waiting_room
 from . import chatbot_service  # Import the new service
 
+QR_MAX_AGE = 60 * 60 * 24 * 365
+
 # ========== Helper Functions ==========
 def is_staff(user):
     return hasattr(user, 'profile') and user.profile.role == 'staff'
@@ -51,7 +72,7 @@ def handle_success_response(request, ticket):
         'status': 'success',
         'ticket_id': ticket.id,
         'event_name': ticket.event.name,
-        'qr_url': ticket.qr_code.url if ticket.qr_code else None
+        'qr_url': ticket.qr_url
     }
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse(response_data)
@@ -64,6 +85,18 @@ def handle_error_response(request, error_message, status=400):
     messages.error(request, error_message)
     return redirect('dashboard')
 
+def requested_quantity(request):
+    """Ticket quantity from a JSON body or form field, defaulting to 1"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except json.JSONDecodeError:
+            raise ValueError('Invalid JSON')
+        quantity = data.get('quantity', 1) if isinstance(data, dict) else 1
+    else:
+        quantity = request.POST.get('quantity', 1)
+    return int(quantity)
+
 def send_otp_email(user, otp):
     subject = 'Your Ticket Purchase OTP'
     message = f'Your OTP for ticket purchase is: {otp}'
@@ -75,6 +108,10 @@ def send_pin_email(user, pin):
     send_mail(subject, message, 'security@eventticketmanagement.com', [user.email])
 
 # ========== Ticket Validation Views ==========
+def scanner_gate(request):
+    """Gate a scan was made at, as named by the scanner's X-Gate header (for the scan log)"""
+    return request.headers.get('X-Gate', '')[:100]
+
 @require_http_methods(["GET", "POST"])
 @csrf_exempt
 def validate_ticket_api(request):
@@ -93,49 +130,153 @@ def validate_ticket_api(request):
     
     if not qr_data:
         return JsonResponse({'status': 'error', 'message': 'No ticket code provided'}, status=400)
-    
+
+    # Forged, tampered and expired codes are rejected without a query; see validation.py
+    verdict = validation.validate_code(qr_data, scanned_by=request.user, gate=scanner_gate(request))
+    return JsonResponse(verdict, status=200 if verdict['status'] == 'success' else 404)
+
+@require_POST
+def validate_tickets_batch(request):
+    """
+    Validate up to ``validation.MAX_BATCH_SIZE`` codes at once:
+    ``{"codes": [...]}`` in, ``{"results": [...]}`` out, one verdict per code
+    in input order with the same shape as ``validate_ticket_api``. Gate staff
+    only, like the manifest and the scanner WebSocket.
+    """
+    if not is_staff(request.user):
+        return JsonResponse({'status': 'error', 'message': 'Only gate staff can validate tickets'}, status=403)
     try:
-        ticket = Ticket.objects.select_related('event', 'user').get(unique_code=qr_data)
-        now = timezone.now()
-        
-        response_data = {
-            'status': 'success',
-            'ticket': {
-                'code': ticket.unique_code,
-                'event': ticket.event.name,
-                'event_date': ticket.event.date.strftime('%Y-%m-%d %H:%M'),
-                'user': ticket.user.get_full_name() or ticket.user.username,
-                'status': ticket.status,
-                'is_valid': False,
-                'message': '',
-                'audio_feedback': 'error'  # Default to error sound
-            }
-        }
-        
-        # Check ticket status
-        if ticket.status == 'USED':
-            response_data['ticket']['message'] = 'This ticket has already been used.'
-        elif ticket.status == 'EXPIRED':
-            response_data['ticket']['message'] = 'This ticket has expired.'
-        elif ticket.status == 'AVAILABLE':
-            response_data['ticket']['message'] = 'This ticket has not been purchased.'
-        elif ticket.status == 'PURCHASED':
-            # Mark as used if valid
-            ticket.status = 'USED'
-            ticket.save(update_fields=['status', 'last_modified'])
-            response_data['ticket']['status'] = 'USED'
-            response_data['ticket']['is_valid'] = True
-            response_data['ticket']['message'] = 'Ticket is valid. Access granted!'
-            response_data['ticket']['audio_feedback'] = 'success'
-            
-        return JsonResponse(response_data)
-        
-    except Ticket.DoesNotExist:
-        return JsonResponse({
-            'status': 'error',
-            'message': 'Ticket not found',
-            'audio_feedback': 'error'
-        }, status=404)
+        codes = json.loads(request.body)['codes']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid request data'}, status=400)
+    if not isinstance(codes, list) or not all(isinstance(code, str) and code for code in codes):
+        return JsonResponse({'status': 'error', 'message': 'codes must be a list of ticket codes'}, status=400)
+    if len(codes) > validation.MAX_BATCH_SIZE:
+        return JsonResponse({'status': 'error', 'message': f'At most {validation.MAX_BATCH_SIZE} codes per request'}, status=400)
+
+    results = validation.validate_codes(codes, source='batch', scanned_by=request.user, gate=scanner_gate(request))
+    return JsonResponse({'status': 'success', 'results': results})
+
+
+@login_required
+@user_passes_test(is_staff)
+@require_http_methods(["GET"])
+def event_manifest(request, event_id):
+    """
+    Offline validation manifest for an event's gate scanners (see manifests.py).
+    ``?format=sorted`` (default) returns sorted uint64 code hashes,
+    ``?format=bloom`` a Bloom filter; ``X-Manifest-Version`` is the version to
+    ask deltas from.
+    """
+    event = get_object_or_404(Event, id=event_id)
+    fmt = request.GET.get('format', 'sorted')
+    if fmt not in manifests.FORMATS:
+        return JsonResponse({'status': 'error', 'message': f'Unknown manifest format: {fmt}'}, status=400)
+
+    etag = f'"{fmt}-{event.id}-{manifests.current_version(event)}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if fmt == 'bloom':
+            version, blob, bits, hash_count = manifests.bloom_manifest(event)
+            response = HttpResponse(blob, content_type='application/octet-stream')
+            response['X-Bloom-Bits'] = bits
+            response['X-Bloom-Hashes'] = hash_count
+        else:
+            version, blob = manifests.sorted_manifest(event)
+            response = HttpResponse(blob, content_type='application/octet-stream')
+            response['X-Manifest-Count'] = len(blob) // 8
+        response['X-Manifest-Version'] = version
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+@user_passes_test(is_staff)
+@require_http_methods(["GET"])
+def event_manifest_delta(request, event_id):
+    """Code hashes added to and removed from the manifest since ``?since=<version>``"""
+    event = get_object_or_404(Event, id=event_id)
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'since must be a manifest version'}, status=400)
+    return JsonResponse(manifests.delta(event, since))
+
+
+@login_required
+@user_passes_test(is_staff)
+@require_http_methods(["GET"])
+def event_stats_api(request, event_id):
+    """Sales, availability and check-in numbers for an event from its stats snapshot (see stats.py)"""
+    try:
+        data = stats.event_stats(event_id)
+    except Event.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Event not found'}, status=404)
+    etag = f'"stats-{event_id}-{data["version"]}-{sum(data["scans"].values())}"'  # Scans aren't versioned
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse({'status': 'success', 'stats': data})
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+@user_passes_test(is_staff)
+@require_POST
+def upload_checkins(request, event_id):
+    """
+    Check-ins recorded offline, as ``{"scans": [{"code": ..., "scanned_at": ISO 8601}, ...]}``.
+    Returns a result per scan in input order; see manifests.record_offline_scans.
+    """
+    if request.content_type != 'application/json':
+        return JsonResponse({'status': 'error', 'message': 'Check-ins must be sent as application/json'}, status=400)
+    event = get_object_or_404(Event, id=event_id)
+    try:
+        scans = [
+            {'code': str(scan['code']), 'scanned_at': parse_datetime(scan['scanned_at'])}
+            for scan in json.loads(request.body)['scans']
+        ]
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid check-in data'}, status=400)
+    if any(scan['scanned_at'] is None for scan in scans):
+        return JsonResponse({'status': 'error', 'message': 'Invalid scanned_at timestamp'}, status=400)
+    for scan in scans:
+        if timezone.is_naive(scan['scanned_at']):
+            scan['scanned_at'] = timezone.make_aware(scan['scanned_at'])
+
+    results = manifests.record_offline_scans(event, scans, scanned_by=request.user, gate=scanner_gate(request))
+    conflicts = sum(result['conflict'] for result in results)
+    if conflicts:
+        logger.warning(f"{conflicts} double entries reported in offline check-ins for Event ID: {event_id}")
+    return JsonResponse({'status': 'success', 'results': results})
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def ticket_qr(request, code, fmt):
+    """
+    Serve a ticket's QR code, rendered on demand as PNG or SVG.
+    The image only depends on the ticket's payload, so it is cached by ETag.
+    """
+    if fmt not in qr.FORMATS:
+        return HttpResponse(status=404)
+    tickets = Ticket.objects.select_related('event').only('id', 'unique_code', 'user_id', 'status', 'event__date')
+    ticket = get_object_or_404(tickets, unique_code=code)
+    # Holders only see codes they paid for; a held ticket's code must not outlive the hold
+    owned = ticket.user_id == request.user.id and ticket.status in SOLD_STATUSES
+    if not owned and not is_staff(request.user):
+        return HttpResponse(status=403)
+
+    payload = ticket.qr_payload()
+    etag = qr.etag_for(payload, fmt)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(qr.render(payload, fmt), content_type=qr.FORMATS[fmt])
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=QR_MAX_AGE, immutable=True)
+    return response
 
 # ========== Ticket Validator View ==========
 def ticket_validator(request):
@@ -149,31 +290,102 @@ def ticket_validator(request):
 def dashboard(request):
     try:
         profile = request.user.profile
-        context = {
-            'credits': profile.credits,
-            'events': Event.objects.filter(date__gte=timezone.now()).annotate(
-                available_tickets=F('ticket_count') - Count('tickets', 
-                                                            filter=Q(tickets__status='PURCHASED'))
-            ).prefetch_related('tickets'),
-            'tickets': request.user.ticket_set.filter(status='PURCHASED')
-                .select_related('event')
-                .order_by('-purchased_at'),
-            'active_tokens_count': Token.objects.filter(
-                used=False, 
-                expiry_date__gt=timezone.now()
-            ).count(),
-            'announcements': get_active_announcements()
-        }
-        template = 'staff_dashboard.html' if is_staff(request.user) else 'customer_dashboard.html'
-        return render(request, template, context)
+        feed = announcements.active_feed()
+        if not is_staff(request.user):
+            context = customer_dashboard_context(request.user)
+            context.update(credits=profile.credits, announcements=feed['announcements'])
+            return render(request, 'customer_dashboard.html', context)
+
+        context = staff_dashboard_context()
+        # Same numbers, credits and announcements render the same page, but only
+        # for the same CSRF secret: the page's forms embed a token for it, and
+        # it changes on every login
+        get_token(request)
+        csrf = salted_hmac('dashboard-etag', request.META['CSRF_COOKIE']).hexdigest()[:16]
+        etag = f'"dashboard-{request.user.id}-{context["version"]}-{profile.credits}-{feed["version"]}-{csrf}"'
+        # Flash messages are only shown once, so a page carrying them is never reused
+        response = None if len(messages.get_messages(request)) else get_conditional_response(request, etag=etag)
+        if response is None:
+            context.update(credits=profile.credits, announcements=feed['announcements'])
+            response = render(request, 'staff_dashboard.html', context)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
+        return response
 
     except Profile.DoesNotExist:
         messages.error(request, "User profile missing. Please contact support.")
         return redirect('home')
 
+
+def upcoming_events():
+    """Upcoming events with only the columns the dashboards show; counts come from the inventory counters"""
+    return Event.objects.filter(date__gte=timezone.now()).only(
+        'name', 'date', 'location', 'price', 'max_purchase_per_user',
+        'available_count', 'held_count', 'sold_count', 'used_count',
+    ).order_by('date')
+
+
+def staff_dashboard_context():
+    """
+    The versioned stats snapshot (see stats.py): one cache read while nothing
+    has changed, and a fixed number of aggregate queries when it has, however
+    many tickets the events have.
+    """
+    return dict(stats.dashboard_stats())
+
+
+def customer_dashboard_context(user):
+    return {
+        'events': upcoming_events(),
+        # HELD tickets aren't paid for yet, so their codes are never shown
+        'tickets': user.ticket_set.filter(status__in=SOLD_STATUSES).select_related('event').order_by('-purchased_at'),
+    }
+
+@login_required
+@require_POST
+def waiting_room_join(request, event_id):
+    """Take a place in the event's waiting room. Queue state lives in the cache only."""
+    position = waiting_room.join(event_id, request.user.id)
+    logger.info(f"User: {request.user.id} joined waiting room for Event ID: {event_id} at position {position}")
+    return JsonResponse({
+        'success': True,
+        'position': position,
+        'queue_ticket': waiting_room.queue_ticket(event_id, request.user.id, position),
+        'status_url': reverse('waiting_room_status', args=[event_id]),
+    })
+
+
+@require_http_methods(["GET"])
+def waiting_room_status(request, event_id):
+    """
+    Polling endpoint for queued buyers. Authenticated by the signed queue ticket
+    from ``waiting_room_join`` instead of the session, so a poll only reads the
+    cache and never loads the user from the database.
+    """
+    try:
+        ticket = waiting_room.read_queue_ticket(request.GET.get('ticket', ''))
+    except signing.BadSignature:
+        return JsonResponse({'success': False, 'error': 'Invalid or expired queue ticket.'}, status=400)
+    if ticket['e'] != event_id:
+        return JsonResponse({'success': False, 'error': 'Queue ticket is for another event.'}, status=400)
+
+    data = waiting_room.status(event_id, ticket['p'])
+    response = JsonResponse({'success': True, **data})
+    if data['admitted']:
+        admission = waiting_room.admission_pass(event_id, ticket['u'])
+        response['X-Admission-Pass'] = admission
+        response.set_cookie(f'admission_{event_id}', admission,
+                            max_age=waiting_room.config()['PASS_TTL'], httponly=True, samesite='Lax')
+    patch_cache_control(response, no_store=True)
+    return response
+
+
 @login_required
 @require_http_methods(["POST"])
 @csrf_exempt # Kept for consistency, review for security implications
+@idempotent
+@waiting_room.admission_required
 def purchase_ticket(request, event_id): # Changed ticket_id to event_id
     try:
         from .models import Ticket, Event, Transaction # Model imports
@@ -184,7 +396,12 @@ def purchase_ticket(request, event_id): # Changed ticket_id to event_id
 
         logger.info(f"Purchase attempt for Event ID: {event_id} by User: {request.user.id}")
 
-        with transaction.atomic(): # Wrap the core logic in a transaction
+        try:
+            quantity = requested_quantity(request)
+        except (TypeError, ValueError):
+            return JsonResponse({'success': False, 'error': 'Invalid ticket quantity.'}, status=400)
+
+        with purchase_slot(event_id), transaction.atomic(): # Wrap the core logic in a transaction
             try:
                 # Get the event first to ensure it exists
                 event = Event.objects.get(id=event_id)
@@ -197,46 +414,55 @@ def purchase_ticket(request, event_id): # Changed ticket_id to event_id
                 logger.warning(f"Attempt to purchase ticket for past event - Event ID: {event_id}, Event Date: {event.date}")
                 return JsonResponse({'success': False, 'error': 'This event has already passed and tickets can no longer be purchased.'}, status=400)
 
-            # Find an available ticket for this event.
-            # select_for_update() locks the selected rows until the end of the transaction to prevent race conditions.
-            ticket_to_purchase = Ticket.objects.select_for_update().filter(event=event, status='AVAILABLE').first()
+            if quantity < 1 or quantity > event.max_purchase_per_user:
+                return JsonResponse({'success': False, 'error': f'You can buy between 1 and {event.max_purchase_per_user} tickets for this event.'}, status=400)
 
-            if not ticket_to_purchase:
-                logger.warning(f"No available tickets for Event ID: {event_id} at time of purchase attempt by User: {request.user.id}")
+            # Cheap sold-out check from the inventory counter before touching ticket rows
+            if event.available_count < quantity:
+                logger.warning(f"Not enough available tickets for Event ID: {event_id} (wanted {quantity}) at time of purchase attempt by User: {request.user.id}")
                 return JsonResponse({'success': False, 'error': 'Sorry, tickets for this event are currently sold out or unavailable.'}, status=404)
-            
-            # At this point, ticket_to_purchase is the specific ticket instance we intend to sell.
-            ticket_price = event.price # Price is on the Event model
+
             user = request.user
-            profile = user.profile
-
-            if profile.credits < ticket_price:
-                logger.warning(f"Insufficient credits - User: {user.id}, Event ID: {event_id}, Available Credits: {profile.credits}, Required: {ticket_price}")
-                return JsonResponse({'success': False, 'error': 'Insufficient credits to purchase this ticket.'}, status=400)
-
-            # 1. Deduct credits from user's profile
-            profile.credits -= Decimal(str(ticket_price))
-            profile.save()
-
-            # 2. Update ticket status, assign user, set purchase time
-            ticket_to_purchase.user = user
-            ticket_to_purchase.status = 'PURCHASED'
-            ticket_to_purchase.purchased_at = timezone.now()
-            ticket_to_purchase.save() # This will also run the Ticket's save() method for QR, etc.
-
-            # 3. Create a transaction record for auditing
-            Transaction.objects.create(
-                user=user,
-                amount=ticket_price,
-                transaction_type='TICKET_PURCHASE'
-                # Consider adding a description or linking to the ticket/event if needed for detailed auditing
-            )
+            # Lock the buyer's profile so two purchases by the same user run one after the other
+            profile = Profile.objects.select_for_update().get(user=user)
+
+            # Per-user limit (holds included), counted through the (event, user) index
+            owned = Ticket.objects.filter(event=event, user=user, status__in=CLAIMED_STATUSES).count()
+            if owned + quantity > event.max_purchase_per_user:
+                logger.warning(f"Purchase limit reached - User: {user.id}, Event ID: {event_id}, Owned: {owned}, Requested: {quantity}")
+                return JsonResponse({'success': False, 'error': f'You can only buy {event.max_purchase_per_user} tickets for this event ({owned} already bought).'}, status=400)
+
+            total_price = event.price * quantity # Price is on the Event model
+
+            if profile.credits < total_price:
+                logger.warning(f"Insufficient credits - User: {user.id}, Event ID: {event_id}, Available Credits: {profile.credits}, Required: {total_price}")
+                return JsonResponse({'success': False, 'error': 'Insufficient credits to purchase these tickets.'}, status=400)
+
+            # 1. Claim the tickets. Concurrent buyers are handed different rows
+            # (see allocation.py), so a flash sale does not serialize on one ticket.
+            claimed = allocate_tickets(event, user, quantity, record=False)
+            if len(claimed) < quantity:
+                transaction.set_rollback(True)  # All or nothing: release any partial claim
+                logger.warning(f"No available tickets for Event ID: {event_id} at time of purchase attempt by User: {request.user.id}")
+                return JsonResponse({'success': False, 'error': 'Sorry, tickets for this event are currently sold out or unavailable.'}, status=404)
+
+            # 2. Charge the whole order with one conditional balance update and ledger entry
+            try:
+                entry = ledger.debit(user, total_price, 'TICKET_PURCHASE')
+            except ledger.InsufficientCredits:
+                transaction.set_rollback(True)
+                return JsonResponse({'success': False, 'error': 'Insufficient credits to purchase these tickets.'}, status=400)
+            profile.credits = entry.balance_after
 
-            logger.info(f"Purchase successful - User: {user.id}, Purchased Ticket ID: {ticket_to_purchase.id} for Event: {event.name}, New Balance: {profile.credits}")
+            # 3. Counters last: the UPDATE locks the event row every buyer needs (see allocation.py)
+            record_transition(event.id, 'AVAILABLE', 'PURCHASED', count=len(claimed))
+
+            logger.info(f"Purchase successful - User: {user.id}, Purchased Ticket IDs: {claimed} for Event: {event.name}, New Balance: {profile.credits}")
 
             return JsonResponse({
                 'success': True,
-                'message': 'Ticket purchased successfully!',
+                'message': 'Ticket purchased successfully!' if quantity == 1 else f'{quantity} tickets purchased successfully!',
+                'ticket_ids': claimed,
                 'new_balance': float(profile.credits) # Convert Decimal to float for JSON
             })
 
@@ -252,6 +478,93 @@ def purchase_ticket(request, event_id): # Changed ticket_id to event_id
             'error': 'An unexpected server error occurred. Our team has been notified.'
         }, status=500)
 
+@login_required
+@require_POST
+@waiting_room.admission_required
+def hold_tickets(request, event_id):
+    """
+    Reserve tickets for ``TICKET_HOLD_SECONDS`` while the buyer confirms.
+    Nothing is charged until ``confirm_hold``; unconfirmed holds are released
+    by ``manage.py sweep_holds``.
+    """
+    try:
+        quantity = requested_quantity(request)
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'Invalid ticket quantity.'}, status=400)
+
+    user = request.user
+    with purchase_slot(event_id), transaction.atomic():
+        event = get_object_or_404(Event, id=event_id)
+        if event.date < timezone.now():
+            return JsonResponse({'success': False, 'error': 'This event has already passed.'}, status=400)
+        if quantity < 1 or quantity > event.max_purchase_per_user:
+            return JsonResponse({'success': False, 'error': f'You can buy between 1 and {event.max_purchase_per_user} tickets for this event.'}, status=400)
+        if event.available_count < quantity:
+            return JsonResponse({'success': False, 'error': 'Sorry, tickets for this event are currently sold out or unavailable.'}, status=404)
+
+        owned = Ticket.objects.filter(event=event, user=user, status__in=CLAIMED_STATUSES).count()
+        if owned + quantity > event.max_purchase_per_user:
+            return JsonResponse({'success': False, 'error': f'You can only buy {event.max_purchase_per_user} tickets for this event ({owned} already bought or held).'}, status=400)
+
+        expires_at = holds.hold_expiry()
+        held = allocate_tickets(event, user, quantity, hold_until=expires_at)
+        if len(held) < quantity:
+            transaction.set_rollback(True)
+            return JsonResponse({'success': False, 'error': 'Sorry, tickets for this event are currently sold out or unavailable.'}, status=404)
+
+    logger.info(f"Hold placed - User: {user.id}, Event ID: {event_id}, Ticket IDs: {held}, Expires: {expires_at}")
+    return JsonResponse({
+        'success': True,
+        'ticket_ids': held,
+        'hold_expires_at': expires_at.isoformat(),
+        'total_price': float(event.price * quantity),
+    })
+
+
+@login_required
+@require_POST
+@idempotent
+def confirm_hold(request, event_id):
+    """Pay for every unexpired ticket the user holds for the event"""
+    user = request.user
+    with transaction.atomic():
+        event = get_object_or_404(Event, id=event_id)
+        profile = Profile.objects.select_for_update().get(user=user)
+        held = list(holds.active_holds(event, user).values_list('id', flat=True))
+        if not held:
+            return JsonResponse({'success': False, 'error': 'Your hold has expired. Please try again.'}, status=410)
+
+        total_price = event.price * len(held)
+        if profile.credits < total_price:
+            return JsonResponse({'success': False, 'error': 'Insufficient credits to purchase these tickets.'}, status=400)
+
+        try:
+            profile.credits = ledger.debit(user, total_price, 'TICKET_PURCHASE').balance_after
+        except ledger.InsufficientCredits:
+            transaction.set_rollback(True)
+            return JsonResponse({'success': False, 'error': 'Insufficient credits to purchase these tickets.'}, status=400)
+
+        # Last, as it updates the event's counters (see allocation.py)
+        if holds.confirm_holds(event, user, held) < len(held):
+            transaction.set_rollback(True)  # A hold expired between the read and the update
+            return JsonResponse({'success': False, 'error': 'Your hold has expired. Please try again.'}, status=410)
+
+    logger.info(f"Hold confirmed - User: {user.id}, Event ID: {event_id}, Ticket IDs: {held}, New Balance: {profile.credits}")
+    return JsonResponse({
+        'success': True,
+        'message': f'{len(held)} ticket(s) purchased successfully!',
+        'ticket_ids': held,
+        'new_balance': float(profile.credits),
+    })
+
+
+@login_required
+@require_POST
+def release_hold(request, event_id):
+    event = get_object_or_404(Event, id=event_id)
+    released = holds.release_holds(event, request.user)
+    return JsonResponse({'success': True, 'released': released})
+
 logger = logging.getLogger(__name__)
 
 # ========== Ticket Management Views ==========
@@ -265,14 +578,17 @@ def claim_ticket(request):
 
     try:
         with transaction.atomic():
+            # Only unowned AVAILABLE tickets; held ones get a new code when released (see holds.py)
             ticket = Ticket.objects.select_for_update().get(
-                unique_code=code, 
-                user__isnull=True
+                unique_code=code,
+                user__isnull=True,
+                status='AVAILABLE'
             )
+            previous_status = ticket.status
             ticket.user = request.user
             ticket.status = 'PURCHASED'
-            ticket.generate_qr_code()
             ticket.save()
+            record_transition(ticket.event_id, previous_status, 'PURCHASED')
             return handle_success_response(request, ticket)
 
     except Ticket.DoesNotExist:
@@ -282,23 +598,15 @@ def claim_ticket(request):
 
 @login_required
 def validate_ticket(request, qr_data):
-    try:
-        ticket_id = int(qr_data.split("Ticket ID: ")[1].split(",")[0])
-        ticket = Ticket.objects.get(id=ticket_id)
-        
-        if ticket.status == 'USED':
-            return JsonResponse({'valid': False, 'message': 'Ticket already used'})
-        
-        ticket.status = 'USED'
-        ticket.save()
-        return JsonResponse({
-            'valid': True, 
-            'event': ticket.event.name,
-            'user': ticket.user.username
-        })
-        
-    except (ValueError, IndexError, Ticket.DoesNotExist):
+    verdict = validation.validate_code(qr_data, source='url', scanned_by=request.user, gate=scanner_gate(request))
+    if verdict['status'] != 'success':
         return JsonResponse({'valid': False, 'message': 'Invalid ticket'})
+    ticket = verdict['ticket']
+    if ticket['is_valid']:
+        return JsonResponse({'valid': True, 'event': ticket['event'], 'user': ticket['user']})
+    if ticket['status'] == 'USED':
+        return JsonResponse({'valid': False, 'message': 'Ticket already used'})
+    return JsonResponse({'valid': False, 'message': ticket['message']})
 
 @login_required
 @user_passes_test(is_staff)
@@ -312,30 +620,14 @@ def bulk_create_tickets(request):
             return handle_error_response(request, 
                 f"Cannot create more tickets than available ({event.ticket_count})")
 
-        created_count = 0
-        with transaction.atomic():
-            event = Event.objects.select_for_update().get(id=event_id)
-            for _ in range(quantity):
-                try:
-                    # Create a new Ticket instance
-                    new_ticket = Ticket(
-                        event=event,
-                        # unique_code will be generated by the Ticket's save() method if not provided,
-                        # or we can continue to generate it here if preferred.
-                        # For consistency with previous behavior, let's keep generating it here for now.
-                        unique_code=uuid.uuid4().hex[:17].upper()
-                        # Status will default to 'AVAILABLE' as per model definition
-                    )
-                    # Call the save method, which includes QR code generation and other logic
-                    new_ticket.save()
-                    logger.info(f"Successfully created Ticket ID: {new_ticket.id}, Status: {new_ticket.status}, Event ID: {event.id}, QR: {new_ticket.qr_code.name if new_ticket.qr_code else 'No QR'}")
-                    created_count += 1
-                except IntegrityError as e:
-                    logger.error(f"IntegrityError while creating ticket for event {event.id}: {e}")
-                    continue
-                except Exception as e:
-                    logger.error(f"Unexpected error while creating ticket for event {event.id}: {e}", exc_info=True)
-                    continue
+        # Tickets are inserted in chunks, each committed on its own, so purchases
+        # for this event are not blocked for the whole run. QR images are rendered
+        # later (on purchase/claim) rather than once per inserted row.
+        try:
+            created_count = issue_tickets(event, quantity)
+        except IntegrityError as e:
+            logger.error(f"IntegrityError while issuing tickets for event {event.id}: {e}")
+            return handle_error_response(request, "Ticket creation failed, please try again")
 
         messages.success(request, f"Created {created_count} tickets!")
         return redirect('dashboard')
@@ -573,14 +865,11 @@ def create_ticket(request, event_id):
         event = get_object_or_404(Event, id=event_id)
         ticket = Ticket.objects.create(
             user=request.user,
-            event=event,
-            unique_code=uuid.uuid4().hex[:17].upper()
+            event=event
         )
-        ticket.generate_qr_code()
-        ticket.save()
         return JsonResponse({
             'ticket_id': ticket.id,
-            'qr_code_url': ticket.qr_code.url,
+            'qr_code_url': ticket.qr_url,
             'event': ticket.event.name
         })
     
@@ -600,6 +889,7 @@ def purchase_token(request):
 
 @login_required
 @require_POST
+@idempotent
 def redeem_token(request):
     code = request.POST.get('token_code', '').strip()
     
@@ -610,16 +900,8 @@ def redeem_token(request):
                 used=False,
                 expiry_date__gt=timezone.now()  # Check expiration
             )
-            profile = request.user.profile
-            profile.credits += token.amount
-            profile.save()
-            
-            # Create transaction record
-            Transaction.objects.create(
-                user=request.user,
-                amount=token.amount,
-                transaction_type='REDEMPTION'
-            )
+            # Balance update and ledger entry in one step
+            ledger.credit(request.user, token.amount, 'REDEMPTION')
             
             token.used = True
             token.used_by = request.user
@@ -653,30 +935,93 @@ def token_management(request):
     active_tokens = Token.objects.filter(used=False, expiry_date__gt=timezone.now())
     return render(request, 'token_management.html', {'active_tokens': active_tokens})
 
+TRANSACTION_PAGE_SIZE = 50
+TRANSACTION_KEY = ('timestamp', 'id')
+TRANSACTION_EXPORT_FIELDS = ('id', 'timestamp', 'transaction_type', 'amount', 'balance_after')
+
+
 @login_required
 def transaction_history(request):
-    transactions = Transaction.objects.filter(user=request.user).order_by('-timestamp')
-    return render(request, 'transaction_history.html', {'transactions': transactions})
+    """Newest first, one keyset page at a time (see pagination.py)"""
+    transactions = Transaction.objects.filter(user=request.user).only(
+        'timestamp', 'transaction_type', 'amount', 'balance_after'
+    )
+    try:
+        page = pagination.keyset_page(transactions, TRANSACTION_KEY, request.GET.get('cursor'),
+                                      size=TRANSACTION_PAGE_SIZE)
+    except pagination.InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
+    return render(request, 'transaction_history.html', {'transactions': page.items, 'page': page})
+
+
+class Echo:
+    """File-like object whose ``write`` returns what it was given, for csv.writer in streamed responses"""
+    def write(self, value):
+        return value
+
+
+def stream_transactions(rows, fmt):
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(TRANSACTION_EXPORT_FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(TRANSACTION_EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+@login_required
+@require_http_methods(["GET"])
+def export_transactions(request, fmt):
+    """
+    The user's whole transaction history as CSV or NDJSON (one object per
+    line), newest first. Rows are streamed from a server-side cursor in
+    chunks, so memory use doesn't depend on the length of the history.
+    """
+    if fmt not in ('csv', 'ndjson'):
+        return HttpResponse(status=404)
+    rows = Transaction.objects.filter(user=request.user).order_by('-timestamp', '-id').values_list(
+        *TRANSACTION_EXPORT_FIELDS
+    ).iterator(chunk_size=2000)
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(stream_transactions(rows, fmt), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="transactions.{fmt}"'
+    patch_cache_control(response, private=True, no_store=True)
+    return response
 
 from django.utils.dateparse import parse_datetime  # Add this import
 
+TOKEN_PAGE_SIZE = 50
+TOKEN_KEY = ('expiry_date', 'id')
+
+
+def token_status_filter(status, now):
+    """``Q`` for the tokens shown under a status filter; both are ranges of ``token_status_idx``"""
+    if status == 'active':
+        return Q(used=False, expiry_date__gt=now)
+    if status == 'expired':
+        return Q(used=True) | Q(used=False, expiry_date__lte=now)
+    return Q()
+
+
 @login_required
 @user_passes_test(is_staff)
 def token_dashboard(request):
+    """
+    Tokens one keyset page at a time, latest expiry first (see pagination.py),
+    with per-status totals from the stats cache (see stats.token_counts).
+    """
     status = request.GET.get('status', 'all')
-    
-    # Always return a QuerySet
-    tokens = Token.objects.annotate(
-    is_expired=models.ExpressionWrapper(
-        Q(expiry_date__lt=timezone.now()) | Q(used=True),
-        output_field=models.BooleanField()
+    if status not in ('all', 'active', 'expired'):
+        status = 'all'
+    now = timezone.now()
+    tokens = Token.objects.filter(token_status_filter(status, now)).select_related('created_by').annotate(
+        is_expired=models.ExpressionWrapper(
+            Q(expiry_date__lte=now) | Q(used=True),
+            output_field=models.BooleanField()
+        )
     )
-)
-
-    if status == 'active':
-        tokens = tokens.filter(expiry_date__gt=timezone.now(), used=False)
-    elif status == 'expired':
-        tokens = tokens.filter(Q(expiry_date__lt=timezone.now()) | Q(used=True))
 
     # Handle POST requests
     if request.method == 'POST':
@@ -697,9 +1042,14 @@ def token_dashboard(request):
             messages.error(request, f"Error creating token: {str(e)}")
             return redirect('token_dashboard')  # Ensure return
 
-    # Always return HttpResponse for GET
+    try:
+        page = pagination.keyset_page(tokens, TOKEN_KEY, request.GET.get('cursor'), size=TOKEN_PAGE_SIZE)
+    except pagination.InvalidCursor:
+        return HttpResponseBadRequest('Invalid cursor')
     return render(request, 'token_dashboard.html', {
-        'tokens': tokens,
+        'tokens': page.items,
+        'page': page,
+        'counts': stats.token_counts(),
         'current_status': status
     })
 @login_required
@@ -798,9 +1148,23 @@ def manage_announcements(request):
     })
 
 def get_active_announcements():
-    """Helper function to get active announcements"""
-    now = timezone.now()
-    return Announcement.objects.filter(
-        is_active=True,
-        valid_until__gt=now
-    ).order_by('-priority', '-created_at')
\ No newline at end of file
+    """Active announcements as plain dicts, from the cached feed (see announcements.py)"""
+    return announcements.active_feed()['announcements']
+
+
+@login_required
+@require_http_methods(["GET"])
+def announcements_api(request):
+    """
+    The active announcement feed for dashboards to poll. Served from the cache
+    with an ETag, so an unchanged feed is a 304 without reading announcements.
+    """
+    feed = announcements.active_feed()
+    etag = f'"announcements-{feed["version"]}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse({'status': 'success', 'version': feed['version'],
+                                 'announcements': feed['announcements']})
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+Virtual waiting room for flash sales.
+
+When ``WAITING_ROOM['ENABLED']`` is set, buyers have to join an event's queue
+before ``purchase_ticket`` will accept them. Joining hands out a position
+(an atomic ``cache.incr``) and a signed queue ticket. Admission is paced by a
+token bucket: tokens refill at ``RATE`` per second up to ``BURST``, and each
+token moves the admission frontier forward by one position. Once a buyer's
+position is behind the frontier the status endpoint returns a signed
+admission pass, which the purchase view checks.
+
+All queue state lives in the cache, never in the database, and the status
+endpoint is authenticated by the signed queue ticket rather than the session. Use a shared cache
+backend (Redis, Memcached) when running more than one worker process.
+"""
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.urls import reverse
+
+DEFAULTS = {
+    'ENABLED': False,
+    'RATE': 5.0,          # admissions per second
+    'BURST': 20,          # admissions that can be granted at once after a quiet spell
+    'PASS_TTL': 600,      # seconds an admission pass stays valid
+    'QUEUE_TTL': 6 * 3600,
+}
+
+QUEUE_SALT = 'tickets.waiting_room.queue'
+PASS_SALT = 'tickets.waiting_room.pass'
+PASS_HEADER = 'HTTP_X_ADMISSION_PASS'
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, 'WAITING_ROOM', {})}
+
+
+def _key(event_id, name):
+    return f'waiting_room:{event_id}:{name}'
+
+
+def join(event_id, user_id):
+    """
+    Put a user in the event's queue and return their position. Joining again
+    returns the position the user already holds.
+    """
+    ttl = config()['QUEUE_TTL']
+    user_key = _key(event_id, f'user:{user_id}')
+    position = cache.get(user_key)
+    if position is not None:
+        return position
+
+    tail_key = _key(event_id, 'tail')
+    cache.add(tail_key, 0, timeout=ttl)
+    position = cache.incr(tail_key)
+    if not cache.add(user_key, position, timeout=ttl):
+        position = cache.get(user_key, position)  # A concurrent join by the same user won
+    return position
+
+
+def advance(event_id, now=None):
+    """
+    Refill the token bucket and admit as many queued positions as it allows.
+    Only one caller at a time does the work; everyone else reads the frontier.
+    Returns the highest admitted position.
+    """
+    conf = config()
+    frontier_key = _key(event_id, 'frontier')
+    lock_key = _key(event_id, 'lock')
+    if not cache.add(lock_key, 1, timeout=5):
+        return cache.get(frontier_key, 0)
+
+    try:
+        now = time.time() if now is None else now
+        bucket_key = _key(event_id, 'bucket')
+        state = cache.get_many([bucket_key, frontier_key, _key(event_id, 'tail')])
+        tokens, refilled_at = state.get(bucket_key, (conf['BURST'], now))
+        frontier = state.get(frontier_key, 0)
+        tail = state.get(_key(event_id, 'tail'), 0)
+
+        tokens = min(conf['BURST'], tokens + (now - refilled_at) * conf['RATE'])
+        admitted = min(int(tokens), tail - frontier)
+        if admitted > 0:
+            frontier += admitted
+            tokens -= admitted
+        cache.set_many({bucket_key: (tokens, now), frontier_key: frontier}, timeout=conf['QUEUE_TTL'])
+        return frontier
+    finally:
+        cache.delete(lock_key)
+
+
+def queue_ticket(event_id, user_id, position):
+    return signing.dumps({'e': event_id, 'u': user_id, 'p': position}, salt=QUEUE_SALT, compress=True)
+
+
+def read_queue_ticket(value):
+    return signing.loads(value, salt=QUEUE_SALT, max_age=config()['QUEUE_TTL'])
+
+
+def admission_pass(event_id, user_id):
+    return signing.dumps({'e': event_id, 'u': user_id}, salt=PASS_SALT, compress=True)
+
+
+def has_admission(request, event_id):
+    value = request.META.get(PASS_HEADER) or request.COOKIES.get(f'admission_{event_id}')
+    if not value:
+        return False
+    try:
+        data = signing.loads(value, salt=PASS_SALT, max_age=config()['PASS_TTL'])
+    except signing.BadSignature:
+        return False
+    return data.get('e') == event_id and data.get('u') == request.user.id
+
+
+def status(event_id, position):
+    """Queue status for a position; cheap enough to poll (cache reads only)"""
+    conf = config()
+    frontier = advance(event_id)
+    ahead = max(0, position - frontier)
+    return {
+        'position': position,
+        'admitted_through': frontier,
+        'ahead': ahead,
+        'admitted': ahead == 0,
+        'estimated_wait_seconds': round(ahead / conf['RATE'], 1) if conf['RATE'] else None,
+    }
+
+
+def admission_required(view_func):
+    """
+    Refuse purchases from buyers without a valid admission pass while the
+    waiting room is enabled.
+    """
+    @wraps(view_func)
+    def wrapper(request, event_id, *args, **kwargs):
+        if config()['ENABLED'] and not has_admission(request, event_id):
+            return JsonResponse({
+                'success': False,
+                'error': 'This sale is busy. Please join the waiting room.',
+                'waiting_room': reverse('waiting_room_join', args=[event_id]),
+            }, status=429)
+        return view_func(request, event_id, *args, **kwargs)
+    return wrapper